@@ -6,15 +6,22 @@ this is the file that is executed. This file works as traffic cop that directs t
 application to the correct entry point.  It allows you to launch the GUI, or to do 
 something simple from the command line.
 
+To process many files without the GUI, start the command line with the word batch
+(see a6batch for the other arguments). To time the image operations, start it with
+the word bench (see a6bench).
+
+Only the GUI imports Kivy, and PIL and NumPy are not imported until an image needs
+them, so that the command line tools start quickly. To see where the startup time
+goes, add the option --startup-profile to any command line.
+
 Author: Walker M. White (wmw2)
 Date:   October 29, 2019
 """
-# To handle command line options
-import argparse
+# The option that reports the import time of each module (see profile)
+PROFILE = '--startup-profile'
 
-# This is necessary to prevent conflicting command line arguments
-import os
-os.environ["KIVY_NO_ARGS"] = "1"
+# The number of modules to list in the startup profile
+PROFILE_SIZE = 20
 
 
 def parse():
@@ -24,10 +31,12 @@ def parse():
     This function uses argparse to handle the command line arguments.  The benefit of
     argparse is the built-in error checking and help menu.
     """
+    import argparse
     parser = argparse.ArgumentParser(prog='imager',description='Application to process an image file.')
     parser.add_argument('image', type=str, nargs='?', help='the image file to process')
     parser.add_argument('-t','--test',   action='store_true',  help='run a unit test on Image and Editor')
     parser.add_argument('-g','--grade',   action='store_true', help='grade the assignment')
+    parser.add_argument(PROFILE, action='store_true', help='report the import time of each module')
     return parser.parse_args()
 
 
@@ -41,6 +50,10 @@ def launch(image):
     Parameter output: The output file for saving any changes
     Precondition: output is a filename string or None
     """
+    # This is necessary to prevent conflicting command line arguments
+    import os
+    os.environ["KIVY_NO_ARGS"] = "1"
+    
     from interface import launch
     launch(image)
 
@@ -53,6 +66,70 @@ def unittest():
     test_all()
 
 
+def batch(argv):
+    """
+    Runs the batch command, and returns its exit status.
+    
+    Parameter argv: The command line arguments after the word 'batch'
+    Precondition: argv is a list of strings
+    """
+    from a6batch import main
+    return main(argv)
+
+
+def bench(argv):
+    """
+    Runs the bench command, and returns its exit status.
+    
+    Parameter argv: The command line arguments after the word 'bench'
+    Precondition: argv is a list of strings
+    """
+    from a6bench import main
+    return main(argv)
+
+
+def profile(argv):
+    """
+    Runs the application in a new process, and reports the import time of each module.
+    
+    The new process is a cold start of Python with the option -X importtime. Its
+    output is shown as usual, followed by the total time of the process, the time
+    spent importing, and the top-level imports that took the longest. The time of
+    each includes the modules that it imported. The result is the exit status of
+    the process.
+    
+    Parameter argv: The command line arguments, without the option --startup-profile
+    Precondition: argv is a list of strings
+    """
+    import subprocess
+    import sys
+    import time
+    start = time.perf_counter()
+    process = subprocess.run([sys.executable,'-X','importtime',__file__]+argv,
+                             stderr=subprocess.PIPE,universal_newlines=True)
+    elapsed = time.perf_counter()-start
+    
+    # Each line is 'import time: self | cumulative | name', with name indented by depth
+    modules = []
+    imported = 0
+    for line in process.stderr.splitlines():
+        if not line.startswith('import time:'):
+            print(line,file=sys.stderr)
+        elif not line.endswith('imported package'):
+            own, total, name = line[len('import time:'):].split('|')
+            imported += int(own)
+            if name[1] != ' ':
+                modules.append((int(total),int(own),name.strip()))
+    
+    print()
+    print('Startup profile of imager %s' % ' '.join(argv))
+    print('%.1f ms in all, %.1f ms importing' % (1000*elapsed,imported/1000))
+    print('%10s %10s  %s' % ('total ms','self ms','module'))
+    for total, own, name in sorted(modules,reverse=True)[:PROFILE_SIZE]:
+        print('%10.1f %10.1f  %s' % (total/1000,own/1000,name))
+    return process.returncode
+
+
 def grade(image):
     """
     Grades the assignment.
@@ -71,6 +148,14 @@ def execute():
     """
     Executes the application, according to the command line arguments specified.
     """
+    import sys
+    if PROFILE in sys.argv[1:]:
+        sys.exit(profile([arg for arg in sys.argv[1:] if arg != PROFILE]))
+    if sys.argv[1:2] == ['batch']:
+        sys.exit(batch(sys.argv[2:]))
+    if sys.argv[1:2] == ['bench']:
+        sys.exit(bench(sys.argv[2:]))
+    
     args = parse()
     
     image = args.image
@@ -83,5 +168,6 @@ def execute():
     else:
         launch(image)
 
-# Do it
-execute()
\ No newline at end of file
+# Do it (but not in the worker processes of a6filter, which import this module)
+if __name__ == '__main__':
+    execute()
\ No newline at end of file
@@ -0,0 +1,384 @@
+"""
+Batch processing for the imager application.
+
+This module applies a list of operations (the methods of Encoder that change
+the image) to many image files, without the GUI. It is the 'batch' command
+of the application, as in
+
+    python imager batch 'photos/*.jpg' antique -o monochromify:True -o vignette
+
+which makes a sepia, vignetted copy of every JPEG in photos, in the folder
+antique. Each operation is the name of a method, followed by a colon and its
+arguments, separated by commas. The arguments are Python literals; if they
+are not, all of the text after the colon is a single string argument (so
+encode:hello, world hides the text 'hello, world').
+
+The files are processed by a pool of worker processes. Each worker handles
+one file at a time, and no more than two files per worker are waiting in the
+pool, so the memory used is bounded by the number of workers. A file is
+skipped if its output is newer than it and was made by the same operations
+and backend (unless forced); each output records a hash of these (its recipe)
+in a PNG text chunk. The output is always a PNG file, as other formats could
+lose the pixels of encoded messages, so inputs with the same name and
+different suffixes (such as a.jpg and a.png) are refused.
+
+Author: Adam Kadhim (ak779) and Calvin Johnson (clj78)
+Date:   November 20, 2019
+"""
+
+# The suffixes of the files found in an input folder
+SUFFIXES = ('.png', '.jpg', '.jpeg', '.bmp', '.gif', '.tif', '.tiff')
+
+# The zlib level of the PNG outputs (0..9); 1 is about three times faster than
+# the usual 6, for files that are up to 10% larger
+COMPRESSION = 1
+
+# The PNG text chunk that holds the recipe of an output (see recipe)
+RECIPE = 'imager-recipe'
+
+
+def parse_op(text):
+    """
+    Returns the operation (name, args) for the given command line text.
+
+    The text is a method name, optionally followed by a colon and arguments
+    separated by commas. If the arguments are all Python literals, they are
+    converted to their values. Otherwise, the text after the colon is kept as
+    a single string argument, commas and spaces included. The method must be
+    one of the journaled methods of Encoder (see a6editor.journaled).
+
+    Parameter text: The operation text
+    Precondition: text is a string
+    """
+    import ast
+    import a6encode
+    assert type(text) == str, repr(text)+' is not a string'
+    name, colon, rest = text.partition(':')
+    method = getattr(a6encode.Encoder,name,None)
+    if name.startswith('_') or not hasattr(method,'__wrapped__'):
+        raise ValueError(repr(name)+' is not an image operation')
+
+    if not colon:
+        return (name, ())
+    try:
+        args = ast.literal_eval('('+rest+',)')
+    except (ValueError, SyntaxError, TypeError, MemoryError, RecursionError):
+        args = None
+    return (name, args if type(args) == tuple else (rest,))
+
+
+def find_inputs(source):
+    """
+    Returns the sorted list of image files for the given source.
+
+    If source is a folder, the result is the files in it with one of the
+    SUFFIXES. Otherwise, source is a glob pattern.
+
+    Parameter source: A folder or a glob pattern
+    Precondition: source is a string
+    """
+    import glob
+    import os.path
+    if os.path.isdir(source):
+        files = [os.path.join(source,name) for name in os.listdir(source)
+                 if os.path.splitext(name)[1].lower() in SUFFIXES]
+    else:
+        files = glob.glob(source)
+    return sorted(file for file in files if os.path.isfile(file))
+
+
+def output_path(file, folder):
+    """
+    Returns the output file for the given input file.
+
+    The output has the same name in folder, with the suffix .png.
+
+    Parameter file: The input file
+    Precondition: file is a string
+
+    Parameter folder: The output folder
+    Precondition: folder is a string
+    """
+    import os.path
+    name = os.path.splitext(os.path.split(file)[1])[0]
+    return os.path.join(folder,name+'.png')
+
+
+def recipe(ops, backend=None):
+    """
+    Returns the recipe of the given operations and backend, as a hex string.
+
+    The recipe is a hash of the operations and the backend used to apply
+    them. It is stored in each output, so that a batch only skips outputs
+    that were made the same way.
+
+    Parameter ops: The operations to apply
+    Precondition: ops is a list of pairs (name, args) (see parse_op)
+
+    Parameter backend: The storage format for the image (None for the preferred one)
+    Precondition: backend is None or one of a6image.BACKENDS
+    """
+    import hashlib
+    import a6image
+    backend = a6image.preferred_backend() if backend is None else backend
+    text = repr(([(name,tuple(args)) for name, args in ops],backend))
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def read_recipe(file):
+    """
+    Returns the recipe stored in the given output file, or None if it has none.
+
+    The result is also None if the file cannot be read as an image.
+
+    Parameter file: The output file
+    Precondition: file is a string
+    """
+    from PIL import Image as CoreImage
+    try:
+        with CoreImage.open(file) as image:
+            return image.info.get(RECIPE)
+    except (OSError, ValueError):
+        return None
+
+
+def collisions(files, folder):
+    """
+    Returns the groups of input files that would have the same output file.
+
+    Each group is a sorted list of two or more files (such as a.jpg and
+    a.png), and the groups are sorted as well. Outputs are compared as the
+    file system would, so A.jpg and a.png collide on Windows.
+
+    Parameter files: The input files
+    Precondition: files is a list of strings
+
+    Parameter folder: The output folder
+    Precondition: folder is a string
+    """
+    import os.path
+    groups = {}
+    for file in files:
+        groups.setdefault(os.path.normcase(output_path(file,folder)),[]).append(file)
+    return sorted(sorted(group) for group in groups.values() if len(group) > 1)
+
+
+def load(file, backend=None):
+    """
+    Returns the Image for the given file.
+
+    Parameter file: The image file
+    Precondition: file is a string naming an image file that PIL can read
+
+    Parameter backend: The storage format for the image (None for the preferred one)
+    Precondition: backend is None or one of a6image.BACKENDS
+    """
+    import a6image
+    from PIL import Image as CoreImage
+    backend = a6image.preferred_backend() if backend is None else backend
+    with CoreImage.open(file) as image:
+        image = image.convert('RGB')
+        return a6image.Image(image.tobytes(),image.size[0],backend)
+
+
+def save(image, file, level=COMPRESSION, recipe=None):
+    """
+    Saves image to the given file as a PNG.
+
+    If recipe is not None, it is stored in the RECIPE text chunk of the file.
+
+    Parameter image: The image to save
+    Precondition: image is an Image object
+
+    Parameter file: The file to write
+    Precondition: file is a string
+
+    Parameter level: The zlib compression level
+    Precondition: level is an int in 0..9
+
+    Parameter recipe: The recipe of the image (see recipe)
+    Precondition: recipe is None or a string
+    """
+    from PIL import Image as CoreImage
+    from PIL.PngImagePlugin import PngInfo
+    size = (image.getWidth(),image.getHeight())
+    core = CoreImage.frombuffer('RGB',size,image.getBuffer(True),'raw','RGB',0,1)
+    info = PngInfo()
+    if not recipe is None:
+        info.add_text(RECIPE,recipe)
+    core.save(file,'PNG',compress_level=level,pnginfo=info)
+
+
+def process(file, ops, folder, force=False, backend=None):
+    """
+    Applies the operations to one file, and returns the result of the job.
+
+    The result is a tuple (file, status, seconds, pixels), where status is
+    'done', 'skipped' or an error message. The file is skipped if its output
+    already exists, is newer, and has the same recipe (see recipe), unless
+    force is True. This is the function run by the worker processes (see run).
+
+    Parameter file: The input file
+    Precondition: file is a string
+
+    Parameter ops: The operations to apply
+    Precondition: ops is a list of pairs (name, args) (see parse_op)
+
+    Parameter folder: The output folder
+    Precondition: folder is a string naming an existing folder
+
+    Parameter force: Whether to process files with newer outputs
+    Precondition: force is a bool
+
+    Parameter backend: The storage format for the image (None for the preferred one)
+    Precondition: backend is None or one of a6image.BACKENDS
+    """
+    import os.path
+    import time
+    import a6encode
+    import a6filter
+    start = time.perf_counter()
+    target = output_path(file,folder)
+    made = recipe(ops,backend)
+    if (not force and os.path.exists(target) and
+        os.path.getmtime(target) >= os.path.getmtime(file) and
+        read_recipe(target) == made):
+        return (file, 'skipped', 0.0, 0)
+
+    try:
+        editor = a6encode.Encoder(load(file,backend))
+        editor.EXECUTION = a6filter.SERIAL    # The files are already in parallel
+        for name, args in ops:
+            if getattr(editor,name)(*args) is False:
+                raise ValueError(name+' failed')
+        current = editor.getCurrent()
+        save(current,target,recipe=made)
+        return (file, 'done', time.perf_counter()-start, len(current))
+    except Exception as e:
+        return (file, str(e) or type(e).__name__, time.perf_counter()-start, 0)
+
+
+def run(files, ops, folder, workers=None, force=False, backend=None):
+    """
+    Processes the files with a pool of worker processes, printing each result.
+
+    The result is the list of results of process, in the order in which the
+    files were finished. At most two files per worker are in the pool at
+    once, so that the pool does not hold a copy of every job. With a single
+    worker, the files are processed in this process instead.
+
+    Parameter files: The input files
+    Precondition: files is a list of strings
+
+    Parameter ops: The operations to apply
+    Precondition: ops is a list of pairs (name, args) (see parse_op)
+
+    Parameter folder: The output folder (created if necessary)
+    Precondition: folder is a string
+
+    Parameter workers: The number of worker processes (None for one per CPU)
+    Precondition: workers is None or an int > 0
+
+    Parameter force: Whether to process files with newer outputs
+    Precondition: force is a bool
+
+    Parameter backend: The storage format for the images (None for the preferred one)
+    Precondition: backend is None or one of a6image.BACKENDS
+    """
+    import os
+    os.makedirs(folder,exist_ok=True)
+    workers = workers or os.cpu_count() or 1
+    results = []
+
+    def report(result):
+        results.append(result)
+        file, status, seconds, pixels = result
+        print('%-40s %-8s %8.3f s %10d pixels' % (file,status,seconds,pixels))
+
+    if workers == 1 or len(files) < 2:
+        for file in files:
+            report(process(file,ops,folder,force,backend))
+        return results
+
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(workers,mp_context=context) as pool:
+        pending = set()
+        for file in files:
+            if len(pending) >= 2*workers:
+                finished, pending = wait(pending,return_when=FIRST_COMPLETED)
+                for task in finished:
+                    report(task.result())
+            pending.add(pool.submit(process,file,ops,folder,force,backend))
+        for task in pending:
+            report(task.result())
+    return results
+
+
+def summarize(results, seconds):
+    """
+    Prints a summary of the results of a batch.
+
+    Parameter results: The results of the batch (see process)
+    Precondition: results is a list of tuples
+
+    Parameter seconds: The wall time of the batch
+    Precondition: seconds is a number >= 0
+    """
+    done = [result for result in results if result[1] == 'done']
+    skipped = [result for result in results if result[1] == 'skipped']
+    failed = len(results)-len(done)-len(skipped)
+    print('%d done, %d skipped, %d failed in %.3f s' % (len(done),len(skipped),failed,seconds))
+    if done:
+        busy = sum(result[2] for result in done)
+        pixels = sum(result[3] for result in done)
+        slowest = max(done,key=lambda result: result[2])
+        print('%.3f s per file, %.1f megapixels per second, slowest %s (%.3f s)' %
+              (busy/len(done),pixels/max(busy,1e-9)/1e6,slowest[0],slowest[2]))
+
+
+def main(argv):
+    """
+    Runs the batch command with the given command line arguments.
+
+    The result is 0 if every file was processed (or skipped), and 1 otherwise.
+
+    Parameter argv: The arguments after the word 'batch'
+    Precondition: argv is a list of strings
+    """
+    import argparse
+    import time
+    import a6image
+    parser = argparse.ArgumentParser(prog='imager batch',
+                                     description='Apply operations to many image files.')
+    parser.add_argument('source', type=str, help='a folder of images, or a glob pattern')
+    parser.add_argument('output', type=str, help='the folder for the results')
+    parser.add_argument('-o','--op', action='append', required=True, dest='ops',
+                        help='an operation, as name or name:arg,arg (in order)')
+    parser.add_argument('-w','--workers', type=int, default=None,
+                        help='the number of worker processes (default one per CPU)')
+    parser.add_argument('-f','--force', action='store_true',
+                        help='process files even if their outputs are up to date')
+    parser.add_argument('-b','--backend', choices=a6image.BACKENDS, default=None,
+                        help='the image storage format')
+    args = parser.parse_args(argv)
+
+    try:
+        ops = [parse_op(text) for text in args.ops]
+    except ValueError as e:
+        parser.error(str(e))
+    if not args.workers is None and args.workers < 1:
+        parser.error('there must be at least one worker')
+    files = find_inputs(args.source)
+    if not files:
+        parser.error('there are no images in '+repr(args.source))
+    clashes = collisions(files,args.output)
+    if clashes:
+        parser.error('these inputs would have the same output: '+
+                     '; '.join(', '.join(group) for group in clashes))
+
+    start = time.perf_counter()
+    results = run(files,ops,args.output,args.workers,args.force,args.backend)
+    summarize(results,time.perf_counter()-start)
+    return 0 if all(result[1] in ['done','skipped'] for result in results) else 1
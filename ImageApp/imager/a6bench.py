@@ -0,0 +1,465 @@
+"""
+Benchmarks for the imager application.
+
+This module is the 'bench' command of the application, as in
+
+    python imager bench --json results.json --baseline baseline.json
+
+The suite (see suite) runs every public operation of Filter and Encoder on
+the sample images, upscaled to several sizes (1, 4, 16 and 64 megapixels by
+default), with each storage backend. The list backend is only run up to 4
+megapixels by default, and the larger cases are reported as skipped. For each
+case, it reports the wall time, the pixels per second and the peak memory.
+The results can be written as JSON, and compared with an earlier JSON file (the baseline). Any operation
+that has become slower than the baseline by more than the threshold is a
+regression, and the command then fails.
+
+With the option --modes, it instead times the filters in each of the
+execution modes (serial, threads and processes), and reports the crossover
+sizes: the smallest image at which threads beat running serially, and at
+which processes beat both (see modes). These are the sizes to use for
+Filter.THREAD_SIZE and Filter.PARALLEL_SIZE on a given machine.
+
+Author: Adam Kadhim (ak779) and Calvin Johnson (clj78)
+Date:   November 20, 2019
+"""
+import a6image
+import a6filter
+
+# The operations to time in each execution mode, with their arguments
+OPERATIONS = [('invert',()), ('monochromify',(True,)), ('vignette',()),
+              ('pixellate',(10,))]
+
+# The factors by which to upscale each side of the sample images (see modes)
+SCALES = (1, 2, 4, 8)
+
+# The sizes in megapixels to upscale the sample images to (see suite)
+SIZES = (1, 4, 16, 64)
+
+# The largest size in megapixels at which to run the list backend (see suite);
+# a 64 MP image of tuples takes many GB and hours per operation
+LIST_SIZE = 4
+
+# The message hidden by encode (and found by decode)
+MESSAGE = 'The quick brown fox jumps over the lazy dog. '*4
+
+# The arguments of the operations that have any (see operations)
+ARGUMENTS = {'monochromify': (True,), 'applyLUT': (bytes(range(255,-1,-1)),),
+             'pixellate': (10,), 'encode': (MESSAGE,),
+             'fuse': ([('monochromify',(True,)), ('vignette',())],)}
+
+# The operations to run (untimed) before some operations
+SETUP = {'decode': [('encode',(MESSAGE,))]}
+
+# The fraction by which an operation may be slower than its baseline
+THRESHOLD = 0.25
+
+
+def operations():
+    """
+    Returns the list of public operations of Filter and Encoder, with arguments.
+
+    These are the journaled methods (see a6editor.journaled), and decode.
+    """
+    import a6encode
+    result = []
+    for cls in [a6filter.Filter, a6encode.Encoder]:
+        for name, value in vars(cls).items():
+            if not name.startswith('_') and (hasattr(value,'__wrapped__') or name == 'decode'):
+                result.append((name,ARGUMENTS.get(name,())))
+    return result
+
+
+def sample_files():
+    """
+    Returns a dictionary of the sample image files, by name.
+
+    The samples are the PNG files in the samples folder next to this one.
+    """
+    import glob
+    import os.path
+    path = os.path.join(os.path.split(os.path.abspath(__file__))[0],'..','samples')
+    result = {}
+    for file in sorted(glob.glob(os.path.join(path,'*.png'))):
+        result[os.path.splitext(os.path.split(file)[1])[0]] = file
+    return result
+
+
+def load_samples(backend=None):
+    """
+    Returns a dictionary of the sample images, by name (see sample_files).
+
+    Parameter backend: The storage format for the images (None for the preferred one)
+    Precondition: backend is None or one of a6image.BACKENDS
+    """
+    from PIL import Image as CoreImage
+    backend = a6image.preferred_backend() if backend is None else backend
+    result = {}
+    for name, file in sample_files().items():
+        image = CoreImage.open(file).convert('RGB')
+        result[name] = a6image.Image(image.tobytes(),image.size[0],backend)
+    return result
+
+
+def resize(image, megapixels):
+    """
+    Returns a copy of image upscaled to about the given number of megapixels.
+
+    The scale is the whole number that comes closest (see upscale), but it is
+    at least 1.
+
+    Parameter image: The image to upscale
+    Precondition: image is an Image object
+
+    Parameter megapixels: The number of megapixels to aim for
+    Precondition: megapixels is a number > 0
+    """
+    scale = max(1,round((megapixels*1e6/len(image))**0.5))
+    return upscale(image,scale)
+
+
+def upscale(image, scale):
+    """
+    Returns a copy of image with each side scale times as long.
+
+    Each pixel becomes a scale x scale block, so the image has the same look
+    (and the same kind of content for the filters) at every size.
+
+    Parameter image: The image to upscale
+    Precondition: image is an Image object
+
+    Parameter scale: The factor for each side
+    Precondition: scale is an int > 0
+    """
+    from PIL import Image as CoreImage
+    size = (image.getWidth(),image.getHeight())
+    core = CoreImage.frombuffer('RGB',size,image.getBuffer(True),'raw','RGB',0,1)
+    core = core.resize((size[0]*scale,size[1]*scale),CoreImage.NEAREST)
+    return a6image.Image(core.tobytes(),core.size[0],image.getBackend())
+
+
+def time_mode(image, mode, name, args, repeat=3):
+    """
+    Returns the best time in seconds of a filter on image in the given mode.
+
+    Each run is on a new copy of image. The time does not include making the
+    copy, or starting the workers (which is done once, before the runs).
+
+    Parameter image: The image to filter
+    Precondition: image is an Image object
+
+    Parameter mode: How to run the filter
+    Precondition: mode is one of a6filter.MODES
+
+    Parameter name: The name of the filter method
+    Precondition: name is a string
+
+    Parameter args: The arguments to the filter
+    Precondition: args is a tuple
+
+    Parameter repeat: The number of runs
+    Precondition: repeat is an int > 0
+    """
+    import time
+    best = None
+    for run in range(repeat+1):
+        editor = a6filter.Filter(image.copy())
+        with editor.using(mode):
+            start = time.perf_counter()
+            getattr(editor,name)(*args)
+            elapsed = time.perf_counter()-start
+        if run > 0:     # The first run starts the workers
+            best = elapsed if best is None else min(best,elapsed)
+    return best
+
+
+def modes(operations=OPERATIONS, scales=SCALES, repeat=3):
+    """
+    Times each operation in each mode on the samples, and prints the results.
+
+    The result is a dictionary from each operation name to its crossover
+    sizes: a pair of the fewest pixels from which threads were faster than
+    serial, and from which processes were faster than both (on every larger
+    image as well, so that noise on small images does not count). Either is
+    None if that never happened.
+
+    Parameter operations: The operations to time
+    Precondition: operations is a list of pairs (name, args)
+
+    Parameter scales: The factors by which to upscale the samples
+    Precondition: scales is a list of ints > 0
+
+    Parameter repeat: The number of runs of each operation (best is kept)
+    Precondition: repeat is an int > 0
+    """
+    import os
+    workers = a6filter.Filter.WORKERS or os.cpu_count() or 1
+    if workers < 2:
+        print('There is only one worker, so every mode runs serially.')
+    samples = load_samples()
+    images = sorted([upscale(image,scale) for image in samples.values() for scale in scales],
+                    key=len)
+
+    print('%-14s %10s %10s %10s %10s' % (('operation','pixels')+a6filter.MODES))
+    result = {}
+    for name, args in operations:
+        wins = []
+        for image in images:
+            times = [time_mode(image,mode,name,args,repeat) for mode in a6filter.MODES]
+            print('%-14s %10d %10.4f %10.4f %10.4f' % ((name,len(image))+tuple(times)))
+            wins.append((len(image),times[1] < times[0],times[2] < min(times[0],times[1])))
+
+        # Walk down from the largest image, until the mode stops winning
+        crossover = [None, None]
+        winning = [True, True]
+        for size, threads, processes in reversed(wins):
+            for pos, faster in enumerate([threads,processes]):
+                winning[pos] = winning[pos] and faster
+                if winning[pos]:
+                    crossover[pos] = size
+        result[name] = tuple(crossover)
+
+    print()
+    for name in result:
+        print('%-14s threads from %s pixels, processes from %s pixels' % ((name,)+result[name]))
+    return result
+
+
+def measure(image, name, args, repeat=3):
+    """
+    Returns the best time in seconds and the peak memory in bytes of an operation.
+
+    Each run is on a new Encoder for a copy of image, after any SETUP. The
+    time includes getting the current image afterwards, so that lazy work
+    (such as a pending rotation) is counted. The memory is measured in one
+    more run with tracemalloc, which is not timed as tracing slows it down.
+    It is the most memory allocated at once during the operation.
+
+    Parameter image: The image to use
+    Precondition: image is an Image object
+
+    Parameter name: The name of the operation
+    Precondition: name is a string
+
+    Parameter args: The arguments to the operation
+    Precondition: args is a tuple
+
+    Parameter repeat: The number of timed runs
+    Precondition: repeat is an int > 0
+    """
+    import time
+    import tracemalloc
+    import a6encode
+
+    def prepare():
+        editor = a6encode.Encoder(image.copy())
+        for step, values in SETUP.get(name,[]):
+            getattr(editor,step)(*values)
+        editor.getCurrent()
+        return editor
+
+    best = None
+    for run in range(repeat):
+        editor = prepare()
+        start = time.perf_counter()
+        getattr(editor,name)(*args)
+        editor.getCurrent()
+        elapsed = time.perf_counter()-start
+        best = elapsed if best is None else min(best,elapsed)
+
+    editor = prepare()
+    tracemalloc.start()
+    try:
+        base = tracemalloc.get_traced_memory()[0]
+        getattr(editor,name)(*args)
+        editor.getCurrent()
+        peak = tracemalloc.get_traced_memory()[1]-base
+    finally:
+        tracemalloc.stop()
+    return (best, peak)
+
+
+def suite(ops=None, sizes=SIZES, backends=None, samples=None, repeat=3, list_size=LIST_SIZE):
+    """
+    Runs the benchmark suite, printing each result, and returns the results.
+
+    Each result is a dictionary with the operation, backend, sample, pixels,
+    seconds, pixels per second and peak memory in bytes. The list backend is
+    not run at sizes above list_size; each of these cases is printed as
+    skipped, and has no result.
+
+    Parameter ops: The operations to run (None for all of them, see operations)
+    Precondition: ops is None or a list of pairs (name, args)
+
+    Parameter sizes: The sizes in megapixels to upscale the samples to
+    Precondition: sizes is a list of numbers > 0
+
+    Parameter backends: The backends to use (None for all that are available)
+    Precondition: backends is None or a list of a6image.BACKENDS
+
+    Parameter samples: The names of the samples to use (None for all)
+    Precondition: samples is None or a list of strings
+
+    Parameter repeat: The number of timed runs of each operation (best is kept)
+    Precondition: repeat is an int > 0
+
+    Parameter list_size: The largest size for the list backend (None for no limit)
+    Precondition: list_size is None or a number >= 0
+    """
+    ops = operations() if ops is None else ops
+    if backends is None:
+        backends = [backend for backend in a6image.BACKENDS if a6image.has_backend(backend)]
+
+    print('%-14s %-7s %-10s %8s %10s %10s %10s' %
+          ('operation','backend','sample','MP','seconds','MP/s','peak MB'))
+    results = []
+    for backend in backends:
+        images = load_samples(backend)
+        for sample in sorted(images) if samples is None else samples:
+            for size in sizes:
+                if backend == a6image.LIST and not list_size is None and size > list_size:
+                    print('%-14s %-7s %-10s %8.2f %10s' % ('(all)',backend,sample,size,'skipped'))
+                    continue
+                image = resize(images[sample],size)
+                for name, args in ops:
+                    seconds, peak = measure(image,name,args,repeat)
+                    rate = len(image)/seconds if seconds > 0 else float('inf')
+                    results.append({'operation': name, 'backend': backend,
+                                    'sample': sample, 'pixels': len(image),
+                                    'seconds': seconds, 'pixels_per_second': rate,
+                                    'peak_bytes': peak})
+                    print('%-14s %-7s %-10s %8.2f %10.4f %10.2f %10.1f' %
+                          (name,backend,sample,len(image)/1e6,seconds,rate/1e6,peak/1e6))
+    return results
+
+
+def write(results, file):
+    """
+    Writes the results of the suite to a JSON file, with a description of this machine.
+
+    Parameter results: The results of the suite
+    Precondition: results is a list of dictionaries (see suite)
+
+    Parameter file: The file to write
+    Precondition: file is a string
+    """
+    import json
+    import os
+    import platform
+    import time
+    numpy = a6image._numpy()
+    data = {'python': platform.python_version(), 'machine': platform.machine(),
+            'system': platform.system(), 'cpus': os.cpu_count(),
+            'numpy': None if numpy is None else numpy.__version__,
+            'date': time.strftime('%Y-%m-%dT%H:%M:%S'), 'results': results}
+    with open(file,'w') as stream:
+        json.dump(data,stream,indent=1)
+
+
+def compare(results, file, threshold=THRESHOLD):
+    """
+    Returns the results that are slower than in the baseline file, and prints them.
+
+    Results are matched to the baseline by operation, backend, sample and
+    pixels. A result is a regression if its time is more than (1+threshold)
+    times the baseline time. Results that are not in the baseline are ignored.
+    Each regression is a tuple of the result and the baseline time.
+
+    Parameter results: The results of the suite
+    Precondition: results is a list of dictionaries (see suite)
+
+    Parameter file: The baseline JSON file (see write)
+    Precondition: file is a string
+
+    Parameter threshold: The fraction by which a result may be slower
+    Precondition: threshold is a number >= 0
+    """
+    import json
+    with open(file) as stream:
+        baseline = json.load(stream)['results']
+
+    def key(result):
+        return (result['operation'],result['backend'],result['sample'],result['pixels'])
+
+    times = {key(result): result['seconds'] for result in baseline}
+    regressions = []
+    for result in results:
+        before = times.get(key(result))
+        if not before is None and result['seconds'] > (1+threshold)*before:
+            regressions.append((result,before))
+
+    print()
+    print('%d of %d results are in the baseline' % (len([1 for result in results if key(result) in times]),len(results)))
+    for result, before in regressions:
+        print('REGRESSION %-14s %-7s %-10s %8.2f MP: %.4f s, was %.4f s (%+.0f%%)' %
+              (key(result)[:3]+(result['pixels']/1e6,result['seconds'],before,
+               100*(result['seconds']/before-1))))
+    return regressions
+
+
+def main(argv):
+    """
+    Runs the bench command with the given command line arguments.
+
+    The result is 1 if there were any regressions, and 0 otherwise.
+
+    Parameter argv: The arguments after the word 'bench'
+    Precondition: argv is a list of strings
+    """
+    import argparse
+    names = [name for name, args in operations()]
+
+    def numbers(text):
+        return [float(item) for item in text.split(',')]
+
+    def words(text):
+        return text.split(',')
+
+    parser = argparse.ArgumentParser(prog='imager bench',
+                                     description='Time the image operations.')
+    parser.add_argument('--ops', type=words, default=None,
+                        help='the operations to time, separated by commas (default all)')
+    parser.add_argument('--sizes', type=numbers, default=list(SIZES),
+                        help='the sizes in megapixels, separated by commas (default 1,4,16,64)')
+    parser.add_argument('--backends', type=words, default=None,
+                        help='the backends to use, separated by commas (default all)')
+    parser.add_argument('--samples', type=words, default=None,
+                        help='the samples to use, separated by commas (default all)')
+    parser.add_argument('--list-size', type=float, default=LIST_SIZE,
+                        help='the largest size in megapixels for the list backend (default 4)')
+    parser.add_argument('--repeat', type=int, default=3, help='the number of timed runs')
+    parser.add_argument('--json', type=str, default=None, help='the file to write the results to')
+    parser.add_argument('--baseline', type=str, default=None, help='the results to compare with')
+    parser.add_argument('--threshold', type=float, default=THRESHOLD,
+                        help='the fraction by which an operation may be slower (default 0.25)')
+    parser.add_argument('--modes', action='store_true',
+                        help='time the execution modes instead (see a6filter)')
+    args = parser.parse_args(argv)
+
+    if args.modes:
+        modes(repeat=args.repeat)
+        return 0
+    for name in args.ops or []:
+        if not name in names:
+            parser.error(repr(name)+' is not an operation')
+    for backend in args.backends or []:
+        if not a6image.has_backend(backend):
+            parser.error(repr(backend)+' is not an available backend')
+    samples = sample_files()
+    for name in args.samples or []:
+        if not name in samples:
+            parser.error(repr(name)+' is not a sample (the samples are '+', '.join(samples)+')')
+    if args.repeat < 1:
+        parser.error('there must be at least one run')
+
+    ops = None if args.ops is None else [(name,ARGUMENTS.get(name,())) for name in args.ops]
+    results = suite(ops,args.sizes,args.backends,args.samples,args.repeat,args.list_size)
+    if not args.json is None:
+        write(results,args.json)
+    if not args.baseline is None and compare(results,args.baseline,args.threshold):
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    modes()
@@ -7,13 +7,402 @@ keeps track of all modifications of an original image.  It allows for
 edit history. The filter functions are in a subclass of this class so that
 they can take advantage of the edit history.
 
+Only the current image is stored in full. Every older edit is stored as a
+delta: the tiles (see a6image.TILE_SIZE) in which it differs from the edit
+after it. So an edit costs memory in proportion to the pixels it changed.
+
+The history is limited by size in bytes, not by the number of edits. Edits
+older than the last two are compressed (with zlib, on a background thread).
+When the history takes more than HISTORY_MEMORY bytes, the oldest edits are
+moved to temporary files, and when those take more than HISTORY_DISK bytes,
+the oldest edits are deleted. An edit is only decompressed (or read back)
+when an undo reaches it.
+
+Image operations (the methods of subclasses marked with the journaled
+decorator) are also recorded in a journal, as a method name and arguments.
+As these operations are deterministic, an edit made only by operations does
+not need any pixels at all: it can be rebuilt by replaying the journal from
+an earlier full image (a checkpoint). Edits are only stored this way if the
+replay takes less than REPLAY_TIME seconds, so checkpoints are closer
+together when the operations are slow. The journal also allows undone
+edits to be redone.
+
+Rotations, reflections and transposes are not done right away. Each edit
+has a pending orientation, and these operations only combine it with a
+new one (the eight orientations form a group, see compose). The pixels are
+only reordered, all at once, when getCurrent is called. So several of these
+operations in a row cost at most one reordering, and two that cancel out
+cost nothing.
+
 Based on an original file by Dexter Kozen (dck10) and Walker White (wmw2)
 
 Author: Adam Kadhim (ak779) and Calvin Johnson (clj78)
 Date:   November 20, 2019
 """
-# THIS FILE IS COMPLETE.  DO NOT MODIFY THIS FILE AT ALL
 import a6image
+import collections
+
+# The orientation that leaves an image unchanged (see Image.reorient)
+IDENTITY = (False, False, False)
+
+# The thread that compresses old edits (created when first needed)
+_COMPRESSOR = None
+
+
+def _compressor():
+    """
+    Returns the executor that compresses edits in the background.
+
+    There is a single worker thread, shared by all edit histories. It is
+    enough, as zlib does not hold the GIL while it compresses.
+    """
+    global _COMPRESSOR
+    if _COMPRESSOR is None:
+        from concurrent.futures import ThreadPoolExecutor
+        _COMPRESSOR = ThreadPoolExecutor(1,thread_name_prefix='history')
+    return _COMPRESSOR
+
+
+def journaled(method):
+    """
+    Returns the given Editor method, changed to record its calls in the journal.
+
+    The method must be deterministic: calling it again with the same
+    arguments on the same image must give the same result. It should only
+    change the current image (getCurrent). Calls to journaled methods from
+    inside a journaled method are not recorded separately. The arguments are
+    recorded as deep copies, so that changing them after the call (such as a
+    list of ops) does not change what is replayed.
+
+    Parameter method: The method to journal
+    Precondition: method is a method of Editor (or a subclass)
+    """
+    import copy
+    import functools
+    import time
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        if self._depth > 0:
+            return method(self, *args, **kwargs)
+
+        step = self._journal[-1]
+        if step.changed(self._history[-1]):
+            step.ops = None
+        record = None if step.ops is None else copy.deepcopy((args,kwargs))
+        self._depth += 1
+        start = time.perf_counter()
+        done = False
+        try:
+            result = method(self, *args, **kwargs)
+            done = True
+        finally:
+            self._depth -= 1
+            if not done:
+                step.ops = None
+        if not step.ops is None:
+            step.ops.append((method.__name__,)+record)
+            step.cost += time.perf_counter()-start
+        step.mark(self._history[-1])
+        return result
+
+    return wrapper
+
+
+def compose(first, second):
+    """
+    Returns the orientation that is the same as first followed by second.
+
+    An orientation is a tuple (transpose, vertical, horizontal) of the
+    arguments to Image.reorient. Each one is represented here by the 2x2
+    matrix that it applies to (column, row) coordinates, relative to the
+    center of the image. The product of two such matrices is another one.
+
+    Parameter first: The orientation to apply first
+    Precondition: first is a tuple of 3 bools
+
+    Parameter second: The orientation to apply second
+    Precondition: second is a tuple of 3 bools
+    """
+    def matrix(orientation):
+        transpose, vertical, horizontal = orientation
+        x = -1 if horizontal else 1
+        y = -1 if vertical else 1
+        return ((0,x),(y,0)) if transpose else ((x,0),(0,y))
+
+    a = matrix(second)
+    b = matrix(first)
+    product = [[sum(a[i][k]*b[k][j] for k in range(2)) for j in range(2)] for i in range(2)]
+    if product[0][0] == 0:
+        return (True, product[1][0] == -1, product[0][1] == -1)
+    return (False, product[1][1] == -1, product[0][0] == -1)
+
+
+def _compress(parts):
+    """
+    Returns the given pixel storage parts packed together and compressed.
+
+    Parameter parts: The pixel storage to compress
+    Precondition: parts is a list of (immutable) storage or tiles of storage
+    """
+    import zlib
+    return zlib.compress(b''.join(map(a6image._to_bytes,parts)),1)
+
+
+class _Delta(object):
+    """
+    A class representing an edit in the history by its difference from the next.
+
+    The edit is the image that results from writing the saved tiles into the
+    next edit, and setting its width (see Image._applyDelta).
+    """
+    # Attribute width: The image width of this edit
+    # Invariant: width is an int > 0
+    #
+    # Attribute tiles: The tiles that differ from the next edit
+    # Invariant: tiles is a dictionary mapping tile numbers to tile storage
+
+    def __init__(self, width, tiles):
+        """
+        Initializes a delta with the given width and saved tiles.
+
+        Parameter width: The image width of this edit
+        Precondition: width is an int > 0
+
+        Parameter tiles: The tiles that differ from the next edit
+        Precondition: tiles is a dictionary mapping tile numbers to tile storage
+        """
+        self.width = width
+        self.tiles = tiles
+
+    def getMemory(self):
+        """
+        Returns the number of bytes of memory used by this delta.
+        """
+        return sum(map(a6image._nbytes,self.tiles.values()))
+
+
+class _Replay(object):
+    """
+    A class representing an edit in the history that is rebuilt from the journal.
+
+    It holds no pixels. The edit is rebuilt by replaying the journal from the
+    nearest full image before it (see Editor._rebuild).
+    """
+
+    def getMemory(self):
+        """
+        Returns the number of bytes of memory used by this edit (0).
+        """
+        return 0
+
+
+class _Step(object):
+    """
+    A class representing the journal for one edit in the history.
+
+    The journal of an edit lists the operations that made the edit from the
+    one before it. It is only known if every change to the image was made by
+    a journaled method. To check this, a step remembers the version of the
+    image after the last operation (see Image._version).
+    """
+    # Attribute ops: The operations of this edit, in order
+    # Invariant: ops is a list of (name,args,kwargs) tuples, or None if unknown
+    #
+    # Attribute cost: The time (in seconds) that the operations took
+    # Invariant: cost is a float >= 0
+    #
+    # Attribute chain: The time to rebuild this edit by replaying the journal
+    # Invariant: chain is a float >= 0, or None if this edit cannot be rebuilt
+    #
+    # Attribute image: The image when the step was last marked
+    # Invariant: image is an Image object or None
+    #
+    # Attribute version: The version of image when the step was last marked
+    # Invariant: version is an int
+    #
+    # Attribute width: The width of image when the step was last marked
+    # Invariant: width is an int
+    #
+    # Attribute orientation: The pending orientation of this edit
+    # Invariant: orientation is a tuple of 3 bools (see compose)
+
+    def __init__(self, image, ops):
+        """
+        Initializes a journal step for the given image.
+
+        Parameter image: The image being edited
+        Precondition: image is an Image object
+
+        Parameter ops: The operations of this edit
+        Precondition: ops is a list of (name,args,kwargs) tuples or None
+        """
+        self.ops = ops
+        self.cost = 0.0
+        self.chain = None
+        self.orientation = IDENTITY
+        self.mark(image)
+
+    def mark(self, image):
+        """
+        Remembers the current state of the image.
+
+        Parameter image: The image being edited
+        Precondition: image is an Image object
+        """
+        self.image = image
+        self.version = image._version
+        self.width = image.getWidth()
+
+    def changed(self, image):
+        """
+        Returns True if the image may have changed since the step was marked.
+
+        Parameter image: The image being edited
+        Precondition: image is an Image object
+        """
+        return (not image is self.image or image._version != self.version or
+                image.getWidth() != self.width)
+
+
+class _Frozen(object):
+    """
+    A class representing a compressed edit in the history.
+
+    A frozen edit is made from either a _Delta or a full Image. Its pixels are
+    compressed in the background, and may later be moved to a file on disk
+    (see spill). The method thaw gets back the original _Delta or Image.
+    """
+    # Attribute width: The image width of this edit
+    # Invariant: width is an int > 0
+    #
+    # Attribute backend: The storage format of the pixels
+    # Invariant: backend is one of a6image.BACKENDS
+    #
+    # Attribute tiles: The tile numbers and sizes (in bytes) of a delta
+    # Invariant: tiles is a list of (int,int) tuples, or None for a full Image
+    #
+    # Attribute size: The number of bytes used before compression
+    # Invariant: size is an int >= 0
+    #
+    # Attribute blob: The compressed pixels
+    # Invariant: blob is a bytes object, a Future for one, or None if spilled
+    #
+    # Attribute path: The file with the compressed pixels
+    # Invariant: path is a string, or None if not spilled
+    #
+    # Attribute disk: The size of the file with the compressed pixels
+    # Invariant: disk is an int >= 0
+
+    def __init__(self, entry):
+        """
+        Initializes a frozen edit, and starts compressing it in the background.
+
+        Parameter entry: The edit to freeze
+        Precondition: entry is a _Delta or an Image object
+        """
+        self.size = entry.getMemory() if isinstance(entry,_Delta) else entry._memory()
+        self.path = None
+        self.disk = 0
+        if isinstance(entry,_Delta):
+            numbers = sorted(entry.tiles)
+            parts = [entry.tiles[n] for n in numbers]
+            self.backend = a6image._backend_of(parts[0]) if parts else a6image.PACKED
+            scale = 1 if self.backend == a6image.PACKED else 3
+            self.tiles = [(n,scale*len(entry.tiles[n])) for n in numbers]
+        else:
+            # The history does not change old images, so sharing them is safe
+            parts = [entry._data]
+            self.tiles = None
+            self.backend = entry.getBackend()
+        self.width = entry.width if isinstance(entry,_Delta) else entry.getWidth()
+        self.blob = _compressor().submit(_compress,parts)
+
+    def getMemory(self):
+        """
+        Returns the number of bytes of memory used by this edit.
+
+        While it is still being compressed, the edit uses its original size.
+        """
+        if self.blob is None:
+            return 0
+        elif isinstance(self.blob,bytes):
+            return len(self.blob)
+        elif self.blob.done():
+            self.blob = self.blob.result()
+            return len(self.blob)
+        return self.size
+
+    def getDisk(self):
+        """
+        Returns the number of bytes of disk space used by this edit.
+        """
+        return 0 if self.path is None else self.disk
+
+    def spill(self, directory):
+        """
+        Moves the compressed pixels into a new file in the given directory.
+
+        Parameter directory: The directory for the file
+        Precondition: directory is the path of an existing directory
+        """
+        import os, tempfile
+        assert self.path is None, 'edit is already on disk'
+        blob = self._compressed()
+        handle, self.path = tempfile.mkstemp(dir=directory)
+        with os.fdopen(handle,'wb') as file:
+            file.write(blob)
+        self.disk = len(blob)
+        self.blob = None
+
+    def thaw(self):
+        """
+        Returns the _Delta or Image that this edit was made from.
+
+        If the edit was on disk, this deletes its file.
+        """
+        result = self.peek()
+        self.discard()
+        return result
+
+    def peek(self):
+        """
+        Returns a new copy of the _Delta or Image that this edit was made from.
+
+        Unlike thaw, this leaves the frozen edit as it is.
+        """
+        import zlib
+        data = zlib.decompress(self._compressed())
+        if self.tiles is None:
+            store = a6image._convert(data,a6image.PACKED,self.backend)
+            return a6image.Image._trusted(store,self.width,self.backend)
+
+        tiles = {}
+        start = 0
+        for number, count in self.tiles:
+            tiles[number] = a6image._from_bytes(data[start:start+count],self.backend)
+            start += count
+        return _Delta(self.width,tiles)
+
+    def discard(self):
+        """
+        Deletes the file for this edit, if there is one.
+        """
+        import os
+        if not self.path is None:
+            os.remove(self.path)
+            self.path = None
+
+    def _compressed(self):
+        """
+        Returns the compressed pixels, waiting for or reading them if necessary.
+        """
+        if self.blob is None:
+            with open(self.path,'rb') as file:
+                return file.read()
+        elif not isinstance(self.blob,bytes):
+            self.blob = self.blob.result()
+        return self.blob
 
 
 class Editor(object):
@@ -23,26 +412,92 @@ class Editor(object):
     This class is what allows us to implement the Undo functionality in our
     application. It separates the image into the original (saved) image and
     the current modification. It also keeps track of all edits in-between
-    (up to a maximum of MAX_HISTORY edits) in order. It can undo any of
-    these edits, rolling the current image back.
+    in order. It can undo any of these edits, rolling the current image back.
+
+    The history is delta-encoded. The edit just before the current image is
+    a copy-on-write copy of it, which saves tiles as the current image
+    changes. When a new edit starts, that copy is sealed into a _Delta. An
+    undo writes the saved tiles back into the current image, which costs time
+    in proportion to the size of the delta, not the image.
+
+    The size of the history is limited in bytes. Edits before the newest delta
+    are frozen (see _Frozen), which compresses them in the background. If the
+    history uses more than HISTORY_MEMORY bytes of memory, the oldest frozen
+    edits are spilled to temporary files. If those use more than HISTORY_DISK
+    bytes, the oldest edits are deleted. The methods getMemoryUse and
+    getDiskUse report the current totals, for tuning these limits.
+
+    Each edit also has a journal step (see _Step), with the operations that
+    made it from the edit before. When an edit is sealed, it is replaced by a
+    _Replay (with no pixels) if it can be rebuilt from the journal in less
+    than REPLAY_TIME seconds. If it cannot, but the edit after it was made by
+    operations that changed much of the image, it is kept as a full image
+    instead of a delta. That starts a new chain of replayable edits. Undone
+    edits can be redone, if they were made only by operations.
 
-    If the number of edits exceeds MAX_HISTORY, the oldest edit will be
-    deleted.
+    Attribute HISTORY_MEMORY: A CLASS ATTRIBUTE for the memory limit in bytes
+    Invariant: HISTORY_MEMORY is an int >= 0
+
+    Attribute HISTORY_DISK: A CLASS ATTRIBUTE for the disk limit in bytes
+    Invariant: HISTORY_DISK is an int >= 0 (0 means never spill to disk)
 
     Attribute MAX_HISTORY: A CLASS ATTRIBUTE for the maximum number of edits
-    Invariant: MAX_HISTORY is an int > 0
+    Invariant: MAX_HISTORY is an int > 1, or None for no limit
+
+    Attribute REPLAY_TIME: A CLASS ATTRIBUTE for the longest replay in seconds
+    Invariant: REPLAY_TIME is a number >= 0 (0 means never replay)
     """
     # IMMUTABLE ATTRIBUTES (Fixed after initialization)
     # Attribute _original: The original image
     # Invariant: _original is an Image object
     #
     # Attribute _history: The edit history
-    # Invariant: _history is a non-empty list of Image objects. In addition,
-    #the length of _history should never be longer than MAX_HISTORY.
+    # Invariant: _history is a non-empty deque. The last element is the current
+    # image. Every other element is an Image, a _Delta from the element after
+    # it, a _Replay, or a _Frozen of an Image or _Delta. The element just before
+    # the current image is always an Image or a _Replay, and the elements before
+    # the one after that are never _Delta objects. Every _Replay comes after a
+    # full image or another _Replay. In addition, the length of _history should
+    # never be longer than MAX_HISTORY (if it is not None).
+    #
+    # Attribute _journal: The journal steps of the edits
+    # Invariant: _journal is a deque of _Step objects, the same length as
+    # _history. The chain of a step is not None if its edit is a full image
+    # (possibly frozen) or a _Replay.
+    #
+    # Attribute _redo: The operations of the edits that were undone
+    # Invariant: _redo is a list of operation lists (see _Step), newest last
+    #
+    # Attribute _undone: The state of the current image after the last undo
+    # Invariant: _undone is a _Step, or None if _redo is empty
+    #
+    # Attribute _depth: The number of journaled methods being executed
+    # Invariant: _depth is an int >= 0
+    #
+    # The images in _history are stored without their pending orientation,
+    # which is the orientation of the matching step in _journal.
+    #
+    # Attribute _spilled: The number of old edits that are done with memory
+    # Invariant: _spilled is an int >= 0. The first _spilled elements of
+    # _history are either on disk, or are not _Frozen (and never will be)
+    #
+    # Attribute _disk: The number of bytes of the history on disk
+    # Invariant: _disk is the sum of getDisk() over the frozen edits
+    #
+    # Attribute _directory: The directory for spilled edits
+    # Invariant: _directory is a string, or None if not yet created
+
+    # The number of bytes of history that we keep in memory
+    HISTORY_MEMORY = 256*1024*1024
+
+    # The number of bytes of history that we keep on disk
+    HISTORY_DISK = 1024*1024*1024
 
     # The number of edits that we are allowed to keep track of.
-    # (THIS GOES IN CLASS FOLDER)
-    MAX_HISTORY = 20
+    MAX_HISTORY = None
+
+    # The number of seconds that an undo may spend replaying the journal
+    REPLAY_TIME = 1.0
 
     # GETTERS
     def getOriginal(self):
@@ -54,8 +509,39 @@ class Editor(object):
     def getCurrent(self):
         """
         Returns the most recent edit
+
+        If the edit has a pending orientation, the pixels are reordered first.
+        This does not count as a change for the journal.
+        """
+        current = self._history[-1]
+        step = self._journal[-1]
+        if step.orientation != IDENTITY:
+            marks = [mark for mark in [step,self._undone]
+                     if not mark is None and not mark.changed(current)]
+            current.reorient(*step.orientation)
+            step.orientation = IDENTITY
+            for mark in marks:
+                mark.mark(current)
+        return current
+
+    def getMemoryUse(self):
+        """
+        Returns the number of bytes of memory used by the edit history.
+
+        This does not include the current image. Edits that are still being
+        compressed count at their uncompressed size.
         """
-        return self._history[-1]
+        total = 0
+        for pos in range(len(self._history)-1):
+            entry = self._history[pos]
+            total += entry._memory() if isinstance(entry,a6image.Image) else entry.getMemory()
+        return total
+
+    def getDiskUse(self):
+        """
+        Returns the number of bytes of disk space used by the edit history.
+        """
+        return self._disk
 
     # INITIALIZER
     def __init__(self,original):
@@ -70,7 +556,14 @@ class Editor(object):
         """
         assert isinstance(original,a6image.Image), repr(original)+' is not an image'
         self._original = original
-        self._history  = [original.copy()]
+        self._history  = collections.deque([original.copy()])
+        self._journal  = collections.deque([_Step(self._history[0],None)])
+        self._redo = []
+        self._undone = None
+        self._depth = 0
+        self._spilled  = 0
+        self._disk = 0
+        self._directory = None
 
     # EDIT METHODS
     def undo(self):
@@ -81,12 +574,54 @@ class Editor(object):
         element of the edit history.  However, the edit history can never
         be empty.  If this method is called on an edit history of one element,
         this method returns False instead.
+
+        If the edit was made only by journaled operations, it can be redone.
         """
         if len(self._history) > 1:
-            self._history.pop()
+            current  = self._history.pop()
+            step = self._journal.pop()
+            if step.ops is None or step.changed(current):
+                self._redo = []
+            else:
+                self._redo.append(step.ops)
+
+            previous = self._history[-1]
+            if isinstance(previous,_Replay):
+                previous, orientation = self._rebuild(len(self._history)-1)
+                self._history[-1] = previous
+                self._journal[-1].orientation = orientation
+            if previous._isCopyOf(current):
+                # Roll the current image back in place
+                current._applyDelta(previous.getWidth(),previous._takeDelta())
+                self._history[-1] = current
+            self._reopen()
+            self._journal[-1].mark(self._history[-1])
+            self._undone = _Step(self._history[-1],None) if self._redo else None
             return True
         return False
 
+    def redo(self):
+        """
+        Returns True if the latest undone edit can be redone, False otherwise.
+
+        This method redoes the latest undone edit by replaying its operations
+        as a new edit. Edits can only be redone if the image has not changed
+        since the undo (and no increment has happened since). In addition, an
+        edit can only be redone if it was made only by journaled operations.
+        """
+        if self._redo and not self._undone.changed(self._history[-1]):
+            ops = self._redo.pop()
+            redo = self._redo
+            self.increment()
+            for name, args, kwargs in ops:
+                getattr(self,name)(*args,**kwargs)
+            self._redo = redo
+            self._undone = _Step(self._history[-1],None) if redo else None
+            return True
+        self._redo = []
+        self._undone = None
+        return False
+
     def clear(self):
         """
         Deletes the entire edit history, retoring the original image.
@@ -94,16 +629,218 @@ class Editor(object):
         When this method completes, the object should have the same values that
         it did once it was first initialized.
         """
-        self._history = [self._original.copy()]
+        for entry in self._history:
+            if isinstance(entry,_Frozen):
+                entry.discard()
+        self._history = collections.deque([self._original.copy()])
+        self._journal = collections.deque([_Step(self._history[0],None)])
+        self._redo = []
+        self._undone = None
+        self._spilled = 0
+        self._disk = 0
 
     def increment(self):
         """
         Adds a new copy of the image to the edit history.
 
         This method copies the current most recent edit and adds it to the
-        end of the history.  If this causes the history to grow to larger
-        (greater than MAX_HISTORY), this method deletes the oldest edit.
+        history.  If this causes the history to grow too large (see the
+        class attributes), this method deletes the oldest edits.
+
+        The copy is placed just before the current image, so that the image
+        being edited is the one that owns its storage.  Since copies are
+        copy-on-write, the copy in the history then only stores the tiles
+        that the next edit changes.
+
+        This also starts a new journal step, and forgets any undone edits.
+        The pending orientation is kept, so the copy shares all of its pixels.
+        """
+        current = self._history.pop()
+        self._seal(current)
+        self._history.append(current.copy())
+        self._history.append(current)
+        step = _Step(current,[])
+        step.orientation = self._journal[-1].orientation
+        self._journal.append(step)
+        self._redo = []
+        self._undone = None
+        self._freeze()
+        self._enforce()
+
+    # HELPER METHODS
+    def _orient(self, orientation):
+        """
+        Adds an orientation to the pending orientation of the current image.
+
+        The pixels are not reordered until they are needed (see getCurrent).
+        As far as copies and the journal can tell, the image has changed.
+
+        Parameter orientation: The orientation to add
+        Precondition: orientation is a tuple of 3 bools (see compose)
+        """
+        step = self._journal[-1]
+        step.orientation = compose(step.orientation,orientation)
+        self._history[-1]._version += 1
+
+    def _seal(self, current):
+        """
+        Replaces the newest edit in the history with a delta, if possible.
+
+        The newest edit can be sealed if it is still a copy-on-write copy of
+        the current image. Otherwise (for example, if an operation replaced
+        the storage of the current image) it stays a full Image, which acts
+        as a keyframe for the edits before it.
+
+        If the newest edit can be rebuilt from the journal in time, it is
+        replaced with a _Replay instead (even if it is a keyframe). If the current image was made from it
+        by operations that changed at least half of the image, it is kept as
+        a full Image, so that the current image can be rebuilt from it later.
+
+        Parameter current: The current image (which is not in the history)
+        Precondition: current is an Image object
+        """
+        step = self._journal[-1]
+        if step.changed(current):
+            step.ops = None
+        if len(self._history) == 0:
+            return
+
+        newest = self._history[-1]
+        last = self._journal[-2]
+        if not isinstance(newest,a6image.Image):
+            return
+
+        chain = None if len(self._journal) < 3 else self._journal[-3].chain
+        if (not last.ops is None and not chain is None and
+            chain+last.cost <= self.REPLAY_TIME):
+            if newest._isCopyOf(current):
+                newest._takeDelta()
+            self._history[-1] = _Replay()
+            last.chain = chain+last.cost
+        elif not newest._isCopyOf(current):
+            last.chain = 0.0
+        elif not step.ops is None and 2*newest._memory() >= current._memory():
+            newest._materialize()
+            last.chain = 0.0
+        else:
+            self._history[-1] = _Delta(newest.getWidth(),newest._takeDelta())
+            last.chain = None
+
+    def _freeze(self):
+        """
+        Freezes the edit before the newest delta, if it is not frozen already.
+
+        A full Image is frozen unless it is a copy-on-write copy of an image
+        that still exists (such as the original), since it then owns little
+        more than its saved tiles. A copy whose source has replaced its
+        storage (as reorient does) owns the old storage, so it is frozen.
         """
-        self._history.append(self.getCurrent().copy())
-        if len(self._history) > self.MAX_HISTORY:
-            self._history.pop(0)
+        if len(self._history) > 3:
+            entry = self._history[-4]
+            if isinstance(entry,_Delta) or (isinstance(entry,a6image.Image) and
+                                            not entry._isShared()):
+                self._history[-4] = _Frozen(entry)
+
+    def _enforce(self):
+        """
+        Spills and deletes old edits until the history is within its limits.
+
+        Only edits before the newest delta are spilled or deleted, so that the
+        next undo is always fast. Deleting the oldest edit takes constant
+        time, as the history is a deque.
+        """
+        memory = self.getMemoryUse()
+        while memory > self.HISTORY_MEMORY and self._spilled < len(self._history)-3:
+            entry = self._history[self._spilled]
+            if isinstance(entry,_Frozen) and entry.path is None:
+                if self.HISTORY_DISK == 0:
+                    memory -= entry.getMemory()
+                    self._evict()
+                    continue
+                memory -= entry.getMemory()
+                entry.spill(self._spillDirectory())
+                self._disk += entry.getDisk()
+            self._spilled += 1
+
+        limit = self.MAX_HISTORY
+        while len(self._history) > 2 and (self._disk > self.HISTORY_DISK or
+                                          (not limit is None and len(self._history) > limit)):
+            self._evict()
+
+    def _evict(self):
+        """
+        Deletes the oldest edit in the history.
+
+        Any edits that were rebuilt from it (by replay) are deleted as well.
+        """
+        first = True
+        while first or (len(self._history) > 2 and isinstance(self._history[0],_Replay)):
+            first = False
+            entry = self._history.popleft()
+            self._journal.popleft()
+            if self._spilled > 0:
+                self._spilled -= 1
+            if isinstance(entry,_Frozen):
+                self._disk -= entry.getDisk()
+                entry.discard()
+
+    def _rebuild(self, pos):
+        """
+        Returns the edit at the given position, rebuilt from the journal.
+
+        The journal is replayed on a new editor of the same class, starting
+        at the nearest full image before the edit. The result is a tuple of
+        the image and its pending orientation.
+
+        Parameter pos: The position of the edit in the history
+        Precondition: pos is an int, and the edit at pos is a _Replay
+        """
+        start = pos
+        while isinstance(self._history[start],_Replay):
+            start -= 1
+        image = self._history[start]
+        if isinstance(image,_Frozen):
+            image = image.peek()
+
+        editor = self.__class__(image)
+        editor._journal[-1].orientation = self._journal[start].orientation
+        for step in range(start+1,pos+1):
+            for name, args, kwargs in self._journal[step].ops:
+                getattr(editor,name)(*args,**kwargs)
+        return (editor._history[-1], editor._journal[-1].orientation)
+
+    def _spillDirectory(self):
+        """
+        Returns the directory for spilled edits, creating it if necessary.
+
+        The directory is deleted along with this edit history (or when the
+        application exits).
+        """
+        if self._directory is None:
+            import shutil, tempfile, weakref
+            self._directory = tempfile.mkdtemp(prefix='imager-history-')
+            weakref.finalize(self,shutil.rmtree,self._directory,True)
+        return self._directory
+
+    def _reopen(self):
+        """
+        Turns a delta just before the current image back into an Image.
+
+        A delta is only valid while the edit after it does not change. So
+        after an undo, the newest delta becomes a copy-on-write copy of the
+        current image again, which stays correct if the image is changed
+        before the next increment. A frozen edit is thawed first.
+        """
+        if len(self._history) < 2:
+            self._spilled = 0
+            return
+
+        if self._spilled > len(self._history)-2:
+            self._spilled = len(self._history)-2
+        entry = self._history[-2]
+        if isinstance(entry,_Frozen):
+            self._disk -= entry.getDisk()
+            entry = entry.thaw()
+            self._history[-2] = entry
+        if isinstance(entry,_Delta):
+            self._history[-2] = self._history[-1]._copyWithDelta(entry.width,entry.tiles)
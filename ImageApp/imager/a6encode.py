@@ -6,12 +6,69 @@ that are called by the application. Note that this class is a subclass of Filter
 This allows us to layer this functionality on top of the Instagram-filters,
 providing this functionality in one application.
 
+A message is hidden one byte per pixel, in the last digits of the red, green
+and blue values. The pixels are changed many at a time: with NumPy if it is
+installed, and otherwise with maps over the channel values.
+
+A message is stored in a frame. The first HEADER pixels hold the marker
+FRAME, the format (VERSION, in the high four bits), the length of the
+message (4 bytes) and a checksum (the low 2 bytes of its CRC-32). The
+message follows, so decode reads exactly the header and length pixels. A
+message is read from, or written to, a file in chunks (see encodeStream and
+decodeStream), so it is never all in memory at once.
+
+The format has flags in its low four bits. If COMPRESSED is set, the message
+was compressed with zlib before it was hidden, and decode decompresses it.
+Text usually compresses several times over, so this fits longer messages
+in an image, and changes fewer pixels (which keeps the history small).
+
+Older versions marked a message with START before it and END after it (the
+legacy format). The method decode still finds messages in that format. The
+pixel-by-pixel versions (_encodeLoop and _decodeLoop) are kept as the
+reference for it, and the tests check that the results are the same.
+
 Based on an original file by Dexter Kozen (dck10) and Walker White (wmw2)
 
 Author: Adam Kadhim (ak779) and Calvin Johnson (clj78)
 Date:   November 20, 2019
 """
+import a6editor
 import a6filter
+import a6image
+import a6lut
+
+# The values of the pixels that mark the start of a framed message ('fra', in the style of START)
+FRAME = (16, 218, 31)
+
+# The version of the frame format
+VERSION = 2
+
+# The number of pixels in the frame header (marker, format, length and checksum)
+HEADER = 10
+
+# The format flag of a compressed message, and all of the known flags
+COMPRESSED = 1
+FLAGS = COMPRESSED
+
+# The zlib level of compressed messages
+LEVEL = 6
+
+# The largest framed message (in bytes)
+LIMIT = 2**32-1
+
+# The values of the pixels that mark the start and the end of a legacy message
+START = (17, 28, 33, 43, 54, 113)
+END = (14, 213, 33)
+
+# The tables of the pure Python versions of encode and decode (see _embed_bytes)
+_TENS = [value-value % 10 for value in range(256)]
+_FIXED = bytes(value if value <= 255 else value-10 for value in range(260))
+_DIGITS = tuple(bytes(value//place % 10 for value in range(256)) for place in (100,10,1))
+_WEIGHTED = tuple([place*(value % 10) for value in range(256)] for place in (100,10,1))
+
+# The last digit of each channel value, and those digits for the end marker (see _find_end)
+_LAST = bytes(value % 10 for value in range(256))
+_MARKER = bytes(value//place % 10 for value in END for place in (100,10,1))
 
 
 class Encoder(a6filter.Filter):
@@ -25,44 +82,139 @@ class Encoder(a6filter.Filter):
 
     Both the `encode` and `decode` methods should work with the most recent
     image in the edit history.
+
+    The last message found by decode is remembered, with the pixels it was
+    read from. The next decode returns it again unless one of those pixels
+    has changed since (see Image._takeChanges), so that checking for a
+    message after every edit is cheap.
+
+    Attribute CHUNK_SIZE: A CLASS ATTRIBUTE for the bytes of a message handled at once
+    Invariant: CHUNK_SIZE is an int > 0
     """
+    # Attribute _message: The last result of decode, and the pixels it depends on
+    # Invariant: _message is None, or a tuple (image, text, stop) where text is
+    # the result of decode for image, which depends only on pixels 0..stop-1
+    _message = None
+
+    # The number of bytes of a message to read, hide or find at once
+    CHUNK_SIZE = 256*1024
 
-    def encode(self, text):
+    @a6editor.journaled
+    def encode(self, text, compress=None):
         """
         Returns True if it could hide the text; False otherwise.
 
         This method attemps to hide the given message text in the current
-        image. This method first converts the text to a byte list using the
+        image. This method first converts the text to bytes using the
         encode() method in string to use UTF-8 representation:
 
-            blist = list(text.encode('utf-8'))
+            data = text.encode('utf-8')
 
         This allows the encode method to support all text, including emojis.
 
-        The method indicates the start of the message with the monoalphabetic
-        values of 'hidden' encoded in the first 6 pixels with succesive values
-        in front such that:
+        The bytes are stored in a frame (see encodeStream), which takes 10
+        pixels on top of one pixel per byte. If the picture does not have
+        enough pixels to store these bytes, this method returns False without
+        storing the message. However, if the number of bytes is less than
+        (# pixels - 10), then the encoding should succeed.
 
-            The values 7,8,3,3,4,13 (monoalphabetic for 'Hidden') turn into...
-                17,28,33,43,54,113
+        The bytes may be compressed first. By default, they are compressed if
+        that makes them shorter (so the message takes fewer pixels).
 
-            *Note that 13 (monoalphabetic 'n') was arbitrarily turned into
-             113 since 613 would have been too large (> 255)
+        Parameter text: a message to hide
+        Precondition: text is a string
+
+        Parameter compress: Whether to compress the message (None to decide)
+        Precondition: compress is a bool or None
+        """
+        import zlib
+        assert type(text) == str, 'text must be a string'
+        assert compress in [True,False,None], repr(compress)+' is not a bool or None'
+        data = text.encode('utf-8')
+        if compress != False:
+            packed = zlib.compress(data,LEVEL)
+            if compress or len(packed) < len(data):
+                return self._frame([packed],COMPRESSED)
+        return self._frame([data],0)
+
+    def encodeStream(self, stream, compress=False):
+        """
+        Returns True if it could hide the bytes read from stream; False otherwise.
+
+        The bytes are read (until the end of the stream) and hidden in chunks of
+        CHUNK_SIZE, starting after the frame header. The header, with the length
+        and checksum, is written last. If the stream holds more bytes than the
+        image has room for, the pixels are put back as they were, and this
+        method returns False.
+
+        If compress is True, the bytes are compressed as they are read. Unlike
+        encode, this method cannot tell in advance whether that helps.
+
+        This method is not journaled, as the stream cannot be read again. So
+        an edit made with it can be undone, but not redone.
+
+        Parameter stream: The bytes to hide
+        Precondition: stream is a binary file-like object open for reading
+
+        Parameter compress: Whether to compress the bytes
+        Precondition: compress is a bool
+        """
+        assert type(compress) == bool, repr(compress)+' is not a bool'
+        chunks = iter(lambda: stream.read(self.CHUNK_SIZE),b'')
+        if compress:
+            return self._frame(_deflate(chunks),COMPRESSED)
+        return self._frame(chunks,0)
+
+    def decodeStream(self, stream):
+        """
+        Returns True if it found a framed message, writing it to stream; False otherwise.
+
+        The message is read in chunks of CHUNK_SIZE bytes, and each chunk is
+        written to the stream as soon as it is read (after decompressing it,
+        if the message is compressed). The result is False if the current
+        image has no frame header, or if the message does not match its
+        checksum (in which case some of it may be written already). Messages
+        in the legacy format are not found (see decode).
+
+        Parameter stream: The file to write the message to
+        Precondition: stream is a binary file-like object open for writing
+        """
+        current = self.getCurrent()
+        frame = _read_header(current)
+        return not frame is None and _unframe(current,frame,stream,self.CHUNK_SIZE)
+
+    def decode(self):
+        """
+        Returns the secret message (a string) stored in the current image.
+
+        The message should be decoded as a list of bytes. Assuming that a list
+        blist has only bytes (ints in 0.255), you can turn it into a string
+        using UTF-8 with the decode method:
 
-        The same methodology is applied to indicate the end of the message with
-        the monoalphabetic values of 'end' encoded in the last 3 pixels with
-        succesive values in front in the same way as before.
+            text = bytes(blist).decode('utf-8')
 
-        This method also makes sure there are enough pixels to encode to begin
-        with since 9 are needed for the begining and end phrase on top of
-        however many bytes the text is.
+        If no message is detected, or if there is an error in decoding the
+        message, this method returns None
 
-        If the text UTF-8 encoding requires more than 999999 bytes or the
-        picture does not have enough pixels to store these bytes, this method
-        returns False without storing the message. However, if the number of
-        bytes is both less than 1000000 and less than (# pixels - 10), then
-        the encoding should succeed.  So this method uses no more than 10
-        pixels to store additional encoding information.
+        Messages in a frame (see encode) and in the legacy format (marked by
+        START and END) are both found.
+        """
+        current = self.getCurrent()
+        changes = current._takeChanges()
+        if (not self._message is None and self._message[0] is current and
+            (changes is None or changes[0] >= self._message[2])):
+            return self._message[1]
+
+        text, stop = self._scan(current)
+        self._message = (current, text, stop)
+        return text
+
+    # These are the pixel-by-pixel versions of encode and decode. They are
+    # much slower, but they are easy to check, so the tests compare them
+    # against the methods above.
+    def _encodeLoop(self, text):
+        """
+        Returns True if it could hide the text, one pixel at a time (see encode)
 
         Parameter text: a message to hide
         Precondition: text is a string
@@ -105,18 +257,10 @@ class Encoder(a6filter.Filter):
 
         return True
 
-    def decode(self):
+    def _decodeLoop(self):
         """
-        Returns the secret message (a string) stored in the current image.
-
-        The message should be decoded as a list of bytes. Assuming that a list
-        blist has only bytes (ints in 0.255), you can turn it into a string
-        using UTF-8 with the decode method:
-
-            text = bytes(blist).decode('utf-8')
-
-        If no message is detected, or if there is an error in decoding the
-        message, this method returns None
+        Returns the secret message stored in the current image, one pixel at a
+        time (see decode)
         """
         current = self.getCurrent()
         start = []
@@ -151,6 +295,91 @@ class Encoder(a6filter.Filter):
             return None
 
     # HELPER METHODS
+    def _frame(self, chunks, flags):
+        """
+        Returns True if it could hide the chunks in a frame; False otherwise.
+
+        The chunks are hidden one after the other, after the frame header,
+        and then the header is written. If they do not fit, the pixels are
+        put back as they were.
+
+        Parameter chunks: The bytes to hide
+        Precondition: chunks is an iterable of bytes objects
+
+        Parameter flags: The flags of the format (see FLAGS)
+        Precondition: flags is an int in 0..15
+        """
+        import zlib
+        current = self.getCurrent()
+        room = min(len(current)-HEADER,LIMIT)
+        if room < 0:
+            return False
+
+        saved = bytearray()     # The pixels to put back, if the message does not fit
+        length = 0
+        checksum = 0
+        for chunk in chunks:
+            if length+len(chunk) > room:
+                if saved:
+                    current._setSpan(HEADER,a6image._from_bytes(saved,current.getBackend()))
+                return False
+            saved += _embed(current,HEADER+length,chunk)
+            checksum = zlib.crc32(chunk,checksum)
+            length += len(chunk)
+
+        _embed(current,0,_header(length,checksum,flags))
+        return True
+
+    def _scan(self, current):
+        """
+        Returns the result of decode for the given image, and the pixels it depends on.
+
+        The result is a pair (text, stop), where the text (or None) depends
+        only on the pixels 0..stop-1.
+
+        Parameter current: The image to decode
+        Precondition: current is an Image object
+        """
+        import io
+        frame = _read_header(current)
+        if not frame is None:
+            stream = io.BytesIO()
+            stop = HEADER+frame[1]
+            if not _unframe(current,frame,stream,self.CHUNK_SIZE):
+                return (None, stop)
+            try:
+                return (stream.getvalue().decode('utf-8'), stop)
+            except ValueError:
+                return (None, stop)
+
+        # Most images have no message, so check the legacy start marker first
+        if len(current) < len(START):
+            return (None, len(current))
+        head = a6image._to_bytes(current._span(0,len(START)))
+        if tuple(_values_bytes(head)) != START:
+            return (None, min(len(current),HEADER))
+
+        # Find the end marker in the last digits of the channels, in one scan
+        digits = bytes(current.getBuffer(True)).translate(_LAST)
+        end = _find_end(digits,len(START))
+        if end is None or end == 0:     # The end marker is missing or cut off
+            return (None if end is None else '', len(current))
+        stop = end+len(END)
+        digits = digits[3*len(START):3*end]
+
+        numpy = a6lut._vectorize(current)
+        try:
+            if numpy is None:
+                message = bytes(_values_bytes(digits))
+            else:
+                values = _values_array(numpy.frombuffer(digits,dtype=numpy.uint8))
+                if len(values) > 0 and values.max() > 255:
+                    return (None, stop)
+                message = values.astype(numpy.uint8).tobytes()
+            return (message.decode('utf-8'), stop)
+        except ValueError:      # A value above 255, or bad UTF-8
+            return (None, stop)
+
     def _decode_pixel(self, pos):
         """
         Return: the number n hidden in pixel pos of the current image.
@@ -217,3 +446,250 @@ class Encoder(a6filter.Filter):
         #Sets the pixel to the encrypted rgb values
         new_rgb = tuple(new_rgb)
         current[pos] = new_rgb
+
+
+def _header(length, checksum, flags=0):
+    """
+    Returns the bytes of the frame header for a message.
+
+    Parameter length: The number of bytes in the message
+    Precondition: length is an int in 0..LIMIT
+
+    Parameter checksum: The CRC-32 of the message
+    Precondition: checksum is an int in 0..2**32-1
+
+    Parameter flags: The flags of the format (see FLAGS)
+    Precondition: flags is an int in 0..15
+    """
+    format = VERSION << 4 | flags
+    return bytes(FRAME)+bytes([format])+length.to_bytes(4,'big')+(checksum & 0xFFFF).to_bytes(2,'big')
+
+
+def _read_header(image):
+    """
+    Returns the frame header of image as a tuple (flags, length, checksum), or None.
+
+    The result is None if image does not start with a frame header, or if the
+    length in it does not fit in the image. The flags are the low four bits
+    of the format, and only those in FLAGS are allowed.
+
+    Parameter image: The image to check
+    Precondition: image is an Image object
+    """
+    if len(image) < HEADER:
+        return None
+    values = _read(image,0,HEADER)
+    if values is None or tuple(values[:len(FRAME)]) != FRAME:
+        return None
+
+    format = values[len(FRAME)]
+    length = int.from_bytes(values[len(FRAME)+1:len(FRAME)+5],'big')
+    checksum = int.from_bytes(values[len(FRAME)+5:HEADER],'big')
+    if format >> 4 != VERSION or format & 15 & ~FLAGS or length > len(image)-HEADER:
+        return None
+    return (format & 15, length, checksum)
+
+
+def _unframe(image, frame, stream, chunk):
+    """
+    Returns True if the message after the frame header matches its checksum.
+
+    The message is written to stream in pieces of chunk bytes, as it is read.
+    A compressed message is decompressed as it is written, and the result is
+    False if it is not valid zlib data. The checksum is of the hidden bytes.
+
+    Parameter image: The image with the message
+    Precondition: image is an Image object
+
+    Parameter frame: The frame header of image (see _read_header)
+    Precondition: frame is a tuple (flags, length, checksum)
+
+    Parameter stream: The file to write the message to
+    Precondition: stream is a binary file-like object open for writing
+
+    Parameter chunk: The number of bytes to read at once
+    Precondition: chunk is an int > 0
+    """
+    import zlib
+    flags, length, checksum = frame
+    inflater = zlib.decompressobj() if flags & COMPRESSED else None
+    result = 0
+    try:
+        for pos in range(HEADER,HEADER+length,chunk):
+            data = _read(image,pos,min(chunk,HEADER+length-pos))
+            if data is None:
+                return False
+            result = zlib.crc32(data,result)
+            stream.write(data if inflater is None else inflater.decompress(data))
+        if not inflater is None:
+            stream.write(inflater.flush())
+            if not inflater.eof:
+                return False
+    except zlib.error:
+        return False
+    return result & 0xFFFF == checksum
+
+
+def _deflate(chunks):
+    """
+    Yields the chunks compressed with zlib, as one stream.
+
+    Parameter chunks: The bytes to compress
+    Precondition: chunks is an iterable of bytes objects
+    """
+    import zlib
+    deflater = zlib.compressobj(LEVEL)
+    for chunk in chunks:
+        data = deflater.compress(chunk)
+        if data:
+            yield data
+    yield deflater.flush()
+
+
+def _embed(image, pos, payload):
+    """
+    Hides the bytes of payload in image, starting at pixel pos, and returns the old pixels.
+
+    The old pixels are packed bytes (see Image.getBuffer).
+
+    Parameter image: The image to change
+    Precondition: image is an Image object
+
+    Parameter pos: The first pixel to change
+    Precondition: pos is an int >= 0, and pos+len(payload) <= len(image)
+
+    Parameter payload: The bytes to hide
+    Precondition: payload is a bytes object
+    """
+    data = a6image._to_bytes(image._span(pos,len(payload)))
+    if not a6lut._vectorize(image) is None:
+        result = _embed_array(data,payload)
+    else:
+        result = _embed_bytes(data,payload)
+    image._setSpan(pos,a6image._from_bytes(result,image.getBackend()))
+    return data
+
+
+def _read(image, pos, count):
+    """
+    Returns the bytes hidden in count pixels of image, starting at pos, or None.
+
+    The result is None if any of the pixels hides a number above 255.
+
+    Parameter image: The image to read
+    Precondition: image is an Image object
+
+    Parameter pos: The first pixel to read
+    Precondition: pos is an int >= 0, and pos+count <= len(image)
+
+    Parameter count: The number of pixels to read
+    Precondition: count is an int >= 0
+    """
+    data = a6image._to_bytes(image._span(pos,count))
+    numpy = a6lut._vectorize(image)
+    if numpy is None:
+        values = _values_bytes(data)
+        return None if values and max(values) > 255 else bytes(values)
+
+    values = _values_array(numpy.frombuffer(data,dtype=numpy.uint8))
+    if len(values) > 0 and values.max() > 255:
+        return None
+    return values.astype(numpy.uint8).tobytes()
+
+
+def _embed_array(data, payload):
+    """
+    Returns packed pixels with the bytes of payload hidden in them, using NumPy.
+
+    Each byte is hidden in one pixel, as the last digits of its red, green
+    and blue values (hundreds, tens and ones). A channel value that would be
+    above 255 is reduced by 10. This gives the same pixels as _encode_pixel.
+
+    Parameter data: The pixels to change
+    Precondition: data is a bytes object with 3 bytes per byte of payload
+
+    Parameter payload: The bytes to hide
+    Precondition: payload is a bytes object
+    """
+    import numpy
+    channels = numpy.frombuffer(data,dtype=numpy.uint8).astype(numpy.int16).reshape(-1,3)
+    values = numpy.frombuffer(payload,dtype=numpy.uint8).astype(numpy.int16)
+    digits = numpy.stack((values//100,values//10 % 10,values % 10),axis=1)
+    result = channels - channels % 10 + digits
+    result[result > 255] -= 10
+    return result.astype(numpy.uint8).tobytes()
+
+
+def _embed_bytes(data, payload):
+    """
+    Returns packed pixels with the bytes of payload hidden in them.
+
+    This is the pure Python version of _embed_array.
+
+    Parameter data: The pixels to change
+    Precondition: data is a bytes object with 3 bytes per byte of payload
+
+    Parameter payload: The bytes to hide
+    Precondition: payload is a bytes object
+    """
+    # Each step is a map over all the channels, so the loops run in C
+    import operator
+    digits = bytearray(len(data))
+    for channel in range(3):
+        digits[channel::3] = payload.translate(_DIGITS[channel])
+    values = map(operator.add,map(_TENS.__getitem__,data),digits)
+    return bytes(map(_FIXED.__getitem__,values))
+
+
+def _values_array(array):
+    """
+    Returns the NumPy array of the numbers hidden in each pixel (see _decode_pixel).
+
+    Parameter array: The pixels of an image
+    Precondition: array is a NumPy array of uint8 with 3 values per pixel
+    """
+    import numpy
+    digits = (array.reshape(-1,3) % 10).astype(numpy.int16)
+    return digits[:,0]*100 + digits[:,1]*10 + digits[:,2]
+
+
+def _values_bytes(data):
+    """
+    Returns the list of the numbers hidden in each pixel (see _decode_pixel).
+
+    This is the pure Python version of _values_array.
+
+    Parameter data: The pixels of an image (see Image.getBuffer)
+    Precondition: data is a bytes-like object with 3 bytes per pixel
+    """
+    import operator
+    hundreds, tens, ones = _WEIGHTED
+    values = map(operator.add,map(hundreds.__getitem__,data[0::3]),map(tens.__getitem__,data[1::3]))
+    return list(map(operator.add,values,map(ones.__getitem__,data[2::3])))
+
+
+def _find_end(digits, start):
+    """
+    Returns the position of the first end marker, as decode would find it.
+
+    The digits are the last digits of every channel value of an image, so the
+    end marker is a match of _MARKER that begins at a multiple of 3. Like the
+    pixel-by-pixel search (see Encoder._decodeLoop), the result is None if the
+    last pixels could start an end marker that does not fit in the image, and
+    0 if there is no end marker (which is an empty message).
+
+    Parameter digits: The last digit of each channel value (see _LAST)
+    Precondition: digits is a bytes object with 3 bytes per pixel
+
+    Parameter start: The first pixel that could start the end marker
+    Precondition: start is an int >= 0
+    """
+    pos = digits.find(_MARKER,3*start)
+    while pos >= 0 and pos % 3 != 0:
+        pos = digits.find(_MARKER,pos+1)
+    if pos >= 0:
+        return pos//3
+
+    if digits[-3:] == _MARKER[:3] or (len(digits) >= 6 and digits[-6:] == _MARKER[:6]):
+        return None
+    return 0
@@ -16,6 +16,224 @@ Author: Adam Kadhim (ak779) and Calvin Johnson (clj78)
 Date:   November 20, 2019
 """
 import a6editor
+import a6lut
+import collections
+
+# The most vignette masks to keep (see vignette_mask)
+MASK_CACHE = 4
+
+# The most bytes of vignette masks to keep; 64 MB holds the mask of an 8 MP image
+MASK_BYTES = 64*2**20
+
+# The vignette masks made so far, least recently used first
+_MASKS = collections.OrderedDict()
+
+# The ways to run a filter (see Filter.EXECUTION)
+SERIAL    = 'serial'
+THREADS   = 'threads'
+PROCESSES = 'processes'
+MODES = (SERIAL, THREADS, PROCESSES)
+
+# The pools of workers for each mode, with their sizes (see _pool)
+_POOLS = {}
+
+
+def vignette_mask(width, height, start=0, stop=None):
+    """
+    Returns the vignette factor of every pixel of a width x height image.
+
+    The factor of the pixel at (row, col) is 1 - (d / hfD)^2, computed exactly
+    as Filter._vignetteLoop does (see Filter.vignette). The squared distance
+    to the center is the sum of a term for the column and a term for the row,
+    so the mask is made from those two vectors. It is still put through the
+    square root and squared again, as the rounding of those steps is part of
+    the result.
+
+    If NumPy is installed, the mask is a read-only height x width array of
+    floats. Otherwise it is a list of rows, each a list of floats. Factors
+    below 0 (from rounding at the corners) are replaced by 0, which does not
+    change any pixel. The last MASK_CACHE masks are cached, so that images of
+    the same size share a mask, as long as they use no more than MASK_BYTES in
+    all. A mask larger than MASK_BYTES is never cached.
+
+    If start or stop is given, only the rows start..stop-1 are returned.
+    They come from the cached mask if there is one, but they are not cached
+    themselves, as they are for a part of an image.
+
+    Parameter width: The image width
+    Precondition: width is an int > 0
+
+    Parameter height: The image height
+    Precondition: height is an int > 0
+
+    Parameter start: The first row of the mask
+    Precondition: start is an int, 0 <= start < height
+
+    Parameter stop: The row after the last row of the mask (None for height)
+    Precondition: stop is None or an int, start < stop <= height
+    """
+    assert type(width) == int and width > 0, repr(width)+' is not a valid width'
+    assert type(height) == int and height > 0, repr(height)+' is not a valid height'
+    stop = height if stop is None else stop
+    assert type(start) == int and 0 <= start < height, repr(start)+' is not a valid row'
+    assert type(stop) == int and start < stop <= height, repr(stop)+' is not a valid row'
+    key = (width,height)
+    if start > 0 or stop < height:
+        mask = _MASKS.get(key)
+        return _make_mask(width,height,start,stop) if mask is None else mask[start:stop]
+    if key in _MASKS:
+        _MASKS.move_to_end(key)
+        return _MASKS[key]
+
+    mask = _make_mask(width,height,0,height)
+    if _mask_bytes(mask) > MASK_BYTES:
+        return mask
+    _MASKS[key] = mask
+    while (len(_MASKS) > MASK_CACHE or
+           sum(map(_mask_bytes,_MASKS.values())) > MASK_BYTES):
+        _MASKS.popitem(last=False)
+    return mask
+
+
+def _mask_bytes(mask):
+    """
+    Returns the (approximate) number of bytes used by a vignette mask.
+
+    A list mask is counted as 32 bytes a factor: a float object and the
+    reference to it.
+
+    Parameter mask: The mask
+    Precondition: mask is a result of _make_mask
+    """
+    if isinstance(mask,list):
+        return 32*len(mask)*len(mask[0])
+    return mask.nbytes
+
+
+def _make_mask(width, height, start, stop):
+    """
+    Returns the rows start..stop-1 of a new vignette mask (see vignette_mask).
+
+    Parameter width: The image width
+    Precondition: width is an int > 0
+
+    Parameter height: The image height
+    Precondition: height is an int > 0
+
+    Parameter start: The first row of the mask
+    Precondition: start is an int, 0 <= start < height
+
+    Parameter stop: The row after the last row of the mask
+    Precondition: stop is an int, start < stop <= height
+    """
+    import a6image
+    center = (width/2, height/2)
+    scale = ((center[0]**2 + center[1]**2)**0.5)**2
+    numpy = a6image._numpy()
+    if not numpy is None:
+        # float_power calls the C pow, like ** on floats (numpy ** may not)
+        cols = (center[0]-numpy.arange(width))**2
+        rows = (center[1]-numpy.arange(start,stop))**2
+        dist = numpy.float_power(rows[:,None]+cols[None,:],0.5)
+        mask = numpy.maximum(1-numpy.float_power(dist,2)/scale,0)
+        mask.flags.writeable = False
+    else:
+        import itertools, operator
+        cols = [(center[0]-x)**2 for x in range(width)]
+        mask = []
+        for y in range(start,stop):
+            dist = map(pow,map(operator.add,cols,itertools.repeat((center[1]-y)**2)),
+                           itertools.repeat(0.5))
+            ratio = map(operator.truediv,map(pow,dist,itertools.repeat(2)),itertools.repeat(scale))
+            mask.append([max(1-value,0) for value in ratio])
+    return mask
+
+
+def _pool(mode, workers):
+    """
+    Returns the pool of workers for the given mode, creating it if necessary.
+
+    The pools are shared by all filters, and a pool is only replaced if the
+    number of workers changes. The pool of processes uses the 'spawn' start
+    method, so the workers do not copy the threads and windows of the
+    application.
+
+    Parameter mode: The kind of workers
+    Precondition: mode is THREADS or PROCESSES
+
+    Parameter workers: The number of workers
+    Precondition: workers is an int > 1
+    """
+    if not mode in _POOLS or _POOLS[mode][1] != workers:
+        if mode in _POOLS:
+            _POOLS[mode][0].shutdown(wait=False)
+        if mode == THREADS:
+            from concurrent.futures import ThreadPoolExecutor
+            pool = ThreadPoolExecutor(workers,thread_name_prefix='filter')
+        else:
+            import multiprocessing
+            from concurrent.futures import ProcessPoolExecutor
+            context = multiprocessing.get_context('spawn')
+            pool = ProcessPoolExecutor(workers,mp_context=context)
+        _POOLS[mode] = (pool, workers)
+    return _POOLS[mode][0]
+
+
+def _attach(name):
+    """
+    Returns the shared memory block with the given name, from a worker process.
+
+    The block belongs to the process that created it, which also unlinks it.
+    So the worker does not track it (in Python 3.13+). Older versions track
+    it anyway, but the workers share the resource tracker of the application,
+    which then sees the block unlinked just once.
+
+    Parameter name: The name of the block
+    Precondition: name is the name of an existing shared memory block
+    """
+    from multiprocessing import shared_memory
+    try:
+        return shared_memory.SharedMemory(name=name,track=False)
+    except TypeError:   # Before Python 3.13
+        return shared_memory.SharedMemory(name=name)
+
+
+def _work(name, shape, start, stop, method, args):
+    """
+    Applies a filter method to a band of an image in shared memory.
+
+    This function runs in a worker process (see Filter._parallel). The band is
+    changed in place.
+
+    Parameter name: The name of the shared memory block with the image
+    Precondition: name is a string
+
+    Parameter shape: The height, width and 3 (the image is packed in the block)
+    Precondition: shape is a tuple of 3 ints
+
+    Parameter start: The first row of the band
+    Precondition: start is an int, 0 <= start < height
+
+    Parameter stop: The row after the last row of the band
+    Precondition: stop is an int, start < stop <= height
+
+    Parameter method: The name of the method to call
+    Precondition: method is a method of Filter that only changes pixels
+
+    Parameter args: The arguments to the method
+    Precondition: args is a tuple
+    """
+    import numpy
+    import a6image
+    block = _attach(name)
+    array = image = None
+    try:
+        array = numpy.ndarray(shape,dtype=numpy.uint8,buffer=block.buf)
+        image = a6image.Image._trusted(array[start:stop].reshape(-1,3),shape[1],a6image.NUMPY)
+        getattr(_Band(image,start,shape[0]),method)(*args)
+    finally:
+        array = image = None    # The block cannot close while these use it
+        block.close()
 
 
 class Filter(a6editor.Editor):
@@ -34,92 +252,119 @@ class Filter(a6editor.Editor):
 
     Each one of the non-hidden functions should edit the most recent image
     in the edit history (which is inherited from Editor).
+
+    The non-hidden functions that change the image are marked with the
+    decorator a6editor.journaled, so that the edit history can replay them.
+    They must only depend on the current image and their arguments.
+
+    The pointwise filters and pixellate can split the image into bands of
+    rows, and change them with a pool of WORKERS workers (see _parallel).
+    The workers are either threads, which share the image (NumPy releases
+    the GIL in its loops), or processes, which get the image in shared
+    memory. Processes take longer to start, so they only pay off on larger
+    images. The mode is EXECUTION, which can be set for the class, for one
+    filter object, or for a few calls (see using). By default, the mode is
+    picked by the size of the image: PROCESSES for at least PARALLEL_SIZE
+    pixels, THREADS for at least THREAD_SIZE pixels, and SERIAL otherwise.
+    Both THREADS and PROCESSES need NumPy, and THREADS does not work with
+    'list' images. Where a mode cannot be used, the filter is run serially.
+
+    Attribute WORKERS: A CLASS ATTRIBUTE for the number of workers
+    Invariant: WORKERS is an int > 0, or None for one per CPU
+
+    Attribute EXECUTION: A CLASS ATTRIBUTE for how to run the filters
+    Invariant: EXECUTION is one of MODES, or None to pick by image size
+
+    Attribute THREAD_SIZE: A CLASS ATTRIBUTE for the fewest pixels for threads
+    Invariant: THREAD_SIZE is an int >= 0, or None to never pick threads
+
+    Attribute PARALLEL_SIZE: A CLASS ATTRIBUTE for the fewest pixels for processes
+    Invariant: PARALLEL_SIZE is an int >= 0, or None to never pick processes
     """
 
+    # The number of workers for large images
+    WORKERS = None
+
+    # How to run the filters (None to pick by the size of the image)
+    EXECUTION = None
+
+    # The number of pixels at which an image is split among threads
+    THREAD_SIZE = 512*1024
+
+    # The number of pixels at which an image is split among processes
+    PARALLEL_SIZE = 4*1024*1024
+
     # PROVIDED ACTIONS (STUDY THESE)
+    @a6editor.journaled
     def invert(self):
         """
         Inverts the current image, replacing each element with its color complement
+
+        The complement of each channel value comes from a lookup table (see
+        a6lut), which is applied to the whole image at once.
         """
-        current = self.getCurrent()
-        for pos in range(len(current)): # We can do this because of __len__
-            rgb = current[pos]          # We can do this because of __getitem__
-            red   = 255 - rgb[0]
-            green = 255 - rgb[1]
-            blue  = 255 - rgb[2]
-            rgb = (red,green,blue)      # New pixel value
-            current[pos] = rgb          # We can do this because of __setitem__
+        self._runStages([self._stage('invert',())])
 
+    @a6editor.journaled
     def transpose(self):
         """
         Transposes the current image
 
         Transposing is tricky, as it is hard to remember which values have been
-        changed and which have not.  To simplify the process, we copy the
-        current image and use that as a reference.  So we change the current
-        image with setPixel, but read (with getPixel) from the copy.
+        changed and which have not.  So rather than moving pixels one at a time
+        (see _transposeLoop), we reorder the whole image at once with
+        Image.reorient. That is put off until the image is next needed, so
+        that it can be combined with any rotations or reflections that follow.
         """
-        current  = self.getCurrent()
-        original = current.copy()
-        current.setWidth(current.getHeight())
-
-        for row in range(current.getHeight()):      # Loop over the rows
-            for col in range(current.getWidth()):   # Loop over the columnns
-                current.setPixel(row,col,original.getPixel(col,row))
+        self._orient((True,False,False))
 
+    @a6editor.journaled
     def reflectHori(self):
         """
         Reflects the current image around the horizontal middle.
+
+        Every row is reversed at once with Image.reorient (see _reflectHoriLoop
+        for the row-by-row version), when the image is next needed.
         """
-        current = self.getCurrent()
-        for h in range(current.getWidth()//2):      # Loop over the columnns
-            for row in range(current.getHeight()):  # Loop over the rows
-                k = current.getWidth()-1-h
-                current.swapPixels(row,h,row,k)
+        self._orient((False,False,True))
 
+    @a6editor.journaled
     def rotateRight(self):
         """
-        Rotates the current image left by 90 degrees.
+        Rotates the current image right by 90 degrees.
 
-        Technically, we can implement this via a transpose followed by a
-        vertical reflection. However, this is slow, so we use the faster
-        strategy below.
+        This is a transpose followed by a horizontal reflection. Image.reorient
+        does both in a single reordering of the pixels, which is much faster
+        than moving each pixel (see _rotateRightLoop). The reordering is put
+        off until the image is next needed.
         """
-        current  = self.getCurrent()
-        original = current.copy()
-        current.setWidth(current.getHeight())
-
-        for row in range(current.getHeight()):      # Loop over the rows
-            for col in range(current.getWidth()):   # Loop over the columnns
-                current.setPixel(row,col,original.getPixel(original.getHeight()-col-1,row))
+        self._orient((True,False,True))
 
+    @a6editor.journaled
     def rotateLeft(self):
         """
         Rotates the current image left by 90 degrees.
 
-        Technically, we can implement this via a transpose followed by a
-        vertical reflection. However, this is slow, so we use the faster
-        strategy below.
+        This is a transpose followed by a vertical reflection. Image.reorient
+        does both in a single reordering of the pixels, which is much faster
+        than moving each pixel (see _rotateLeftLoop). The reordering is put
+        off until the image is next needed.
         """
-        current  = self.getCurrent()
-        original = current.copy()
-        current.setWidth(current.getHeight())
-
-        for row in range(current.getHeight()):      # Loop over the rows
-            for col in range(current.getWidth()):   # Loop over the columnns
-                current.setPixel(row,col,original.getPixel(col,original.getWidth()-row-1))
+        self._orient((True,True,False))
 
     # ASSIGNMENT METHODS (IMPLEMENT THESE)
+    @a6editor.journaled
     def reflectVert(self):
         """
         Reflects the current image around the vertical middle.
+
+        This reverses the order of the rows at once with Image.reorient (see
+        _reflectVertLoop for the version that swaps the rows one pair at a time),
+        when the image is next needed.
         """
-        current = self.getCurrent()
-        for h in range(current.getHeight()//2):      # Loop over the rows
-            for col in range(current.getWidth()):  # Loop over the columns
-                k = current.getHeight()-1-h
-                current.swapPixels(h,col,k,col)
+        self._orient((False,True,False))
 
+    @a6editor.journaled
     def monochromify(self, sepia):
         """
         Converts the current image to monochrome (greyscale or sepia tone).
@@ -133,34 +378,39 @@ class Filter(a6editor.Editor):
         If sepia is True, it makes the same computations as before but sets
         green to 0.6 * brightness and blue to 0.4 * brightness.
 
+        The brightness and the new pixels are computed with lookup tables (see
+        a6lut.apply_tone), which give exactly the same values as the formulas
+        above.
+
         Parameter sepia: Whether to use sepia tone instead of greyscale.
         Precondition: sepia is a bool
         """
         #Assert preconditions
         assert type(sepia) == bool, 'sepia must be a boolian type'
 
-        #Gets current image
-        current = self.getCurrent()
+        self._runStages([self._stage('monochromify',(sepia,))])
 
-        if sepia == False:
-            #Greyscale filter
-            for pos in range(len(current)):
-                rgb = current[pos]
-                brightness = (0.3*rgb[0]) + (0.6*rgb[1]) + (0.1*rgb[2])
-                brightness = int(brightness)
-                rgb = (brightness,brightness,brightness)
-                current[pos] = rgb
-        else:
-            #Sepia filter
-            for pos in range(len(current)):
-                rgb = current[pos]
-                brightness = (0.3*rgb[0]) + (0.6*rgb[1]) + (0.1*rgb[2])
-                g_brightness = int(0.6*brightness)
-                b_brightness = int(0.4*brightness)
-                brightness = int(brightness)
-                rgb = (brightness,g_brightness,b_brightness)
-                current[pos] = rgb
+    @a6editor.journaled
+    def applyLUT(self, red, green=None, blue=None):
+        """
+        Changes the current image with a channel lookup table for each color.
+
+        Each channel value v of every pixel is replaced by entry v of the
+        table for its channel. Tables can be made with the functions in
+        a6lut, such as a6lut.curve and a6lut.levels.
+
+        Parameter red: The channel table for red
+        Precondition: red is a bytes object of length 256
 
+        Parameter green: The channel table for green (None to use red)
+        Precondition: green is a bytes object of length 256 or None
+
+        Parameter blue: The channel table for blue (None to use red)
+        Precondition: blue is a bytes object of length 256 or None
+        """
+        self._runStages([self._stage('applyLUT',(red,green,blue))])
+
+    @a6editor.journaled
     def jail(self):
         """
         Puts jail bars on the current image
@@ -199,6 +449,7 @@ class Filter(a6editor.Editor):
             for x in range(num_bars):
                 self._drawVBar(int(round((x+1)*space_between)), red)
 
+    @a6editor.journaled
     def vignette(self):
         """
         Modifies the current image to simulates vignetting (corner darkening).
@@ -214,6 +465,197 @@ class Filter(a6editor.Editor):
         hfD (for half diagonal) is the distance from the center of the image
         to any of the corners.  The values d and hfD should be left as floats
         and not converted to ints.
+
+        The factors only depend on the size of the image, so they come from a
+        cached mask (see vignette_mask). Every channel is then multiplied by
+        the mask a band at a time (see _runStages), and truncated to an int
+        (see _vignetteLoop for the pixel-by-pixel version).
+        """
+        self._runStages([self._stage('vignette',())])
+
+    @a6editor.journaled
+    def fuse(self, ops):
+        """
+        Applies a sequence of filters to the current image.
+
+        Each op is the name of a method of this class and a tuple of its
+        arguments, such as ('monochromify',(True,)). Runs of consecutive
+        pointwise filters (invert, applyLUT, monochromify and vignette) are
+        fused: they are applied together in a single pass over the image,
+        one band of rows at a time. Adjacent channel tables are combined
+        into one. The pixels are still rounded to ints after every filter,
+        so the result is the same as calling the methods one by one. Other
+        filters are just called in order.
+
+        Parameter ops: The filters to apply
+        Precondition: ops is a list or tuple of pairs (name, args), where name
+        is the name of a journaled method and args is a tuple of its arguments
+        """
+        assert type(ops) in [list,tuple], repr(ops)+' is not a list of ops'
+        for op in ops:
+            assert type(op) in [list,tuple] and len(op) == 2, repr(op)+' is not an op'
+            assert type(op[0]) == str and type(op[1]) in [list,tuple], repr(op)+' is not an op'
+            assert hasattr(self.__class__,op[0]), repr(op[0])+' is not a filter'
+
+        stages = []
+        for name, args in ops:
+            stage = self._stage(name,tuple(args))
+            if stage is None:
+                self._runStages(stages)
+                stages = []
+                getattr(self,name)(*args)
+            elif stages and stages[-1][0] == stage[0] == 'table':
+                first, second = stages[-1][1], stage[1]
+                stages[-1] = ('table',tuple(first[c].translate(second[c]) for c in range(3)))
+            else:
+                stages.append(stage)
+        self._runStages(stages)
+
+    def using(self, mode):
+        """
+        Returns a context manager that sets EXECUTION for this object.
+
+        This picks the mode for a few calls, as in
+
+            with editor.using(a6filter.THREADS):
+                editor.vignette()
+
+        The mode is restored when the with statement ends.
+
+        Parameter mode: How to run the filters
+        Precondition: mode is one of MODES, or None to pick by image size
+        """
+        import contextlib
+        assert mode is None or mode in MODES, repr(mode)+' is not an execution mode'
+
+        @contextlib.contextmanager
+        def context():
+            saved = self.__dict__.get('EXECUTION',self)
+            self.EXECUTION = mode
+            try:
+                yield self
+            finally:
+                if saved is self:
+                    del self.EXECUTION
+                else:
+                    self.EXECUTION = saved
+        return context()
+
+    # OPTIONAL METHOD
+    @a6editor.journaled
+    def pixellate(self,step):
+        """
+        Pixellates the current image to give it a blocky feel.
+
+        To pixellate an image, start with the top left corner (e.g. the first
+        row and column).  Average the colors of the step x step block to the
+        right and down from this corner (if there are less than step rows or
+        step columns, go to the edge of the image). Then assign that average
+        to ALL of the pixels in that block.
+
+        When you are done, skip over step rows and step columns to go to the
+        next corner pixel.  Repeat this process again.  The result will be a
+        pixellated image.
+
+        Rather than summing each block on its own (see _pixellateLoop), the
+        sums come from a summed-area table (see _blockTable), so each average
+        is four lookups. Every band of blocks is then filled at once. The cost
+        no longer depends on step. Large images are split into bands of whole
+        blocks for the worker processes (see _parallel).
+
+        Parameter step: The number of pixels in a pixellated block
+        Precondition: step is an int > 0
+        """
+        #assert preconditions
+        assert type(step) == int, 'step must be an integer'
+        assert step>0, 'step must be greater than 0'
+        if self._parallel('pixellate',(step,),step):
+            return
+
+        current = self.getCurrent()
+        rows = list(range(0,current.getHeight(),step))+[current.getHeight()]
+        cols = list(range(0,current.getWidth(),step))+[current.getWidth()]
+        table = self._blockTable(rows,cols)
+
+        numpy = a6lut._vectorize(current)
+        if not numpy is None:
+            heights = numpy.diff(rows).reshape(-1,1,1)
+            widths  = numpy.diff(cols).reshape(1,-1,1)
+            sums = table[1:,1:]-table[:-1,1:]-table[1:,:-1]+table[:-1,:-1]
+            means = (sums//(heights*widths)).astype(numpy.uint8)
+            array = current.getArray()
+            for band in range(len(rows)-1):
+                array[rows[band]:rows[band+1]] = numpy.repeat(means[band],widths.ravel(),axis=0)
+            return
+
+        # Each step is a map over a band of blocks, so the loops run in C
+        import operator
+        widths = [cols[pos+1]-cols[pos] for pos in range(len(cols)-1)]
+        result = bytearray()
+        for band in range(len(rows)-1):
+            height = rows[band+1]-rows[band]
+            sizes = [height*width for width in widths]
+            means = bytearray(3*len(widths))
+            for c, above, below in zip(range(3),zip(*table[band]),zip(*table[band+1])):
+                sums = list(map(operator.sub,below,above))
+                sums = map(operator.sub,sums[1:],sums[:-1])
+                means[c::3] = bytes(map(operator.floordiv,sums,sizes))
+            pixels = map(bytes,zip(*[iter(means)]*3))
+            result += b''.join(map(operator.mul,pixels,widths))*height
+        a6lut._store(current,result)
+
+    def _blockTable(self, rows, cols):
+        """
+        Returns the summed-area table of the current image at the given corners.
+
+        Entry [i][j][c] of the table is the sum of channel c over all of the
+        pixels above row rows[i] and to the left of column cols[j]. So the sum
+        over the block from (rows[i],cols[j]) to (rows[i+1],cols[j+1]) is
+        table[i+1][j+1]-table[i][j+1]-table[i+1][j]+table[i][j].
+
+        Only the entries at the corners are kept, so the table is as small as
+        the number of blocks. The result is a NumPy array of int64 if NumPy is
+        used for this image (see a6lut), and nested lists of ints otherwise.
+
+        Parameter rows: The rows at the block corners
+        Precondition: rows is an increasing list of ints, from 0 to the height
+
+        Parameter cols: The columns at the block corners
+        Precondition: cols is an increasing list of ints, from 0 to the width
+        """
+        current = self.getCurrent()
+        numpy = a6lut._vectorize(current)
+        if not numpy is None:
+            array = current.getArray(True)
+            sums = numpy.add.reduceat(array,rows[:-1],axis=0,dtype=numpy.int64)
+            sums = numpy.add.reduceat(sums,cols[:-1],axis=1)
+            table = numpy.zeros((len(rows),len(cols),3),dtype=numpy.int64)
+            table[1:,1:] = sums.cumsum(axis=0).cumsum(axis=1)
+            return table
+
+        # Prefix sums along each row (in C), read at the corner columns
+        import itertools, operator
+        data = current.getBuffer(True)
+        width = 3*current.getWidth()
+        pick = operator.itemgetter(*cols)
+        table = [[(0,0,0)]*len(cols)]
+        total = [[0]*len(cols) for c in range(3)]
+        for band in range(len(rows)-1):
+            for row in range(rows[band],rows[band+1]):
+                line = data[row*width:(row+1)*width]
+                for c in range(3):
+                    sums = pick(list(itertools.accumulate(line[c::3],initial=0)))
+                    total[c] = list(map(operator.add,total[c],sums))
+            table.append(list(zip(*total)))
+        return table
+
+    # REFERENCE METHODS
+    # These are the pixel-by-pixel versions of the geometric transforms, of
+    # vignette and of pixellate. They are much slower, but they are easy to
+    # check, so the tests compare them against the methods above.
+    def _vignetteLoop(self):
+        """
+        Vignettes the current image, one pixel at a time (see vignette)
         """
         #Gets center of current image
         current = self.getCurrent()
@@ -249,60 +691,277 @@ class Filter(a6editor.Editor):
                     pix = (int(pixel[0]*mult),int(pixel[1]*mult),int(pixel[2]*mult))
                     current.setPixel(y,x,pix)
 
-    # OPTIONAL METHOD -- WORKS ON SQUARE IMAGES ONLY RIGHT NOW
-    def pixellate(self,step):
+    def _pixellateLoop(self,step):
         """
-        Pixellates the current image to give it a blocky feel.
-
-        To pixellate an image, start with the top left corner (e.g. the first
-        row and column).  Average the colors of the step x step block to the
-        right and down from this corner (if there are less than step rows or
-        step columns, go to the edge of the image). Then assign that average
-        to ALL of the pixels in that block.
-
-        When you are done, skip over step rows and step columns to go to the
-        next corner pixel.  Repeat this process again.  The result will be a
-        pixellated image.
+        Pixellates the current image, one block at a time (see _avg)
 
         Parameter step: The number of pixels in a pixellated block
         Precondition: step is an int > 0
         """
-        #assert preconditions
-        assert type(step) == int, 'step must be an integer'
-        assert step>0, 'step must be greater than 0'
-
         current = self.getCurrent()
-        condition = 'wide'
+        for row in range(0,current.getHeight(),step):
+            for col in range(0,current.getWidth(),step):
+                self._avg(row,col,step)
+
+    def _transposeLoop(self):
+        """
+        Transposes the current image, one pixel at a time
 
-        #Calculates the number of pixelated blocks that can fit wide and long
-        num_w_blocks = int(current.getWidth() / step)
-        num_h_blocks = int(current.getHeight() / step)
+        To simplify the process, we copy the current image and use that as a
+        reference.  So we change the current image with setPixel, but read
+        (with getPixel) from the copy.
+        """
+        current  = self.getCurrent()
+        original = current.copy()
+        current.setWidth(current.getHeight())
 
-        if num_h_blocks > num_w_blocks:
-            condition = 'long'
+        for row in range(current.getHeight()):      # Loop over the rows
+            for col in range(current.getWidth()):   # Loop over the columnns
+                current.setPixel(row,col,original.getPixel(col,row))
+
+    def _reflectHoriLoop(self):
+        """
+        Reflects the current image around the horizontal middle, one row at a time
+        """
+        current = self.getCurrent()
+        for row in range(current.getHeight()):      # Loop over the rows
+            current.setRow(row,current.getRow(row)[::-1])
 
-        #Starting points of blocks along the wide and long axis
-        w_block_coords = []
-        h_block_coords = []
+    def _rotateRightLoop(self):
+        """
+        Rotates the current image right by 90 degrees, one pixel at a time
+        """
+        current  = self.getCurrent()
+        original = current.copy()
+        current.setWidth(current.getHeight())
 
-        #Loops # of blocks amount of times, calculates the point and adds to list
-        for x in range(num_w_blocks+1):
-            w_block_coords.append(int(step * x))
+        for row in range(current.getHeight()):      # Loop over the rows
+            for col in range(current.getWidth()):   # Loop over the columnns
+                current.setPixel(row,col,original.getPixel(original.getHeight()-col-1,row))
 
-        for y in range(num_h_blocks+1):
-            h_block_coords.append(int(step * y))
+    def _rotateLeftLoop(self):
+        """
+        Rotates the current image left by 90 degrees, one pixel at a time
+        """
+        current  = self.getCurrent()
+        original = current.copy()
+        current.setWidth(current.getHeight())
 
-        #Uses helper function _avg to draw the pixellation
-        if condition =='wide':
-            for x in w_block_coords:
-                for y in h_block_coords:
-                    self._avg(y,x,step)
-        else:
-            for y in h_block_coords:
-                for x in w_block_coords:
-                    self._avg(y,x,step)
+        for row in range(current.getHeight()):      # Loop over the rows
+            for col in range(current.getWidth()):   # Loop over the columnns
+                current.setPixel(row,col,original.getPixel(col,original.getWidth()-row-1))
+
+    def _reflectVertLoop(self):
+        """
+        Reflects the current image around the vertical middle, one pair of rows at a time
+        """
+        current = self.getCurrent()
+        for h in range(current.getHeight()//2):      # Loop over the rows
+            k = current.getHeight()-1-h
+            top = current.getRow(h)
+            current.setRow(h,current.getRow(k))
+            current.setRow(k,top)
 
     # HELPER METHODS
+    def _rows(self):
+        """
+        Returns the position of the current image in the image being filtered.
+
+        The result is a tuple of the first row of the current image, and the
+        height of the whole image. For a Filter, this is (0, height). It is
+        different for a band in a worker process (see _Band).
+        """
+        return (0, self.getCurrent().getHeight())
+
+    def _mode(self):
+        """
+        Returns the way to run a filter on the current image.
+
+        The result is EXECUTION, unless that is None. Then it is picked by the
+        size of the image (see the class specification).
+        """
+        if not self.EXECUTION is None:
+            return self.EXECUTION
+        size = len(self.getCurrent())
+        if not self.PARALLEL_SIZE is None and size >= self.PARALLEL_SIZE:
+            return PROCESSES
+        if not self.THREAD_SIZE is None and size >= self.THREAD_SIZE:
+            return THREADS
+        return SERIAL
+
+    def _parallel(self, method, args, align=1):
+        """
+        Applies a method to the current image with a pool of workers.
+
+        This returns False, without doing anything, if the mode (see _mode) is
+        SERIAL, if the mode cannot be used, or if there would be only one band.
+        Then the caller should do the work itself.
+
+        Otherwise, the image is split into one band of rows for each worker,
+        and each worker calls the method on its band. The method must only
+        change each pixel based on pixels in the same band, which is why the
+        bands can be aligned (such as to the blocks of pixellate). A worker
+        sees its band as the current image of a _Band, so it can call _rows to
+        find the part of the image that it has.
+
+        With THREADS, the bands are views of the image itself. With PROCESSES,
+        the image is copied to a shared memory block, each process changes
+        its band there (see _work), and the result is copied back.
+
+        Parameter method: The name of the method to call
+        Precondition: method is a method of Filter that only changes pixels
+
+        Parameter args: The arguments to the method
+        Precondition: args is a tuple (that can be pickled)
+
+        Parameter align: The number of rows that each band is a multiple of
+        Precondition: align is an int > 0
+        """
+        import os
+        import a6image
+        mode = self._mode()
+        assert mode in MODES, repr(mode)+' is not an execution mode'
+        current = self.getCurrent()
+        workers = self.WORKERS or os.cpu_count() or 1
+        if (mode == SERIAL or workers < 2 or a6image._numpy() is None or
+            (mode == THREADS and current.getBackend() == a6image.LIST)):
+            return False
+
+        height = current.getHeight()
+        size = -(-height//workers)
+        size = -(-size//align)*align
+        bands = [(row,min(row+size,height)) for row in range(0,height,size)]
+        if len(bands) < 2:
+            return False
+
+        if mode == THREADS:
+            array = current.getArray()
+            width = current.getWidth()
+            def work(start, stop):
+                image = a6image.Image._trusted(array[start:stop].reshape(-1,3),width,a6image.NUMPY)
+                getattr(_Band(image,start,height),method)(*args)
+            pool = _pool(THREADS,workers)
+            tasks = [pool.submit(work,start,stop) for start, stop in bands]
+            for task in tasks:
+                task.result()
+            return True
+
+        import numpy
+        from multiprocessing import shared_memory
+        from concurrent.futures.process import BrokenProcessPool
+        shape = (height,current.getWidth(),3)
+        block = shared_memory.SharedMemory(create=True,size=3*len(current))
+        array = None
+        try:
+            array = numpy.ndarray(shape,dtype=numpy.uint8,buffer=block.buf)
+            array[...] = current.getArray(True)
+            try:
+                pool = _pool(PROCESSES,workers)
+                tasks = [pool.submit(_work,block.name,shape,start,stop,method,args)
+                         for start, stop in bands]
+                for task in tasks:
+                    task.result()
+            except BrokenProcessPool:
+                del _POOLS[PROCESSES]
+                return False
+            if current.getBackend() == a6image.LIST:
+                a6lut._store(current,array.tobytes())
+            else:
+                current.getArray()[...] = array
+        finally:
+            array = None    # The block cannot close while the array uses it
+            block.close()
+            block.unlink()
+        return True
+
+    def _stage(self, name, args):
+        """
+        Returns the pointwise stage for the given filter, or None.
+
+        A stage is a pair (kind, value). A 'table' stage has a triple of channel
+        tables (see a6lut) and a 'tone' stage has the weights and scales of a
+        tone table. A 'mask' stage multiplies by the vignette mask of the image
+        (see vignette_mask), so it has no value. Filters that are not pointwise
+        have no stage.
+
+        Parameter name: The name of the filter method
+        Precondition: name is a string
+
+        Parameter args: The arguments to the filter
+        Precondition: args is a tuple
+        """
+        if name == 'invert':
+            return ('table',(a6lut.INVERT,)*3)
+        elif name == 'applyLUT':
+            assert 1 <= len(args) <= 3, repr(args)+' are not valid arguments'
+            tables = tuple(args)+(None,)*(3-len(args))
+            tables = tuple(args[0] if table is None else table for table in tables)
+            for table in tables:
+                assert a6lut.is_table(table), repr(table)+' is not a channel table'
+            return ('table',tables)
+        elif name == 'monochromify':
+            assert len(args) == 1 and type(args[0]) == bool, repr(args)+' are not valid arguments'
+            return ('tone',(a6lut.BRIGHTNESS,a6lut.SEPIA if args[0] else a6lut.GREYSCALE))
+        elif name == 'vignette':
+            return ('mask',())
+        return None
+
+    def _runStages(self, stages):
+        """
+        Applies pointwise stages to the current image in a single pass.
+
+        The image is changed a band of rows at a time, applying every stage to
+        the band before moving on. So the band stays in the cache, and only
+        the band has to be copied for any floats. Each stage rounds its
+        results to bytes, just like the methods that make the stages.
+
+        Parameter stages: The stages to apply (see _stage)
+        Precondition: stages is a list of stages
+        """
+        import a6image
+        if not stages or self._parallel('_runStages',(stages,)):
+            return
+
+        current = self.getCurrent()
+        width = current.getWidth()
+        if any(kind == 'mask' for kind, value in stages):
+            start, height = self._rows()
+            mask = vignette_mask(width,height,start,start+current.getHeight())
+        numpy = a6lut._vectorize(current)
+        if not numpy is None:
+            array = current.getArray()
+            band = max(1,(1 << 16)//width)
+            for row in range(0,current.getHeight(),band):
+                part = array[row:row+band]
+                for kind, value in stages:
+                    if kind == 'table':
+                        a6lut.map_array(part,*value)
+                    elif kind == 'tone':
+                        a6lut.tone_array(part,*value)
+                    else:
+                        part[...] = part*mask[row:row+band,:,None]
+            return
+
+        import operator
+        if any(kind == 'mask' for kind, value in stages) and not type(mask) == list:
+            mask = mask.tolist()
+        data = current.getBuffer(True)
+        result = bytearray(len(data))
+        for row in range(current.getHeight()):
+            line = data[3*row*width:3*(row+1)*width]
+            for kind, value in stages:
+                if kind == 'table':
+                    line = a6lut.map_bytes(line,*value)
+                elif kind == 'tone':
+                    line = a6lut.tone_bytes(line,*value)
+                else:
+                    part = bytearray(len(line))
+                    for c in range(3):
+                        part[c::3] = bytes(map(int,map(operator.mul,line[c::3],mask[row])))
+                    line = part
+            result[3*row*width:3*(row+1)*width] = line
+        a6lut._store(current,result)
+
     def _drawHBar(self, row, pixel):
         """
         Draws a horizontal bar on the current image at the given row.
@@ -332,10 +991,7 @@ class Filter(a6editor.Editor):
             assert element<=255,'elements of pixel must be less or equal to 255'
 
         #Draws bars
-        for col in range(current.getWidth()):
-            current.setPixel(row,   col, pixel)
-            current.setPixel(row+1, col, pixel)
-            current.setPixel(row+2, col, pixel)
+        current.fillRegion(row,0,3,current.getWidth(),pixel)
 
     def _drawVBar(self, col, pixel):
         """
@@ -365,12 +1021,8 @@ class Filter(a6editor.Editor):
             assert element>=0, 'elements of pixel must be greater or equal to 0'
             assert element<=255,'elements of pixel must be less or equal to 255'
 
-
-        for row in range(current.getHeight()):
-            current.setPixel(row,col  , pixel)
-            current.setPixel(row,col+1, pixel)
-            current.setPixel(row,col+2, pixel)
-            current.setPixel(row,col+3, pixel)
+        #Draws bars
+        current.fillRegion(0,col,current.getHeight(),4,pixel)
 
     def _avg(self,row,col,step):
         """
@@ -378,23 +1030,16 @@ class Filter(a6editor.Editor):
         the given starting position (row,col) by amount step.
 
         This method creates a single block of pixellation given the starting
-        position and step from which to move from. It begins by creating an
-        empty list for all of the pixel tuples to be stored in for later
-        calculation. It also has an isolated list for the isolated color values
-        for calculating the average of each respective color.
-
-        Looping through each pixel from the point (row,col), going to
-        (row+step,col+step), each pixel tuple is added to the list colors. If
-        it is at the end of the image and row+step or col+step is out of range
-        for the pixels in the image, it just ends the block at the edge of image.
-        From there, looping through the list of tuples, isolates the r values
-        and places them in the list red, and so forth for green and blue.
-
-        Then, the average values of each list are calculated using the sum()
-        and len() functions. These are then turned into integers because rgb
-        attributes must be ints. These average values are then store into an
-        average pixel to which every pixel is assigned the value of by relooping
-        through all pixels we got the value of.
+        position and step from which to move from. The block covers the rows
+        row to row+step-1 and the columns col to col+step-1. If it is at the
+        end of the image and row+step or col+step is out of range for the
+        pixels in the image, it just ends the block at the edge of image.
+
+        The block is copied out with getRegion, and the average of each color
+        is the sum of that channel (every third byte of the packed pixels)
+        divided by the number of pixels, turned into an integer because rgb
+        attributes must be ints. Every pixel in the block is then assigned
+        that average with fillRegion.
 
         Paramater row: The start of the row to begin a pixellated block at
         Precondition: row is an int, 0 <= row  &  row < image height
@@ -408,53 +1053,79 @@ class Filter(a6editor.Editor):
         current = self.getCurrent()
 
         #Assert preconditions
-        assert type(row), 'row must be an integer'
+        assert type(row) == int, 'row must be an integer'
         assert 0<=row, 'row must be greater than or equal to 0'
-        assert row< current.getHeight(),'row+step must be less than height'
-        assert type(col), 'col must be an integer'
+        assert row< current.getHeight(),'row must be less than height'
+        assert type(col) == int, 'col must be an integer'
         assert 0 <= col, 'col must be greater than or equal to 0'
-        assert col< current.getWidth(), 'col+step must be less than width'
+        assert col< current.getWidth(), 'col must be less than width'
         assert type(step) == int, 'step must be an integer'
         assert step > 0, 'step must be greater than 0'
 
-        #List of pixels and color elements of pixels isolated for calculations
-        colors = []
-        red = []
-        green = []
-        blue = []
-
-        #Defines the edge of the block to pixelate
-        col_edge = col+step
-        row_edge = row+step
-
         #Assures if we are at the end of the image it ends at the edge of image
-        if col_edge >= current.getWidth():
-            col_edge = current.getWidth() - 1
-
-        if row_edge >= current.getHeight():
-            row_edge = current.getHeight() - 1
-
-        #loops through rows and cols from starting point to distance step away
-        for x in range(col,col_edge+1):
-            for y in range(row,row_edge+1):
-                colors.append(current.getPixel(x,y))  #gets rgb, puts in list
-
-        #Gets all red values and adds to list and does same for blue and green
-        for x in range(len(colors)):
-            r = colors[x][0]
-            red.append(r)
-            g = colors[x][1]
-            green.append(g)
-            b = colors[x][2]
-            blue.append(b)
+        height = min(step,current.getHeight()-row)
+        width  = min(step,current.getWidth()-col)
 
         #Calculate average values for colors
-        red_avg = int(sum(red)/len(red))
-        green_avg = int(sum(green)/len(green))
-        blue_avg = int(sum(blue)/len(blue))
+        block = current.getRegion(row,col,height,width).getBuffer(True)
+        size = height*width
+        red_avg = int(sum(block[0::3])/size)
+        green_avg = int(sum(block[1::3])/size)
+        blue_avg = int(sum(block[2::3])/size)
         avg_pixel = (red_avg,green_avg,blue_avg)
 
         #Sets pixels to average values
-        for x in range(col,col_edge+1):
-            for y in range(row,row_edge+1):
-                current.setPixel(x,y,avg_pixel)
+        current.fillRegion(row,col,height,width,avg_pixel)
+
+
+class _Band(Filter):
+    """
+    A filter for a band of rows of a larger image, in a worker process.
+
+    A band has no edit history. Its current image is the band itself, which
+    is changed in place, and the journal is turned off. So calling a filter
+    method on a band just applies it to those pixels (see Filter._parallel).
+    """
+    # Attribute _image: The pixels of the band
+    # Invariant: _image is an Image object
+    #
+    # Attribute _start: The first row of the band in the whole image
+    # Invariant: _start is an int >= 0
+    #
+    # Attribute _height: The height of the whole image
+    # Invariant: _height is an int > _start
+
+    # A band never splits itself again
+    EXECUTION = SERIAL
+
+    # Journaled methods only record calls when this is 0 (see a6editor.journaled)
+    _depth = 1
+
+    def __init__(self, image, start, height):
+        """
+        Initializes a filter for the given band.
+
+        Parameter image: The pixels of the band
+        Precondition: image is an Image object
+
+        Parameter start: The first row of the band in the whole image
+        Precondition: start is an int >= 0
+
+        Parameter height: The height of the whole image
+        Precondition: height is an int >= start + image height
+        """
+        self._image = image
+        self._start = start
+        self._height = height
+
+    def getCurrent(self):
+        """
+        Returns the band
+        """
+        return self._image
+
+    def _rows(self):
+        """
+        Returns the first row of the band and the height of the whole image.
+        """
+        return (self._start, self._height)
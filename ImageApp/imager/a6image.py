@@ -6,9 +6,67 @@ be modified.  This is the main class needed to display images in the viewer.
 
 Based on an original file by Dexter Kozen (dck10) and Walker White (wmw2)
 
+Pixels may be stored in one of several formats (backends). The original
+format, and the default, is a Python list of 3-element tuples. The 'packed'
+backend stores the pixels in a single bytearray (3 bytes per pixel), and only
+needs the standard library. The 'numpy' backend stores the pixels in a single
+uint8 array, which lets the filters work on the whole image at once. NumPy is
+an optional dependency; it is only imported when that backend is requested.
+
+Copies of images are copy-on-write. A copy shares the pixels of the
+original until one of them changes. When the original changes,
+it first saves the old contents of each affected tile (TILE_SIZE pixels)
+into the copy, so a copy only costs memory for the tiles that changed since.
+
 Author: Adam Kadhim (ak779) and Calvin Johnson (clj78)
 Date:   November 20, 2019
 """
+import weakref
+
+# The names of the supported storage formats
+LIST   = 'list'
+PACKED = 'packed'
+NUMPY  = 'numpy'
+BACKENDS = (LIST, PACKED, NUMPY)
+
+# The number of pixels in a copy-on-write tile
+TILE_SIZE = 4096
+
+
+def _numpy():
+    """
+    Returns the numpy module, or None if it is not installed.
+
+    NumPy is optional, so we do not import it until an image actually needs it.
+    """
+    try:
+        import numpy
+    except ImportError:
+        return None
+    return numpy
+
+
+def preferred_backend():
+    """
+    Returns the fastest storage backend available on this machine.
+
+    This is the backend that the application uses when it loads image files.
+    It is 'numpy' if NumPy is installed, and 'packed' otherwise.
+    """
+    return PACKED if _numpy() is None else NUMPY
+
+
+def has_backend(backend):
+    """
+    Returns True if the given storage backend can be used on this machine.
+
+    Parameter backend: The backend name
+    Precondition: backend is a string
+    """
+    if backend == NUMPY:
+        return not _numpy() is None
+    return backend in BACKENDS
+
 
 def _is_pixel(item):
     """
@@ -36,25 +94,73 @@ def _is_pixel_list(data):
     A pixel list is a 1-dimensional list of pixels where a pixel is a tuple
     of 3 ints in the range 0..255
 
+    This check is written as a few whole-list passes (map, set, bytearray)
+    rather than a Python loop over the pixels, so that the looping happens in
+    C. That makes it cheap enough to run on every image that comes from an
+    untrusted source. Images made by this module (copies, conversions and
+    filter results) skip it entirely (see Image._trusted).
+
     Parameter data: The data to check
     Precondition: NONE (data can be anything)(
     """
-    condition = True
-    for element in data:
-        #Only 1 dimensional
-        if type(element) == list:
-            condition = False
+    import itertools
+    try:
+        #Every element must be a tuple of length 3
+        if not set(map(type,data)) <= {tuple}:
+            return False
+        if not set(map(len,data)) <= {3}:
+            return False
+
+        #Every channel must be an int in 0..255 (bytearray checks the range)
+        if not set(map(type,itertools.chain.from_iterable(data))) <= {int}:
+            return False
+        bytearray(itertools.chain.from_iterable(data))
+    except (TypeError, ValueError):
+        return False
+    return True
+
+
+def _is_pixel_array(data):
+    """
+    Returns True if data is a pixel array, False otherwise.
+
+    A pixel array is a NumPy array of uint8 values whose last dimension is 3.
+    It may be 2-dimensional (one row per pixel) or 3-dimensional (height x
+    width x 3). No other checks are needed, as uint8 values are always valid.
 
-        #Correct tuple type
-        elif type(element) != tuple:
-            condition = False
+    Parameter data: The data to check
+    Precondition: NONE (data can be anything)
+    """
+    numpy = _numpy()
+    if numpy is None or not isinstance(data,numpy.ndarray):
+        return False
+    return data.dtype == numpy.uint8 and data.ndim in (2,3) and data.shape[-1] == 3
 
-        #Tuple of length 3, makes sure is pixel with helper
-        helper_result = _is_pixel(element)
-        if helper_result == False:
-            condition = helper_result
 
-    return condition
+def _is_pixel_buffer(data):
+    """
+    Returns True if data is a pixel buffer, False otherwise.
+
+    A pixel buffer is a bytes-like object (bytes, bytearray, a memoryview of
+    bytes or an array of type 'B') holding the pixels as consecutive (r,g,b)
+    bytes. Hence its length must be a multiple of 3. No other checks are
+    needed, as bytes are always valid color values.
+
+    Parameter data: The data to check
+    Precondition: NONE (data can be anything)
+    """
+    import array
+    if type(data) in (bytes, bytearray):
+        pass
+    elif type(data) == array.array:
+        if data.typecode != 'B':
+            return False
+    elif type(data) == memoryview:
+        if data.format != 'B' or data.ndim != 1:
+            return False
+    else:
+        return False
+    return len(data) % 3 == 0
 
 # TASK 1: IMPLEMENT THIS CLASS
 class Image(object):
@@ -83,10 +189,47 @@ class Image(object):
         image.__setitem__(pos, (255,0,0))
 
      These operations are used by the greyscale filters and the stenography methods.
+
+    The pixels can be stored as a list of tuples (the 'list' backend), as a
+    bytearray (the 'packed' backend) or as a NumPy array (the 'numpy' backend).
+    The methods above work the same in every case. Code that wants to process
+    the whole image at once can use the method `getArray` to get the pixels as
+    a height x width x 3 array.
+
+    The method `copy` is cheap, whatever the backend. The copy shares
+    storage with this image, and only the tiles that this image changes
+    afterwards are duplicated (into the copy). If the copy itself is changed,
+    or its storage is needed as a whole, it makes its own full copy first.
     """
     # IMMUTABLE ATTRIBUTES (Fixed after initialization)
-    # Attribute _data: The underlying list of pixels
-    # Invariant: _data is a pixel list (see _is_pixel_list)
+    # Attribute _data: The underlying pixel storage
+    # Invariant: _data is a pixel list (see _is_pixel_list) if _backend is LIST,
+    # a bytearray with 3 bytes per pixel if it is PACKED, or a (# of pixels) x 3
+    # pixel array (see _is_pixel_array) if it is NUMPY
+    # _data is a property. The storage itself is _store, which is None while
+    # this image is a copy-on-write copy. Reading _data makes a private copy.
+    #
+    # Attribute _views: The copy-on-write copies that share _store
+    # Invariant: _views is None or a WeakSet of Image objects
+    #
+    # Attribute _base: The shared storage (only while a copy-on-write copy)
+    # Invariant: _base is None, or storage of the same size and backend
+    #
+    # Attribute _tiles: Saved tiles that differ from _base
+    # Invariant: _tiles is None, or a dictionary mapping tile numbers to tile storage
+    #
+    # Attribute _source: The image whose _store is _base
+    # Invariant: _source is None or a weak reference to an Image
+    #
+    # Attribute _backend: The storage format
+    # Invariant: _backend is one of BACKENDS
+    #
+    # Attribute _version: A counter of the changes to the pixels
+    # Invariant: _version is an int >= 0 that grows whenever a pixel may change
+    #
+    # Attribute _dirty: The pixels that may have changed since the last _takeChanges
+    # Invariant: _dirty is None (no changes), or a pair (start,stop) of pixel
+    # positions, with every changed pixel in start..stop-1
     #
     # MUTABLE ATTRIBUTES (Can be changed at any time, via the setters)
     # Attribute _width:  The image width, which is the number of columns
@@ -97,6 +240,13 @@ class Image(object):
     # Invariant: _height is an int > 0, _width*_height = len(_data)
     # height = 0 only if len(_data) = 0
     # Note that if you change width, you must change height (to satisfy the invariant)
+    _store  = None
+    _views  = None
+    _base   = None
+    _tiles  = None
+    _source = None
+    _version = 0
+    _dirty  = None
 
     # PART A
     # GETTERS AND SETTERS
@@ -107,7 +257,98 @@ class Image(object):
         The image data is a 1-dimensional list of 3-element tuples.  The list
         returned by this method is a copy of the one managed by this object.
         """
-        return self._data[:]
+        if self._backend == LIST:
+            return self._data[:]
+        return _convert(self._data,self._backend,LIST)
+
+    def getBackend(self):
+        """
+        Returns the name of the storage format for this image.
+
+        The value is one of the strings in BACKENDS.
+        """
+        return self._backend
+
+    def getArray(self, readonly=False):
+        """
+        Returns the image pixels as a height x width x 3 NumPy array.
+
+        For the 'numpy' and 'packed' backends, this is a view of the image
+        data, so changes to the array change the image as well. For the 'list'
+        backend, the array is a new copy of the data.
+
+        Asking for a writable view counts as changing every pixel, since the
+        image cannot see writes to the array. If the caller only reads the
+        array, it should set readonly to True.
+
+        This method requires NumPy.
+
+        Parameter readonly: Whether to return a read-only view
+        Precondition: readonly is a bool
+        """
+        numpy = _numpy()
+        assert not numpy is None, 'getArray requires numpy'
+        if self._backend == LIST:
+            result = numpy.array(self._data,dtype=numpy.uint8)
+            return result.reshape(self._height,self._width,3)
+
+        if not readonly:
+            self._touch(0,len(self))
+        if self._backend == NUMPY:
+            result = self._data.reshape(self._height,self._width,3)
+        else:
+            result = numpy.frombuffer(self._data,dtype=numpy.uint8)
+            result = result.reshape(self._height,self._width,3)
+        if readonly:
+            result = result.view()
+            result.flags.writeable = False
+        return result
+
+    def getBuffer(self, readonly=False):
+        """
+        Returns the image pixels as a memoryview of packed bytes.
+
+        The bytes are the (r,g,b) values of each pixel in row-major order, which
+        is the 'RGB' raw format used by PIL (Image.frombuffer) and by Kivy
+        textures (Texture.blit_buffer). For the 'packed' and 'numpy' backends
+        this is a view of the image data, so no pixels are copied. For the
+        'list' backend, the view is of a new copy of the data; it is writable
+        unless readonly is True, but changing it does not change the image.
+
+        As with getArray, a writable view counts as changing every pixel. Code
+        that only reads the pixels (such as saving or drawing) should set
+        readonly to True.
+
+        This method also makes an Image support the buffer protocol in Python
+        3.12+, so memoryview(image) works as well.
+
+        Parameter readonly: Whether to return a read-only view
+        Precondition: readonly is a bool
+        """
+        if self._backend == LIST:
+            result = memoryview(_convert(self._data,LIST,PACKED))
+            return result.toreadonly() if readonly else result
+
+        if not readonly:
+            self._touch(0,len(self))
+        result = memoryview(self._data)
+        if self._backend == NUMPY:
+            result = result.cast('B')
+        if readonly:
+            result = result.toreadonly()
+        return result
+
+    def __buffer__(self, flags):
+        """
+        Returns a memoryview of the image pixels (see getBuffer).
+
+        This special method supports the buffer protocol (Python 3.12+). The
+        view is writable only if the request asks for it.
+
+        Parameter flags: The buffer request flags
+        Precondition: flags is an int
+        """
+        return self.getBuffer(not flags & 1)   # PyBUF_WRITABLE
 
     def getWidth(self):
         """
@@ -135,14 +376,14 @@ class Image(object):
         #Assert preconditions
         assert type(value) == int,'value is not an integer'
         assert value >= 0, 'value is not greather than 0'
-        remains = len(self._data) % value
+        remains = len(self) % value
         assert remains == 0,'value does not evenly divide length of pixels'
         if value == 0:
-            assert len(self._data) == 0,'value can only be 0 if there are no pixels'
+            assert len(self) == 0,'value can only be 0 if there are no pixels'
 
         #Set image width to value, and change height accordingly
         self._width = value
-        self._height = len(self._data) // self._width
+        self._height = len(self) // self._width
 
     def getHeight(self):
         """
@@ -170,17 +411,17 @@ class Image(object):
         #assert preconditions
         assert type(value) == int, 'value must be an integer'
         assert value >= 0,'value is not greater than 0'
-        remains = len(self._data) % value
+        remains = len(self) % value
         assert remains == 0,'value does not evenly divide length of pixels'
         if value == 0:
-            assert len(_data) == 0,'value can only be 0 if there are no pixels'
+            assert len(self) == 0,'value can only be 0 if there are no pixels'
 
 
         self._height = value
-        self._width = len(self._data) // self._height
+        self._width = len(self) // self._height
 
     # INITIALIZER
-    def __init__(self, data, width):
+    def __init__(self, data, width, backend=None):
         """
         Initializes an Image from the given pixel list.
 
@@ -199,25 +440,114 @@ class Image(object):
 
         This initializer stores a reference to the original image data; it
         does not copy it. So changes to the image will change the data
-        parameter as well.
+        parameter as well. The only exception is when the data has to be
+        converted to a different backend (see below).
+
+        The data may also be a pixel buffer (see _is_pixel_buffer) or a pixel
+        array (see _is_pixel_array). In those cases the image uses the
+        'packed' or the 'numpy' backend, respectively. A pixel buffer that is
+        not a bytearray is copied into one.
+
+        The optional backend selects how the pixels are stored. If it is None,
+        the backend is chosen from the type of data.  Otherwise the data is
+        converted (copied) into that format if necessary.
 
         Parameter data: The image data as a pixel list
-        Precondition: data is a pixel list
+        Precondition: data is a pixel list, a pixel buffer or a pixel array
 
         Parameter width: The image width
         Precondition: width is an int > 0 and evenly divides the length of pixels
+
+        Parameter backend: The storage format
+        Precondition: backend is None or one of BACKENDS
         """
         #Assert preconditions
-        assert _is_pixel_list(data) == True,'data is not a pixel list'
+        assert backend is None or backend in BACKENDS, repr(backend)+' is not a backend'
+        if _is_pixel_array(data):
+            data = _numpy().ascontiguousarray(data.reshape(-1,3))
+            current = NUMPY
+        elif _is_pixel_buffer(data):
+            if type(data) != bytearray:
+                data = bytearray(data)
+            current = PACKED
+        else:
+            assert _is_pixel_list(data) == True,'data is not a pixel list'
+            current = LIST
         assert type(width) == int,'width is not an integer'
         assert width > 0, 'width is not greather than 0'
-        remains = len(data) % width
+        size = len(data)//3 if current == PACKED else len(data)
+        remains = size % width
         assert remains == 0,'Width does not evenly divide length of pixels'
 
+        #Convert the storage if necessary
+        if backend is None:
+            backend = current
+        if backend != current:
+            data = _convert(data,current,backend)
+
         #Initializes attributes
-        self._width = width
-        self._height = len(data) // self._width
+        self._assign(data,width,backend)
+
+    @classmethod
+    def _trusted(cls, data, width, backend):
+        """
+        Returns a new Image for data that is already known to be valid.
+
+        This is the internal constructor used for images that this module
+        (or a filter) has produced itself, such as copies and conversions. It
+        stores data as is and skips all of the checks in the initializer, so
+        its cost does not depend on the number of pixels.
+
+        Parameter data: The image data
+        Precondition: data is valid storage for the given backend
+
+        Parameter width: The image width
+        Precondition: width is an int > 0 and evenly divides the length of pixels
+
+        Parameter backend: The storage format
+        Precondition: backend is one of BACKENDS
+        """
+        result = cls.__new__(cls)
+        result._assign(data,width,backend)
+        return result
+
+    def _assign(self, data, width, backend):
+        """
+        Sets the attributes of this image, without checking them.
+
+        Parameter data: The image data
+        Precondition: data is valid storage for the given backend
+
+        Parameter width: The image width
+        Precondition: width is an int > 0 and evenly divides the length of pixels
+
+        Parameter backend: The storage format
+        Precondition: backend is one of BACKENDS
+        """
         self._data = data
+        self._version += 1
+        self._backend = backend
+        self._width = width
+        self._height = len(self) // width
+        self._dirty = (0,len(self))
+
+    @property
+    def _data(self):
+        """
+        The underlying pixel storage of this image.
+
+        If this image is a copy-on-write copy, reading this property gives it
+        a private copy of the storage first (see _materialize).
+        """
+        if self._store is None:
+            self._materialize()
+        return self._store
+
+    @_data.setter
+    def _data(self, value):
+        # Any copies that shared the old storage keep it for themselves
+        self._detach()
+        self._store = value
 
     # PART B
     # OPERATOR OVERLOADING
@@ -227,7 +557,10 @@ class Image(object):
 
         This special method supports the built-in len function.
         """
-        return len(self._data)
+        storage = self._base if self._store is None else self._store
+        if self._backend == PACKED:
+            return len(storage) // 3
+        return len(storage)
 
     def __getitem__(self, pos):
         """
@@ -248,9 +581,9 @@ class Image(object):
         #assert preconditions
         assert type(pos) == int, 'pos must be an integer'
         assert pos >= 0, 'pos must be grater than or equal to 0'
-        assert len(self._data)-1 >= pos, 'pos must be valid position in list'
+        assert len(self)-1 >= pos, 'pos must be valid position in list'
 
-        return self._data[pos]
+        return self._get(pos)
 
     def __setitem__(self, pos, pixel):
         """
@@ -268,7 +601,7 @@ class Image(object):
         #assert preconditions
         assert type(pos) == int, 'pos must be an integer'
         assert pos >= 0, 'pos must be grater than or equal to 0'
-        assert len(self._data)-1 >= pos, 'pos must be valid position in list'
+        assert len(self)-1 >= pos, 'pos must be valid position in list'
         assert type(pixel) == tuple, 'pixel must be a tuple'
         assert len(pixel) == 3, 'pixel must be tuple of length 3'
         for item in pixel:
@@ -276,7 +609,7 @@ class Image(object):
             assert item >= 0, 'values in tuple, pixel, must be >= 0'
             assert item <= 255, 'values in tuple, pixel, must be <= 255'
 
-        self._data[pos] = pixel
+        self._set(pos,pixel)
 
     # PART C
     # TWO-DIMENSIONAL ACCESS METHODS
@@ -306,7 +639,7 @@ class Image(object):
         #Calculate which element of the pixel list it is from 2d list
         width = self.getWidth()
         index = width * row + col
-        return self._data[index]
+        return self._get(index)
 
     def setPixel(self, row, col, pixel):
         """
@@ -341,7 +674,152 @@ class Image(object):
         #set pixel value at given (row,col) to given value, pixel.
         width = self.getWidth()
         index = width * row + col
-        self._data[index] = pixel
+        self._set(index,pixel)
+
+    # BLOCK ACCESS METHODS
+    def getRow(self, row):
+        """
+        Returns a list of the pixels in the given row (from left to right)
+
+        Each pixel is a 3-element tuple (r,g,b). Unlike getPixel, this method
+        checks its precondition once and then reads the whole row as a single
+        slice of the underlying storage.
+
+        Parameter row: The pixel row
+        Precondition: row is an int >= 0 and < height
+        """
+        self._assert_region(row,0,1,self._width)
+        start = row*self._width
+        return _convert(self._span(start,self._width),self._backend,LIST)
+
+    def setRow(self, row, pixels):
+        """
+        Sets the pixels in the given row (from left to right)
+
+        Parameter row: The pixel row
+        Precondition: row is an int >= 0 and < height
+
+        Parameter pixels: The new row of pixels
+        Precondition: pixels is a pixel list of length width
+        """
+        self._assert_region(row,0,1,self._width)
+        assert _is_pixel_list(pixels), repr(pixels)+' is not a pixel list'
+        assert len(pixels) == self._width, 'pixels must have width elements'
+        self._setSpan(row*self._width,_convert(pixels,LIST,self._backend))
+
+    def getColumn(self, col):
+        """
+        Returns a list of the pixels in the given column (from top to bottom)
+
+        Each pixel is a 3-element tuple (r,g,b).
+
+        Parameter col: The pixel column
+        Precondition: col is an int >= 0 and < width
+        """
+        self._assert_region(0,col,self._height,1)
+        if self._backend == PACKED:
+            step = 3*self._width
+            red   = self._data[3*col  ::step]
+            green = self._data[3*col+1::step]
+            blue  = self._data[3*col+2::step]
+            return list(zip(red,green,blue))
+        return _convert(self._data[col::self._width],self._backend,LIST)
+
+    def getRegion(self, row, col, height, width):
+        """
+        Returns a new image that is a copy of a rectangular region of this one
+
+        The region has its top left corner at (row, col) and is height rows
+        tall and width columns wide. The new image uses the same backend.
+
+        Parameter row: The top row of the region
+        Precondition: row is an int >= 0, and row+height <= image height
+
+        Parameter col: The left column of the region
+        Precondition: col is an int >= 0, and col+width <= image width
+
+        Parameter height: The number of rows in the region
+        Precondition: height is an int > 0
+
+        Parameter width: The number of columns in the region
+        Precondition: width is an int > 0
+        """
+        self._assert_region(row,col,height,width)
+        if self._backend == NUMPY:
+            block = self.getArray(True)[row:row+height,col:col+width].copy()
+            return Image._trusted(block.reshape(-1,3),width,NUMPY)
+
+        data = self._span(row*self._width+col,width)
+        for pos in range(row+1,row+height):
+            data += self._span(pos*self._width+col,width)
+        return Image._trusted(data,width,self._backend)
+
+    def fillRegion(self, row, col, height, width, pixel):
+        """
+        Sets every pixel in a rectangular region of this image to pixel.
+
+        The region has its top left corner at (row, col) and is height rows
+        tall and width columns wide.
+
+        Parameter row: The top row of the region
+        Precondition: row is an int >= 0, and row+height <= image height
+
+        Parameter col: The left column of the region
+        Precondition: col is an int >= 0, and col+width <= image width
+
+        Parameter height: The number of rows in the region
+        Precondition: height is an int > 0
+
+        Parameter width: The number of columns in the region
+        Precondition: width is an int > 0
+
+        Parameter pixel: The pixel value
+        Precondition: pixel is a 3-element tuple (r,g,b) of ints in 0..255
+        """
+        self._assert_region(row,col,height,width)
+        assert _is_pixel(pixel), repr(pixel)+' is not a pixel'
+        if self._backend == NUMPY:
+            self._touch(row*self._width+col,(row+height-1)*self._width+col+width)
+            self._grid()[row:row+height,col:col+width] = pixel
+            return
+
+        if self._backend == PACKED:
+            span = bytes(pixel)*width
+        else:
+            span = [pixel]*width
+        for pos in range(row,row+height):
+            self._setSpan(pos*self._width+col,span)
+
+    def setRegion(self, row, col, image):
+        """
+        Copies the pixels of image into this image, with the top left corner
+        of image placed at (row, col).
+
+        Parameter row: The top row of the region
+        Precondition: row is an int >= 0, and row+image height <= height
+
+        Parameter col: The left column of the region
+        Precondition: col is an int >= 0, and col+image width <= width
+
+        Parameter image: The pixels to copy
+        Precondition: image is a non-empty Image object
+        """
+        assert isinstance(image,Image), repr(image)+' is not an image'
+        height = image.getHeight()
+        width  = image.getWidth()
+        self._assert_region(row,col,height,width)
+        if self._backend == NUMPY:
+            block = image.getArray(True)
+            self._touch(row*self._width+col,(row+height-1)*self._width+col+width)
+            self._grid()[row:row+height,col:col+width] = block
+            return
+
+        data = image._data
+        if image._backend != self._backend:
+            data = _convert(data,image._backend,self._backend)
+        size = 3*width if self._backend == PACKED else width
+        for pos in range(height):
+            self._setSpan((row+pos)*self._width+col,data[pos*size:(pos+1)*size])
 
     # PART D
     def __str__(self):
@@ -389,6 +867,55 @@ class Image(object):
 
         return accumulator
 
+    # WHOLE-IMAGE METHODS
+    def reorient(self, transpose=False, vertical=False, horizontal=False):
+        """
+        Transposes and/or reflects this image (in place).
+
+        The steps are done in this order: first the image is transposed (rows
+        become columns), then the order of the rows is reversed (a vertical
+        reflection), and then each row is reversed (a horizontal reflection).
+        Every rotation and reflection of the image is one of these.
+
+        The pixels are reordered as a whole with slicing, rather than one at a
+        time. The image gets new storage, so any copy-on-write copies keep the
+        old storage without copying it.
+
+        Parameter transpose: Whether to transpose the image
+        Precondition: transpose is a bool
+
+        Parameter vertical: Whether to reverse the order of the rows
+        Precondition: vertical is a bool
+
+        Parameter horizontal: Whether to reverse each row
+        Precondition: horizontal is a bool
+        """
+        assert type(transpose) == bool, repr(transpose)+' is not a bool'
+        assert type(vertical) == bool, repr(vertical)+' is not a bool'
+        assert type(horizontal) == bool, repr(horizontal)+' is not a bool'
+        if not (transpose or vertical or horizontal):
+            return
+
+        numpy = _numpy()
+        if self._backend != LIST and not numpy is None:
+            # View each pixel as a single 3-byte item, so it moves as one
+            cells = self.getArray(True).reshape(self._height,-1).view('V3')
+            if transpose:
+                cells = cells.T
+            if vertical:
+                cells = cells[::-1]
+            if horizontal:
+                cells = cells[:,::-1]
+            width = cells.shape[1]
+            # Always copy; a 1-pixel side can leave cells a contiguous alias
+            data = numpy.array(cells,order='C').view(numpy.uint8).reshape(-1,3)
+            if self._backend == PACKED:
+                data = bytearray(data)
+        else:
+            data, width = _reorient(self._data,self._backend,self._width,
+                                    transpose,vertical,horizontal)
+        self._assign(data,width,self._backend)
+
     # ADDITIONAL METHODS
     def swapPixels(self, row1, col1, row2, col2):
         """
@@ -414,12 +941,556 @@ class Image(object):
         self.setPixel(row1,col1,pix2)
         self.setPixel(row2,col2,pix1)
 
-    def copy(self):
+    def copy(self, backend=None):
         """
         Returns a copy of this image object.
 
         The underlying pixel data must be copied (e.g. the copy cannot refer
         to the same list of pixels that this object does).
+
+        If backend is not None, the copy stores its pixels in that format
+        instead of the format of this image.
+
+        Parameter backend: The storage format of the copy
+        Precondition: backend is None or one of BACKENDS
+        """
+        if not backend is None and backend != self._backend:
+            data = _convert(self._data,self._backend,backend)
+            return Image._trusted(data,self._width,backend)
+
+        # Copy-on-write: share the storage (and any saved tiles)
+        result = Image.__new__(Image)
+        result._backend = self._backend
+        result._width = self._width
+        result._height = self._height
+        if self._store is None:
+            result._base  = self._base
+            result._tiles = dict(self._tiles)
+            source = None if self._source is None else self._source()
+        else:
+            result._base  = self._store
+            result._tiles = {}
+            source = self
+        if not source is None:
+            if source._views is None:
+                source._views = weakref.WeakSet()
+            source._views.add(result)
+            result._source = weakref.ref(source)
+        return result
+
+    # STORAGE HELPERS
+    def _get(self, index):
+        """
+        Returns the pixel at the given index of the underlying storage.
+
+        A copy-on-write copy reads the pixel from its saved tiles or from the
+        shared storage, without making a private copy.
+
+        This method does not enforce any preconditions.  The caller must do so.
+
+        Parameter index: The position in the pixel list
+        Precondition: index is a valid position in the pixel list
+        """
+        if self._store is None:
+            tile = index // TILE_SIZE
+            if tile in self._tiles:
+                storage = self._tiles[tile]
+                index -= tile*TILE_SIZE
+            else:
+                storage = self._base
+            if self._backend == PACKED:
+                index *= 3
+                return tuple(storage[index:index+3])
+            elif self._backend == NUMPY:
+                return tuple(storage[index].tolist())
+            return storage[index]
+
+        if self._backend == PACKED:
+            index *= 3
+            return tuple(self._data[index:index+3])
+        elif self._backend == NUMPY:
+            return tuple(self._data[index].tolist())
+        return self._data[index]
+
+    def _span(self, index, count):
+        """
+        Returns a copy of count consecutive pixels, in the storage format.
+
+        The result is a list of tuples (LIST), a bytearray (PACKED), or a
+        count x 3 array (NUMPY). This method does not enforce any
+        preconditions.  The caller must do so.
+
+        Parameter index: The position of the first pixel
+        Precondition: index is a valid position in the pixel list
+
+        Parameter count: The number of pixels
+        Precondition: count is an int >= 0 and index+count <= # of pixels
+        """
+        if self._backend == PACKED:
+            return self._data[3*index:3*(index+count)]
+        elif self._backend == NUMPY:
+            return self._data[index:index+count].copy()
+        return self._data[index:index+count]
+
+    def _setSpan(self, index, span):
+        """
+        Replaces consecutive pixels starting at index with span.
+
+        This method does not enforce any preconditions.  The caller must do so.
+
+        Parameter index: The position of the first pixel
+        Precondition: index is a valid position in the pixel list
+
+        Parameter span: The new pixels, in the storage format (see _span)
+        Precondition: span fits in the image starting at index
+        """
+        if self._backend == PACKED:
+            self._touch(index,index+len(span)//3)
+            self._data[3*index:3*index+len(span)] = span
+        else:
+            self._touch(index,index+len(span))
+            self._data[index:index+len(span)] = span
+
+    def _grid(self):
+        """
+        Returns the storage of a 'numpy' image as a height x width x 3 view.
+
+        Unlike getArray, this does not prepare any pixels to be changed.  The
+        caller must call _touch before writing to the view.
+        """
+        return self._data.reshape(self._height,self._width,3)
+
+    def _rawBuffer(self):
+        """
+        Returns the pixels as a writable memoryview of packed bytes, for reading only.
+
+        Some consumers (such as Texture.blit_buffer in Kivy) only read the pixels
+        but refuse read-only buffers. Unlike getBuffer, this does not prepare
+        any pixels to be changed, so the caller must not write to the view. It
+        is a view of the image data unless the backend is 'list' or the storage
+        is itself read-only, in which case it is a view of a copy.
+        """
+        if self._backend == LIST:
+            return memoryview(_convert(self._data,LIST,PACKED))
+        result = memoryview(self._data)
+        if self._backend == NUMPY:
+            result = result.cast('B')
+        if result.readonly:
+            result = memoryview(bytearray(result))
+        return result
+
+    def _assert_region(self, row, col, height, width):
+        """
+        Asserts that the given rectangle is a non-empty part of this image.
+
+        Parameter row: The top row of the region
+        Precondition: NONE (row can be anything)
+
+        Parameter col: The left column of the region
+        Precondition: NONE (col can be anything)
+
+        Parameter height: The number of rows in the region
+        Precondition: NONE (height can be anything)
+
+        Parameter width: The number of columns in the region
+        Precondition: NONE (width can be anything)
+        """
+        assert type(row) == int, 'row must be an integer'
+        assert type(col) == int, 'col must be an integer'
+        assert type(height) == int, 'height must be an integer'
+        assert type(width) == int, 'width must be an integer'
+        assert row >= 0, 'row must be greater than or equal to 0'
+        assert col >= 0, 'col must be greater than or equal to 0'
+        assert height > 0, 'height must be greater than 0'
+        assert width > 0, 'width must be greater than 0'
+        assert row+height <= self._height, 'region must end before the last row'
+        assert col+width <= self._width, 'region must end before the last column'
+
+    def _set(self, index, pixel):
+        """
+        Sets the pixel at the given index of the underlying storage.
+
+        This method does not enforce any preconditions.  The caller must do so.
+
+        Parameter index: The position in the pixel list
+        Precondition: index is a valid position in the pixel list
+
+        Parameter pixel: The pixel value
+        Precondition: pixel is a 3-element tuple (r,g,b) of ints in 0..255
+        """
+        self._touch(index,index+1)
+        if self._backend == PACKED:
+            index *= 3
+            self._data[index:index+3] = bytes(pixel)
+        else:
+            self._data[index] = pixel
+
+    def _touch(self, start, stop):
+        """
+        Prepares the pixels from start to stop-1 to be changed.
+
+        Every copy-on-write copy that still shares this image's storage saves
+        the current contents of each affected tile, unless it saved that tile
+        already. The saved tile is shared by all such copies. A copy-on-write
+        copy that is about to change makes a private copy of its storage.
+
+        Every method that changes pixels must call this method first.
+
+        Parameter start: The first pixel to change
+        Precondition: start is an int, 0 <= start <= stop
+
+        Parameter stop: The pixel after the last one to change
+        Precondition: stop is an int, stop <= # of pixels
+        """
+        self._version += 1
+        dirty = self._dirty
+        self._dirty = (start,stop) if dirty is None else (min(dirty[0],start),max(dirty[1],stop))
+        if self._store is None:
+            self._materialize()
+        if not self._views or start >= stop:
+            return
+
+        for tile in range(start // TILE_SIZE, (stop-1) // TILE_SIZE + 1):
+            saved = None
+            for view in self._views:
+                if not tile in view._tiles:
+                    if saved is None:
+                        saved = self._tile(tile)
+                    view._tiles[tile] = saved
+
+    def _tile(self, tile):
+        """
+        Returns a copy of the given tile of the storage.
+
+        The copy is immutable (a tuple, bytes or a read-only array), since it
+        may be shared by several copy-on-write copies.
+
+        Parameter tile: The tile number
+        Precondition: tile is an int, 0 <= tile*TILE_SIZE < # of pixels
+        """
+        start = tile*TILE_SIZE
+        if self._backend == PACKED:
+            return bytes(self._store[3*start:3*(start+TILE_SIZE)])
+        elif self._backend == LIST:
+            return tuple(self._store[start:start+TILE_SIZE])
+
+        result = self._store[start:start+TILE_SIZE].copy()
+        result.flags.writeable = False
+        return result
+
+    def _materialize(self):
+        """
+        Gives this copy-on-write copy a private copy of its storage.
+
+        The new storage is the shared storage, with the saved tiles put back.
+        After this, this image no longer shares anything with its source.
+        """
+        if self._backend == PACKED:
+            data = bytearray(self._base)
+            for tile in self._tiles:
+                saved = self._tiles[tile]
+                start = 3*tile*TILE_SIZE
+                data[start:start+len(saved)] = saved
+        else:
+            data = self._base.copy()
+            for tile in self._tiles:
+                saved = self._tiles[tile]
+                start = tile*TILE_SIZE
+                data[start:start+len(saved)] = saved
+        self._data = data
+
+    # HISTORY SUPPORT
+    def _isCopyOf(self, image):
+        """
+        Returns True if this is a copy-on-write copy that shares image's storage.
+
+        In that case this image is exactly image with the saved tiles put back,
+        so the saved tiles are a delta from image to this one.
+
+        Parameter image: The image to check
+        Precondition: image is an Image object
+        """
+        return self._store is None and not self._source is None and self._source() is image
+
+    def _takeChanges(self):
         """
-        new_image = Image(self._data[:],self._width)
-        return new_image
+        Returns the pixels that may have changed since the last call, and forgets them.
+
+        The result is None if no pixel has changed, and otherwise a pair
+        (start,stop) such that every changed pixel is in start..stop-1. Every
+        change is recorded, but the range may include pixels that did not
+        change. Only one object should take the changes of an image, as the
+        next caller only sees what changed after this call.
+        """
+        result = self._dirty
+        self._dirty = None
+        return result
+
+    def _takeDelta(self):
+        """
+        Returns the saved tiles of this copy-on-write copy, and stops sharing.
+
+        The result is a dictionary mapping tile numbers to tile storage. This
+        image must not be used afterwards, since it has no storage left.
+        """
+        tiles = self._tiles
+        self._detach()
+        return tiles
+
+    def _applyDelta(self, width, tiles):
+        """
+        Changes this image into the one described by a delta from it.
+
+        The saved tiles are written back in place, and the width is reset.
+        This is the inverse of _takeDelta.
+
+        Parameter width: The width of the image described by the delta
+        Precondition: width is an int > 0 that evenly divides the number of pixels
+
+        Parameter tiles: The saved tiles of the delta
+        Precondition: tiles is a dictionary from tile numbers to tile storage
+        """
+        for tile in tiles:
+            self._setSpan(tile*TILE_SIZE,tiles[tile])
+        self._width = width
+        self._height = len(self) // width
+
+    def _copyWithDelta(self, width, tiles):
+        """
+        Returns a copy-on-write copy of this image with a delta applied.
+
+        The result is the image that the delta describes, but it only stores
+        the saved tiles. Like any copy-on-write copy, it keeps up to date as
+        this image changes afterwards.
+
+        Parameter width: The width of the image described by the delta
+        Precondition: width is an int > 0 that evenly divides the number of pixels
+
+        Parameter tiles: The saved tiles of the delta
+        Precondition: tiles is a dictionary from tile numbers to tile storage
+        """
+        result = self.copy()
+        result._tiles.update(tiles)
+        result._width = width
+        result._height = len(self) // width
+        return result
+
+    def _isShared(self):
+        """
+        Returns True if this is a copy-on-write copy whose source still exists.
+
+        A copy whose source has replaced (or dropped) its storage still has a
+        shared storage (_base), but no image will change it any more. Such a
+        copy is not shared in this sense, since it alone keeps _base alive.
+        """
+        return self._store is None and not self._source is None and not self._source() is None
+
+    def _memory(self):
+        """
+        Returns the (approximate) number of bytes of pixel storage this image owns.
+
+        A copy-on-write copy only owns its saved tiles, as it shares the rest.
+        If its source has gone (see _isShared), it owns the shared storage as
+        well. (If several such copies had the same source, each one counts it.)
+        """
+        if self._store is None:
+            tiles = sum(map(_nbytes,self._tiles.values()))
+            return tiles if self._isShared() else tiles+_nbytes(self._base)
+        return _nbytes(self._store)
+
+    def _detach(self):
+        """
+        Stops sharing storage with any other image.
+
+        This is called whenever the storage of this image is replaced. Copies
+        that shared the old storage keep it for themselves, since nothing will
+        change it any more. If this image was itself a copy-on-write copy, it
+        is removed from its source.
+        """
+        if self._views:
+            for view in self._views:
+                view._source = None
+        self._views = None
+
+        if not self._source is None:
+            source = self._source()
+            if not source is None and source._views:
+                source._views.discard(self)
+        self._source = None
+        self._base  = None
+        self._tiles = None
+
+
+def _nbytes(data):
+    """
+    Returns the (approximate) number of bytes used by pixel storage.
+
+    For the 'list' backend, each pixel is counted as a list slot plus a tuple
+    of 3 small ints, even though equal pixels may share a tuple.
+
+    Parameter data: The pixel storage (or a tile of it)
+    Precondition: data is valid storage (or tile storage) for some backend
+    """
+    import sys
+    if isinstance(data,(bytes,bytearray)):
+        return len(data)
+    elif isinstance(data,(list,tuple)):
+        return sys.getsizeof(data)+len(data)*sys.getsizeof((0,0,0))
+    return data.nbytes
+
+
+def _to_bytes(data):
+    """
+    Returns pixel storage (or a tile of it) as packed bytes.
+
+    Parameter data: The pixel storage
+    Precondition: data is valid storage (or tile storage) for some backend
+    """
+    import itertools
+    if isinstance(data,(bytes,bytearray)):
+        return bytes(data)
+    elif isinstance(data,(list,tuple)):
+        return bytes(itertools.chain.from_iterable(data))
+    return data.tobytes()
+
+
+def _backend_of(data):
+    """
+    Returns the backend that pixel storage (or a tile of it) belongs to.
+
+    Parameter data: The pixel storage
+    Precondition: data is valid storage (or tile storage) for some backend
+    """
+    if isinstance(data,(bytes,bytearray)):
+        return PACKED
+    elif isinstance(data,(list,tuple)):
+        return LIST
+    return NUMPY
+
+
+def _from_bytes(data, backend):
+    """
+    Returns packed bytes as a tile of the given backend (see Image._tile).
+
+    This is the inverse of _to_bytes for tiles, so the result is immutable.
+
+    Parameter data: The packed pixel bytes
+    Precondition: data is a bytes object whose length is a multiple of 3
+
+    Parameter backend: The storage format
+    Precondition: backend is one of BACKENDS
+    """
+    if backend == PACKED:
+        return bytes(data)
+    elif backend == LIST:
+        return tuple(_convert(data,PACKED,LIST))
+
+    result = _convert(data,PACKED,NUMPY)
+    result.flags.writeable = False
+    return result
+
+
+def _reorient(data, backend, width, transpose, vertical, horizontal):
+    """
+    Returns the pixel data transposed and/or reflected, and its new width.
+
+    This is Image.reorient for 'list' and 'packed' storage, without NumPy.
+    The result is new storage. A horizontal reflection is done by reversing
+    all of the storage (which also reverses the order of the rows), so it
+    takes one fewer pass if combined with a vertical one.
+
+    Parameter data: The pixel data
+    Precondition: data is valid 'list' or 'packed' storage
+
+    Parameter backend: The storage format
+    Precondition: backend is LIST or PACKED
+
+    Parameter width: The image width
+    Precondition: width is an int > 0 that evenly divides the number of pixels
+
+    Parameter transpose: Whether to transpose the image
+    Precondition: transpose is a bool
+
+    Parameter vertical: Whether to reverse the order of the rows
+    Precondition: vertical is a bool
+
+    Parameter horizontal: Whether to reverse each row
+    Precondition: horizontal is a bool
+    """
+    import itertools
+    size = 3 if backend == PACKED else 1
+    height = len(data) // (size*width)
+    if transpose:
+        if backend == PACKED:
+            # Column c becomes row c, one channel at a time
+            result = bytearray(len(data))
+            for col in range(width):
+                for channel in range(3):
+                    start = 3*col*height+channel
+                    result[start:start+3*height:3] = data[3*col+channel::3*width]
+        else:
+            result = list(itertools.chain.from_iterable(data[col::width] for col in range(width)))
+        data = result
+        width, height = height, width
+
+    if horizontal:
+        data = data[::-1]
+        if backend == PACKED:
+            # Reversing the bytes also reversed the channels in each pixel
+            result = bytearray(len(data))
+            result[0::3] = data[2::3]
+            result[1::3] = data[1::3]
+            result[2::3] = data[0::3]
+            data = result
+        vertical = not vertical
+
+    if vertical:
+        span = size*width
+        rows = (data[pos:pos+span] for pos in range(len(data)-span,-1,-span))
+        if backend == PACKED:
+            data = bytearray().join(rows)
+        else:
+            data = list(itertools.chain.from_iterable(rows))
+    elif not (transpose or horizontal):
+        data = data[:]
+    return (data, width)
+
+
+def _convert(data, source, backend):
+    """
+    Returns the pixel data converted from the source format to the backend.
+
+    The result is always a new object (the data is copied).
+
+    Parameter data: The pixel data
+    Precondition: data is valid pixel data for the source backend
+
+    Parameter source: The current storage format
+    Precondition: source is one of BACKENDS
+
+    Parameter backend: The new storage format
+    Precondition: backend is one of BACKENDS
+    """
+    import itertools
+    if backend == NUMPY:
+        numpy = _numpy()
+        assert not numpy is None, 'the numpy backend requires numpy'
+        if source == NUMPY:
+            return data.copy()
+        elif source == PACKED:
+            return numpy.frombuffer(data,dtype=numpy.uint8).reshape(-1,3).copy()
+        return numpy.array(data,dtype=numpy.uint8).reshape(-1,3)
+    elif backend == PACKED:
+        if source == NUMPY:
+            return bytearray(data.tobytes())
+        elif source == PACKED:
+            return bytearray(data)
+        return bytearray(itertools.chain.from_iterable(data))
+
+    # LIST
+    if source == NUMPY:
+        return list(map(tuple,data.tolist()))
+    elif source == PACKED:
+        channels = iter(data)
+        return list(zip(channels,channels,channels))
+    return data[:]
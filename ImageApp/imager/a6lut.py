@@ -0,0 +1,346 @@
+"""
+Lookup tables (LUTs) for the per-pixel color filters of the imager application.
+
+Many filters compute each pixel from the color of that pixel alone. Rather
+than doing the math once per pixel, we can do it once per possible input
+and look the answers up. This module supports two kinds of tables.
+
+A channel table maps each channel value (0..255) to a new value. It is a
+bytes object of length 256, and can be used for a different channel each of
+red, green and blue. Inverting, curves and levels are all channel tables.
+
+A tone table maps each pixel to a new pixel by its brightness. The
+brightness is the sum of three weighted channel values, each of which comes
+from a 256-entry table (see brightness_tables). Each new channel value is
+then int(scale*brightness). Greyscale and sepia are tone tables. As the
+tables hold exactly the products that a per-pixel loop would compute, and
+they are added in the same order, the results are the same to the bit.
+
+Tables are applied to the whole image in one pass: with NumPy fancy indexing
+if NumPy is installed, and otherwise with bytes.translate (channel tables)
+or with maps over the channel values (tone tables). The functions map_array,
+map_bytes, tone_array and tone_bytes apply tables to any part of an image, so
+that a6filter can run several filters in one pass (see Filter.fuse).
+
+Author: Adam Kadhim (ak779) and Calvin Johnson (clj78)
+Date:   November 20, 2019
+"""
+import a6image
+
+# The channel table that leaves values unchanged
+IDENTITY = bytes(range(256))
+
+# The channel table that replaces each value with its complement
+INVERT = bytes(range(255,-1,-1))
+
+# The weights of red, green and blue in the brightness of a pixel
+BRIGHTNESS = (0.3, 0.6, 0.1)
+
+# The scales of red, green and blue for greyscale and sepia tone
+GREYSCALE = (1.0, 1.0, 1.0)
+SEPIA = (1.0, 0.6, 0.4)
+
+# The brightness tables made so far (see brightness_tables)
+_TABLES = {}
+
+
+def is_table(table):
+    """
+    Returns True if table is a channel table, False otherwise.
+
+    A channel table is a bytes object of length 256.
+
+    Parameter table: The value to check
+    Precondition: NONE (table can be anything)
+    """
+    return type(table) == bytes and len(table) == 256
+
+
+def make_table(func):
+    """
+    Returns the channel table for the given function of a channel value.
+
+    Parameter func: The function to tabulate
+    Precondition: func is a function from ints 0..255 to ints 0..255
+    """
+    assert callable(func), repr(func)+' is not callable'
+    return bytes(func(value) for value in range(256))
+
+
+def levels(low, high, gamma=1.0):
+    """
+    Returns the channel table that stretches the values low..high to 0..255.
+
+    Values below low become 0, and values above high become 255. The values
+    in between are scaled to 0..1, raised to the power 1/gamma, and scaled
+    back to 0..255 (rounding to the nearest int).
+
+    Parameter low: The value that becomes black
+    Precondition: low is an int in 0..254
+
+    Parameter high: The value that becomes white
+    Precondition: high is an int, low < high <= 255
+
+    Parameter gamma: The gamma correction (1.0 is none)
+    Precondition: gamma is a number > 0
+    """
+    assert type(low) == int and 0 <= low < 255, repr(low)+' is not a valid low value'
+    assert type(high) == int and low < high <= 255, repr(high)+' is not a valid high value'
+    assert type(gamma) in [int,float] and gamma > 0, repr(gamma)+' is not a valid gamma'
+
+    def level(value):
+        value = min(max(value-low,0),high-low)/(high-low)
+        return int(round(255*value**(1/gamma)))
+    return make_table(level)
+
+
+def curve(points):
+    """
+    Returns the channel table for the curve through the given control points.
+
+    The curve is piecewise linear (rounding to the nearest int). Values
+    before the first point or after the last one are those of the nearest
+    point.
+
+    Parameter points: The control points (input, output)
+    Precondition: points is a non-empty list of pairs of ints in 0..255,
+    with inputs in increasing order
+    """
+    assert type(points) in [list,tuple] and len(points) > 0, repr(points)+' is not a list of points'
+    for point in points:
+        assert len(point) == 2 and a6image._is_pixel(tuple(point)+(0,)), repr(point)+' is not a point'
+    for pos in range(1,len(points)):
+        assert points[pos-1][0] < points[pos][0], 'the points are not in increasing order'
+
+    def interpolate(value):
+        if value <= points[0][0]:
+            return points[0][1]
+        for pos in range(1,len(points)):
+            x0, y0 = points[pos-1]
+            x1, y1 = points[pos]
+            if value <= x1:
+                return int(round(y0+(y1-y0)*(value-x0)/(x1-x0)))
+        return points[-1][1]
+    return make_table(interpolate)
+
+
+def brightness_tables(weights):
+    """
+    Returns the three 256-entry tables of weighted channel values.
+
+    Entry v of table c is weights[c]*v. The brightness of a pixel (r,g,b)
+    is then red[r]+green[g]+blue[b]. The tables are cached.
+
+    Parameter weights: The weights of red, green and blue
+    Precondition: weights is a tuple of 3 numbers >= 0
+    """
+    if not weights in _TABLES:
+        _TABLES[weights] = tuple([weight*value for value in range(256)] for weight in weights)
+    return _TABLES[weights]
+
+
+def apply(image, red, green=None, blue=None):
+    """
+    Applies channel tables to every pixel of image (in place).
+
+    If green or blue is None, that channel uses the same table as red.
+
+    Parameter image: The image to change
+    Precondition: image is an Image object
+
+    Parameter red: The channel table for red
+    Precondition: red is a channel table (see is_table)
+
+    Parameter green: The channel table for green
+    Precondition: green is a channel table or None
+
+    Parameter blue: The channel table for blue
+    Precondition: blue is a channel table or None
+    """
+    assert isinstance(image,a6image.Image), repr(image)+' is not an image'
+    green = red if green is None else green
+    blue  = red if blue is None else blue
+    tables = (red,green,blue)
+    for table in tables:
+        assert is_table(table), repr(table)+' is not a channel table'
+
+    numpy = _vectorize(image)
+    if not numpy is None:
+        map_array(image.getArray(),red,green,blue)
+    else:
+        _store(image,map_bytes(image.getBuffer(True),red,green,blue))
+
+
+def apply_tone(image, weights, scales):
+    """
+    Applies a tone table to every pixel of image (in place).
+
+    Each pixel (r,g,b) gets the brightness b = wr*r + wg*g + wb*b, where
+    (wr,wg,wb) are the weights. It is then replaced by the pixel
+    (int(sr*b), int(sg*b), int(sb*b)), where (sr,sg,sb) are the scales.
+    Values above 255 are replaced by 255.
+
+    Parameter image: The image to change
+    Precondition: image is an Image object
+
+    Parameter weights: The weights of red, green and blue in the brightness
+    Precondition: weights is a tuple of 3 numbers >= 0
+
+    Parameter scales: The scales of red, green and blue in the result
+    Precondition: scales is a tuple of 3 numbers >= 0
+    """
+    assert isinstance(image,a6image.Image), repr(image)+' is not an image'
+    for values in [weights,scales]:
+        assert type(values) == tuple and len(values) == 3, repr(values)+' is not a triple'
+        for value in values:
+            assert type(value) in [int,float] and value >= 0, repr(value)+' is not a valid factor'
+
+    numpy = _vectorize(image)
+    if not numpy is None:
+        tone_array(image.getArray(),weights,scales)
+    else:
+        _store(image,tone_bytes(image.getBuffer(True),weights,scales))
+
+
+def map_array(array, red, green=None, blue=None):
+    """
+    Applies channel tables to every pixel of a NumPy array (in place).
+
+    This is the NumPy version of apply, for any part of an image.
+
+    Parameter array: The pixels to change
+    Precondition: array is a NumPy array of uint8 whose last dimension is 3
+
+    Parameter red: The channel table for red
+    Precondition: red is a channel table (see is_table)
+
+    Parameter green: The channel table for green
+    Precondition: green is a channel table or None
+
+    Parameter blue: The channel table for blue
+    Precondition: blue is a channel table or None
+    """
+    import numpy
+    green = red if green is None else green
+    blue  = red if blue is None else blue
+    if red == green == blue:
+        array[...] = numpy.frombuffer(red,dtype=numpy.uint8)[array]
+    else:
+        tables = (red,green,blue)
+        for channel in range(3):
+            table = numpy.frombuffer(tables[channel],dtype=numpy.uint8)
+            array[...,channel] = table[array[...,channel]]
+
+
+def map_bytes(data, red, green=None, blue=None):
+    """
+    Returns packed pixels with channel tables applied to every pixel.
+
+    This is the pure Python version of apply, for any part of an image.
+
+    Parameter data: The pixels to change (see Image.getBuffer)
+    Precondition: data is a bytes-like object with 3 bytes per pixel
+
+    Parameter red: The channel table for red
+    Precondition: red is a channel table (see is_table)
+
+    Parameter green: The channel table for green
+    Precondition: green is a channel table or None
+
+    Parameter blue: The channel table for blue
+    Precondition: blue is a channel table or None
+    """
+    green = red if green is None else green
+    blue  = red if blue is None else blue
+    if red == green == blue:
+        return bytes(data).translate(red)
+    tables = (red,green,blue)
+    result = bytearray(len(data))
+    for channel in range(3):
+        result[channel::3] = bytes(data[channel::3]).translate(tables[channel])
+    return result
+
+
+def tone_array(array, weights, scales):
+    """
+    Applies a tone table to every pixel of a NumPy array (in place).
+
+    This is the NumPy version of apply_tone, for any part of an image.
+
+    Parameter array: The pixels to change
+    Precondition: array is a NumPy array of uint8 whose last dimension is 3
+
+    Parameter weights: The weights of red, green and blue in the brightness
+    Precondition: weights is a tuple of 3 numbers >= 0
+
+    Parameter scales: The scales of red, green and blue in the result
+    Precondition: scales is a tuple of 3 numbers >= 0
+    """
+    import numpy
+    tables = brightness_tables(weights)
+    brightness = numpy.asarray(tables[0])[array[...,0]]
+    brightness += numpy.asarray(tables[1])[array[...,1]]
+    brightness += numpy.asarray(tables[2])[array[...,2]]
+    for channel in range(3):
+        value = brightness if scales[channel] == 1 else scales[channel]*brightness
+        array[...,channel] = numpy.minimum(value,255)
+
+
+def tone_bytes(data, weights, scales):
+    """
+    Returns packed pixels with a tone table applied to every pixel.
+
+    This is the pure Python version of apply_tone, for any part of an image.
+
+    Parameter data: The pixels to change (see Image.getBuffer)
+    Precondition: data is a bytes-like object with 3 bytes per pixel
+
+    Parameter weights: The weights of red, green and blue in the brightness
+    Precondition: weights is a tuple of 3 numbers >= 0
+
+    Parameter scales: The scales of red, green and blue in the result
+    Precondition: scales is a tuple of 3 numbers >= 0
+    """
+    # Each step is a map over all the pixels, so the loops run in C
+    import itertools, operator
+    tables = brightness_tables(weights)
+    brightness = map(operator.add,map(tables[0].__getitem__,data[0::3]),
+                                  map(tables[1].__getitem__,data[1::3]))
+    brightness = list(map(operator.add,brightness,map(tables[2].__getitem__,data[2::3])))
+    result = bytearray(len(data))
+    for channel in range(3):
+        value = brightness if scales[channel] == 1 else map(operator.mul,itertools.repeat(scales[channel]),brightness)
+        result[channel::3] = bytes(map(min,map(int,value),itertools.repeat(255)))
+    return result
+
+
+def _vectorize(image):
+    """
+    Returns the numpy module if it should be used to change image, or None.
+
+    NumPy is used if it is installed and image is not a 'list' image (whose
+    pixels would have to be converted both ways).
+
+    Parameter image: The image to change
+    Precondition: image is an Image object
+    """
+    if image.getBackend() == a6image.LIST:
+        return None
+    return a6image._numpy()
+
+
+def _store(image, data):
+    """
+    Replaces all of the pixels of image with packed data.
+
+    Parameter image: The image to change
+    Precondition: image is an Image object
+
+    Parameter data: The new pixels (see Image.getBuffer)
+    Precondition: data is a bytes-like object with 3 bytes per pixel of image
+    """
+    if image.getBackend() == a6image.PACKED:
+        image.getBuffer()[:] = data
+    else:
+        source = a6image.Image._trusted(bytearray(data),image.getWidth(),a6image.PACKED)
+        image.setRegion(0,0,source)
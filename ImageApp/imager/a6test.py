@@ -12,13 +12,15 @@ Date:   October 29, 2019
 """
 import introcs
 import a6image
+import a6editor
+import a6lut
 import a6filter
 import a6encode
 import traceback
 
 # Helper to read the test images
 
-def load_image(file):
+def load_image(file,backend=None):
     """
     Returns an Image object for the give file in the tests folder.
 
@@ -27,6 +29,9 @@ def load_image(file):
 
     Parameter file: The image file (without the png suffix)
     Precondition: file is a string
+
+    Parameter backend: The storage format for the image (None for the default)
+    Precondition: backend is None or one of a6image.BACKENDS
     """
     import os.path
     from PIL import Image as CoreImage
@@ -36,8 +41,7 @@ def load_image(file):
     try:
         image = CoreImage.open(path)
         image = image.convert("RGB")
-        buffer = list(image.getdata())
-        size  = image.size[0]*image.size[1]
+        buffer = image.tobytes()
         width = image.size[0]
     except:
         traceback.print_exc()
@@ -47,7 +51,9 @@ def load_image(file):
     result = None
     if not buffer is None:
         try:
-            result = a6image.Image(buffer,width)
+            if backend is None:
+                backend = a6image.LIST
+            result = a6image.Image(buffer,width,backend)
         except:
             traceback.print_exc()
             result = None
@@ -95,6 +101,11 @@ def test_pixel_list():
     introcs.assert_true(a6image._is_pixel_list([(0,244,255),(100,64,255),(50,3,250)]))
     introcs.assert_false(a6image._is_pixel_list([(0,244,255),(100,'64',255),(50,3,250)]))
     introcs.assert_false(a6image._is_pixel_list([(0,244,255),(100,-64,255),(50,3,250)]))
+    introcs.assert_false(a6image._is_pixel_list([(0,244,255),(100,64,255,0),(50,3,250)]))
+    introcs.assert_false(a6image._is_pixel_list([(0,244,255),(100,True,255),(50,3,250)]))
+    introcs.assert_false(a6image._is_pixel_list([(0,244,255),(100,64.0,255),(50,3,250)]))
+    introcs.assert_false(a6image._is_pixel_list(5))
+    introcs.assert_true(a6image._is_pixel_list([]))
 
 
 def test_image_init():
@@ -298,6 +309,983 @@ def test_image_other():
     introcs.assert_error(image.swapPixels, 0, 1, 0, 'a', message='swapPixels does not enforce the precondition on column type')
     introcs.assert_error(image.swapPixels, 0, 1, 0, 8,   message='swapPixels does not enforce the precondition on column value')
 
+
+def test_image_numpy():
+    """
+    Tests the numpy backend of class Image
+    """
+    if not a6image.has_backend(a6image.NUMPY):
+        print('Skipping the numpy backend (numpy is not installed)')
+        return
+
+    import numpy
+    print('Testing image numpy backend')
+    p = [(255, 64, 0),(0, 255, 64),(64, 0, 255),(64, 255, 128),(128, 64, 255),(255, 128, 64)]
+
+    image = a6image.Image(p,2,a6image.NUMPY)
+    introcs.assert_equals(a6image.NUMPY,image.getBackend())
+    introcs.assert_equals(6,len(image))
+    introcs.assert_equals(2,image.getWidth())
+    introcs.assert_equals(3,image.getHeight())
+    introcs.assert_equals(p,image.getData())
+    for n in range(6):
+        introcs.assert_equals(p[n],image[n])
+        introcs.assert_equals(p[n],image.getPixel(n // 2, n % 2))
+        introcs.assert_equals(int,type(image[n][0]))
+
+    image[4] = (1,2,3)
+    introcs.assert_equals((1,2,3),image.getPixel(2,0))
+    image.setPixel(2,0,(255, 64, 0))
+    introcs.assert_equals((255, 64, 0),image[4])
+    introcs.assert_equals(str(a6image.Image(p[:4]+[(255, 64, 0)]+p[5:],2)),str(image))
+
+    # The array is a view of the data
+    array = image.getArray()
+    introcs.assert_equals((3,2,3),array.shape)
+    array[0,1] = (7,8,9)
+    introcs.assert_equals((7,8,9),image[1])
+    image.setWidth(3)
+    introcs.assert_equals((2,3,3),image.getArray().shape)
+
+    # So is the buffer
+    buffer = image.getBuffer()
+    introcs.assert_equals(18,len(buffer))
+    introcs.assert_equals(bytes([7,8,9]),buffer[3:6].tobytes())
+    buffer[5] = 10
+    introcs.assert_equals((7,8,10),image[1])
+
+    # Arrays can be used directly, in either shape
+    image = a6image.Image(numpy.zeros((4,5,3),dtype=numpy.uint8),5)
+    introcs.assert_equals(a6image.NUMPY,image.getBackend())
+    introcs.assert_equals(4,image.getHeight())
+    introcs.assert_equals((0,0,0),image.getPixel(3,4))
+
+    # Copies do not share data, and may change backend
+    image = a6image.Image(p,3,a6image.NUMPY)
+    copy  = image.copy()
+    introcs.assert_equals(a6image.NUMPY,copy.getBackend())
+    copy[0] = (0,0,0)
+    introcs.assert_equals(p[0],image[0])
+    copy = image.copy(a6image.LIST)
+    introcs.assert_equals(a6image.LIST,copy.getBackend())
+    introcs.assert_equals(p,copy._data)
+
+    # Test enforcement
+    introcs.assert_error(a6image.Image,p,3,'abc',message='Image does not enforce the precondition on backend')
+    introcs.assert_error(a6image.Image,numpy.zeros((4,5,3)),5,message='Image does not enforce the precondition on array type')
+    introcs.assert_error(image.__setitem__,9,(0,0,255),message='__setitem__ does not enforce the precondition on range')
+    introcs.assert_error(image.setPixel,0,0,(0,0,256),message='setPixel does not enforce the precondition on pixel value')
+
+
+def test_image_packed():
+    """
+    Tests the packed (bytearray) backend of class Image
+    """
+    import array
+    print('Testing image packed backend')
+    p = [(255, 64, 0),(0, 255, 64),(64, 0, 255),(64, 255, 128),(128, 64, 255),(255, 128, 64)]
+    b = bytearray([255,64,0, 0,255,64, 64,0,255, 64,255,128, 128,64,255, 255,128,64])
+
+    image = a6image.Image(p,2,a6image.PACKED)
+    introcs.assert_equals(a6image.PACKED,image.getBackend())
+    introcs.assert_equals(b,image._data)
+    introcs.assert_equals(6,len(image))
+    introcs.assert_equals(2,image.getWidth())
+    introcs.assert_equals(3,image.getHeight())
+    introcs.assert_equals(p,image.getData())
+    for n in range(6):
+        introcs.assert_equals(p[n],image[n])
+        introcs.assert_equals(p[n],image.getPixel(n // 2, n % 2))
+
+    # A bytearray is used directly, like a list
+    image = a6image.Image(b,3)
+    introcs.assert_equals(a6image.PACKED,image.getBackend())
+    introcs.assert_equals(id(b),id(image._data))
+    introcs.assert_equals(2,image.getHeight())
+    image[4] = (1,2,3)
+    introcs.assert_equals((1,2,3),image.getPixel(1,1))
+    introcs.assert_equals(bytearray([1,2,3]),b[12:15])
+    image.setPixel(1,1,(128, 64, 255))
+    introcs.assert_equals(str(a6image.Image(p,3)),str(image))
+    image.setWidth(6)
+    introcs.assert_equals(1,image.getHeight())
+
+    # The buffer is a view of the data (but a copy for lists)
+    buffer = image.getBuffer()
+    introcs.assert_equals(bytes(b),buffer.tobytes())
+    buffer[0] = 7
+    introcs.assert_equals((7,64,0),image[0])
+    buffer[0] = 255
+    image = a6image.Image(p,2)
+    buffer = image.getBuffer()
+    introcs.assert_equals(bytes(b),buffer.tobytes())
+    introcs.assert_false(buffer.readonly)
+    buffer[0] = 7
+    introcs.assert_equals(p,image.getData())
+    introcs.assert_true(image.getBuffer(True).readonly)
+
+    # Other buffers are copied
+    image = a6image.Image(array.array('B',b),2)
+    introcs.assert_equals(a6image.PACKED,image.getBackend())
+    introcs.assert_equals(p,image.getData())
+    image = a6image.Image(bytes(b),1)
+    introcs.assert_equals(6,image.getHeight())
+
+    # Copies do not share data, and may change backend
+    copy  = image.copy()
+    introcs.assert_equals(a6image.PACKED,copy.getBackend())
+    introcs.assert_not_equals(id(image._data), id(copy._data))
+    copy[0] = (0,0,0)
+    introcs.assert_equals(p[0],image[0])
+    copy = image.copy(a6image.LIST)
+    introcs.assert_equals(p,copy._data)
+
+    # Test enforcement
+    introcs.assert_error(a6image.Image,b[:-1],1,message='Image does not enforce the precondition on buffer size')
+    introcs.assert_error(a6image.Image,array.array('i',[1,2,3]),1,message='Image does not enforce the precondition on buffer type')
+    introcs.assert_error(a6image.Image,b,4,message='Image does not enforce the precondition width validity')
+    introcs.assert_error(image.__getitem__,6,message='__getitem__ does not enforce the precondition on range')
+    introcs.assert_error(image.__setitem__,0,(0,0,256),message='__setitem__ does not enforce the precondition on pixel value')
+    introcs.assert_error(image.setWidth,4,message='setWidth does not enforce the precondition on width validity')
+
+
+def test_image_blocks():
+    """
+    Tests the row, column and region methods in class Image (all backends)
+    """
+    print('Testing image block methods')
+    p = [(255, 64, 0),(0, 255, 64),(64, 0, 255),(64, 255, 128),(128, 64, 255),(255, 128, 64)]
+    rgb = (1,2,3)
+
+    for backend in a6image.BACKENDS:
+        if not a6image.has_backend(backend):
+            continue
+
+        image = a6image.Image(p[:],3,backend)
+        introcs.assert_equals(p[3:],image.getRow(1))
+        introcs.assert_equals([p[1],p[4]],image.getColumn(1))
+        image.setRow(0,p[3:])
+        introcs.assert_equals(p[3:]+p[3:],image.getData())
+        image.setRow(0,p[:3])
+
+        region = image.getRegion(0,1,2,2)
+        introcs.assert_equals(backend,region.getBackend())
+        introcs.assert_equals(2,region.getWidth())
+        introcs.assert_equals([p[1],p[2],p[4],p[5]],region.getData())
+        region[0] = rgb
+        introcs.assert_equals(p[1],image[1])
+
+        image.fillRegion(1,0,1,2,rgb)
+        introcs.assert_equals(p[:3]+[rgb,rgb,p[5]],image.getData())
+        image.setRegion(0,1,a6image.Image([rgb,p[0],p[1],p[2]],2))
+        introcs.assert_equals([p[0],rgb,p[0],rgb,p[1],p[2]],image.getData())
+
+        # Test enforcement
+        introcs.assert_error(image.getRow, 2, message='getRow does not enforce the precondition on row value')
+        introcs.assert_error(image.setRow, 0, p[:2], message='setRow does not enforce the precondition on row length')
+        introcs.assert_error(image.setRow, 0, [(0,0,256)]*3, message='setRow does not enforce the precondition on pixel value')
+        introcs.assert_error(image.getColumn, 'a', message='getColumn does not enforce the precondition on col type')
+        introcs.assert_error(image.getRegion, 1, 1, 2, 1, message='getRegion does not enforce the precondition on height')
+        introcs.assert_error(image.getRegion, 0, 2, 1, 2, message='getRegion does not enforce the precondition on width')
+        introcs.assert_error(image.fillRegion, 0, 0, 1, 1, (0,0), message='fillRegion does not enforce the precondition on pixel')
+        introcs.assert_error(image.setRegion, 1, 0, region, message='setRegion does not enforce the precondition on row')
+
+
+def test_image_cow():
+    """
+    Tests copy-on-write copies in class Image (all backends)
+    """
+    print('Testing image copy-on-write')
+    size = a6image.TILE_SIZE
+    p = [(n % 256, n//256 % 256, 7) for n in range(3*size)]
+    rgb = (1,2,3)
+
+    for backend in a6image.BACKENDS:
+        if not a6image.has_backend(backend):
+            continue
+
+        image = a6image.Image(p[:],size//4,backend)
+        copy  = image.copy()
+        introcs.assert_equals(None,copy._store)
+        introcs.assert_equals(len(image),len(copy))
+        introcs.assert_equals(image.getHeight(),copy.getHeight())
+
+        # Changing the original saves only the changed tiles in the copy
+        image[1] = rgb
+        image.fillRegion(image.getHeight()-1,0,1,4,rgb)
+        introcs.assert_equals([0,2],sorted(copy._tiles))
+        introcs.assert_equals(rgb,image[1])
+        introcs.assert_equals(p[1],copy[1])
+        introcs.assert_equals(p[-1],copy[len(p)-1])
+        introcs.assert_equals(p[size],copy[size])
+        introcs.assert_equals(None,copy._store)
+
+        # Copies of copies share the same storage
+        other = copy.copy()
+        image.setRow(image.getHeight()//2,[rgb]*image.getWidth())
+        introcs.assert_equals(p,other.getData())
+        introcs.assert_equals(p,copy.getData())
+
+        # Changing a copy gives it private storage
+        copy[0] = rgb
+        introcs.assert_equals(rgb,copy[0])
+        introcs.assert_equals(p[0],image[0])
+        introcs.assert_equals(p[0],other[0])
+        image[0] = rgb
+        introcs.assert_equals(p,other.getData())
+
+        # Replacing the storage leaves copies alone
+        copy = image.copy()
+        expected = image.getData()
+        image._data = a6image.Image(p,1,backend)._data
+        introcs.assert_equals(expected,copy.getData())
+
+    # The edit history stores copies before the current image
+    editor = a6editor.Editor(a6image.Image(p,size//4,a6image.PACKED))
+    editor.increment()
+    editor.getCurrent()[0] = rgb
+    editor.increment()
+    editor.getCurrent()[size] = rgb
+    introcs.assert_equals({1},set(editor._history[1]._tiles))
+    introcs.assert_true(editor.undo())
+    introcs.assert_equals(p[size],editor.getCurrent()[size])
+    introcs.assert_equals(rgb,editor.getCurrent()[0])
+    introcs.assert_true(editor.undo())
+    introcs.assert_equals(p[0],editor.getCurrent()[0])
+
+
+def test_image_display():
+    """
+    Tests the buffer that ImagePanel.blit gives to Texture.blit_buffer
+    """
+    import itertools
+    print('Testing image display buffer')
+    try:
+        import widgets
+        blit = lambda picture: widgets.ImagePanel.blit(None,picture)
+    except ImportError:
+        # Without Kivy, check the call that blit makes
+        blit = lambda picture: picture._rawBuffer()
+    p = [(n, 2*n % 256, 255-n) for n in range(15)]
+    packed = bytes(itertools.chain.from_iterable(p))
+    for backend in a6image.BACKENDS:
+        if not a6image.has_backend(backend):
+            continue
+        image = a6image.Image(p[:],5,backend)
+        for picture in [image, image.copy()]:
+            picture._takeChanges()
+            buffer = blit(picture)
+            # Kivy refuses read-only buffers, but drawing changes no pixels
+            introcs.assert_false(buffer.readonly)
+            introcs.assert_equals(packed,buffer.tobytes())
+            introcs.assert_equals(None,picture._takeChanges())
+
+    # Read-only storage is copied
+    numpy = a6image._numpy()
+    if not numpy is None:
+        array = numpy.array(p,dtype=numpy.uint8)
+        array.flags.writeable = False
+        buffer = blit(a6image.Image._trusted(array,5,a6image.NUMPY))
+        introcs.assert_false(buffer.readonly)
+        introcs.assert_equals(packed,buffer.tobytes())
+
+
+def test_editor_history():
+    """
+    Tests the delta-encoded edit history in class Editor (all backends)
+    """
+    import random
+    print('Testing editor history')
+    size = a6image.TILE_SIZE
+    p = [(n % 256, n//256 % 256, 7) for n in range(4*size)]
+    rgb = (1,2,3)
+
+    for backend in a6image.BACKENDS:
+        if not a6image.has_backend(backend):
+            continue
+
+        # Older edits are stored as deltas
+        editor = a6editor.Editor(a6image.Image(p[:],size//4,backend))
+        editor.increment()
+        editor.getCurrent()[0] = rgb
+        editor.increment()
+        editor.getCurrent()[size] = rgb
+        editor.increment()
+        introcs.assert_true(isinstance(editor._history[1],a6editor._Delta))
+        introcs.assert_equals({1},set(editor._history[1].tiles))
+        introcs.assert_true(editor.undo())
+        introcs.assert_true(editor.undo())
+        introcs.assert_equals(p[size],editor.getCurrent()[size])
+        introcs.assert_equals(rgb,editor.getCurrent()[0])
+        introcs.assert_true(editor.undo())
+        introcs.assert_equals(p,editor.getCurrent().getData())
+        introcs.assert_false(editor.undo())
+
+        # Old edits are compressed, then spilled to disk, then deleted
+        editor = a6editor.Editor(a6image.Image(p[:],size//4,backend))
+        editor.HISTORY_MEMORY = 0
+        editor.HISTORY_DISK = 100000
+        for step in range(40):
+            editor.increment()
+            editor.getCurrent()[step*97 % len(p)] = (step,step,step)
+        introcs.assert_true(isinstance(editor._history[-3],a6editor._Delta))
+        introcs.assert_true(isinstance(editor._history[-4],a6editor._Frozen))
+        introcs.assert_false(editor._history[-4].path is None)
+        introcs.assert_true(editor.getDiskUse() > 0)
+        introcs.assert_true(editor.getDiskUse() <= 100000)
+        newest = editor._history[-3].getMemory()+editor._history[-2]._memory()
+        introcs.assert_equals(newest,editor.getMemoryUse())
+        while editor.undo():
+            pass
+        introcs.assert_equals(0,editor.getDiskUse())
+        introcs.assert_equals(len(p),len(editor.getCurrent()))
+
+        editor.HISTORY_DISK = 0
+        for step in range(40):
+            editor.increment()
+            editor.getCurrent()[step] = rgb
+        introcs.assert_equals(3,len(editor._history))
+        introcs.assert_equals(0,editor.getDiskUse())
+
+        # A copy whose source replaced its storage now owns the old storage
+        image = a6image.Image(p[:],size//4,backend)
+        copy = image.copy()
+        introcs.assert_true(copy._isShared())
+        introcs.assert_equals(0,copy._memory())
+        image.reorient(True,False,False)
+        introcs.assert_false(copy._isShared())
+        introcs.assert_equals(a6image._nbytes(copy._base),copy._memory())
+        introcs.assert_equals(p,copy.getData())
+
+        # So the history counts it, and compresses it
+        editor = a6filter.Filter(a6image.Image(p[:],size//4,backend))
+        editor.REPLAY_TIME = 0
+        for step in range(8):
+            editor.increment()
+            if step % 2 == 0:
+                editor.rotateLeft()
+            else:
+                editor.invert()
+        buffers = {}
+        for entry in list(editor._history)[:-1]:
+            if isinstance(entry,a6editor._Frozen):
+                if not entry.blob is None and not isinstance(entry.blob,bytes):
+                    entry.blob = entry.blob.result()
+                buffers[id(entry)] = entry.getMemory()
+            elif isinstance(entry,a6editor._Delta):
+                buffers[id(entry)] = entry.getMemory()
+            elif not entry._store is None:
+                buffers[id(entry._store)] = a6image._nbytes(entry._store)
+            else:
+                for tile in entry._tiles.values():
+                    buffers[id(tile)] = a6image._nbytes(tile)
+                if not entry._isShared():
+                    buffers[id(entry._base)] = a6image._nbytes(entry._base)
+        introcs.assert_equals(sum(buffers.values()),editor.getMemoryUse())
+        introcs.assert_true(isinstance(editor._history[-4],a6editor._Frozen))
+
+        # Compare against a history of full copies
+        for limit, memory in [(20, a6editor.Editor.HISTORY_MEMORY), (None, 0)]:
+            test_editor_replay(p[:2*size],backend,limit,memory)
+
+
+def test_editor_replay(p,backend,limit,memory):
+    """
+    Tests class Editor against a history of full copies, with random edits
+
+    Parameter p: The pixels of the image to edit
+    Precondition: p is a pixel list whose length is a multiple of TILE_SIZE
+
+    Parameter backend: The storage format to test
+    Precondition: backend is one of a6image.BACKENDS
+
+    Parameter limit: The maximum number of edits
+    Precondition: limit is an int > 1 or None
+
+    Parameter memory: The memory limit for the edit history
+    Precondition: memory is an int >= 0
+    """
+    import random
+    size = a6image.TILE_SIZE
+    random.seed(backend)
+    editor = a6editor.Editor(a6image.Image(p[:],size//4,backend))
+    editor.MAX_HISTORY = limit
+    editor.HISTORY_MEMORY = memory
+    expected = [editor.getCurrent().getData()]
+    widths = [editor.getCurrent().getWidth()]
+    for step in range(100):
+        current = editor.getCurrent()
+        choice = random.randrange(5)
+        if choice == 0:
+            introcs.assert_equals(len(expected) > 1,editor.undo())
+            if len(expected) > 1:
+                expected.pop()
+                widths.pop()
+        else:
+            if choice != 1:     # Sometimes edit without an increment
+                editor.increment()
+                expected.append(None)
+                widths.append(None)
+            current = editor.getCurrent()
+            pos = random.randrange(len(current))
+            current[pos] = (step % 256,0,0)
+            if choice == 4:
+                current.setWidth(random.choice([size//4,size//2,size]))
+            expected[-1] = current.getData()
+            widths[-1] = current.getWidth()
+            if not limit is None and len(expected) > limit:
+                expected.pop(0)
+                widths.pop(0)
+        introcs.assert_equals(expected[-1],editor.getCurrent().getData())
+        introcs.assert_equals(widths[-1],editor.getCurrent().getWidth())
+
+    editor.clear()
+    introcs.assert_equals(p,editor.getCurrent().getData())
+
+
+def test_editor_journal():
+    """
+    Tests the journal of operations in class Editor (all backends)
+    """
+    import random
+    print('Testing editor journal')
+    size = a6image.TILE_SIZE
+    p = [(n % 256, n//32 % 256, n*7 % 256) for n in range(size//4)]
+    ops = [('invert',()), ('reflectHori',()), ('reflectVert',()), ('transpose',()),
+           ('rotateLeft',()), ('monochromify',(True,)), ('pixellate',(3,)),
+           ('encode',('hi',))]
+
+    for backend in a6image.BACKENDS:
+        if not a6image.has_backend(backend):
+            continue
+
+        # Operations are rebuilt by replay, and can be redone
+        editor = a6encode.Encoder(a6image.Image(p[:],32,backend))
+        states = [(p,32)]
+        for name, args in ops:
+            editor.increment()
+            getattr(editor,name)(*args)
+            current = editor.getCurrent()
+            states.append((current.getData(),current.getWidth()))
+        introcs.assert_true(isinstance(editor._history[3],a6editor._Replay))
+        introcs.assert_equals(('pixellate',(3,),{}),editor._journal[7].ops[0])
+        for pos in range(len(ops)-1,-1,-1):
+            introcs.assert_true(editor.undo())
+            introcs.assert_equals(states[pos][0],editor.getCurrent().getData())
+            introcs.assert_equals(states[pos][1],editor.getCurrent().getWidth())
+        introcs.assert_false(editor.undo())
+        for pos in range(1,len(ops)+1):
+            introcs.assert_true(editor.redo())
+            introcs.assert_equals(states[pos][0],editor.getCurrent().getData())
+        introcs.assert_false(editor.redo())
+
+        # Changing the image stops redo
+        editor.undo()
+        editor.getCurrent()[0] = (1,2,3)
+        introcs.assert_false(editor.redo())
+        editor.undo()
+        editor.increment()
+        introcs.assert_false(editor.redo())
+
+        # Replay uses the arguments of each call, even if they change later
+        editor = a6encode.Encoder(a6image.Image(p[:],32,backend))
+        fused = [('invert',()), ('reflectHori',())]
+        states = []
+        for step in range(3):
+            editor.increment()
+            editor.fuse(fused)
+            states.append(editor.getCurrent().getData())
+        introcs.assert_true(isinstance(editor._history[1],a6editor._Replay))
+        introcs.assert_false(editor._journal[-1].ops[0][1][0] is fused)
+        fused[0] = ('transpose',())
+        fused.append(('monochromify',(True,)))
+        for pos in [1,0]:
+            introcs.assert_true(editor.undo())
+            introcs.assert_equals(states[pos],editor.getCurrent().getData())
+        for pos in [1,2]:
+            introcs.assert_true(editor.redo())
+            introcs.assert_equals(states[pos],editor.getCurrent().getData())
+
+        # Compare random edits against a history of full copies
+        for replay in [a6editor.Editor.REPLAY_TIME, 0]:
+            random.seed(backend)
+            editor = a6encode.Encoder(a6image.Image(p[:],32,backend))
+            editor.REPLAY_TIME = replay
+            expected = [[p,32,False]]
+            redo = []
+            for step in range(60):
+                choice = random.randrange(6)
+                if choice == 0:
+                    introcs.assert_equals(len(expected) > 1,editor.undo())
+                    if len(expected) > 1:
+                        state = expected.pop()
+                        redo = redo+[state] if state[2] else []
+                elif choice == 1:
+                    introcs.assert_equals(len(redo) > 0,editor.redo())
+                    if redo:
+                        expected.append(redo.pop())
+                else:
+                    if choice != 2:     # Sometimes edit without an increment
+                        editor.increment()
+                        expected.append([None,None,True])
+                    current = editor.getCurrent()
+                    if choice == 5:
+                        current[random.randrange(len(current))] = (step,0,0)
+                        expected[-1][2] = False
+                    else:
+                        name, args = random.choice(ops)
+                        getattr(editor,name)(*args)
+                        current = editor.getCurrent()
+                    expected[-1][0] = current.getData()
+                    expected[-1][1] = current.getWidth()
+                    redo = []
+                introcs.assert_equals(expected[-1][0],editor.getCurrent().getData())
+                introcs.assert_equals(expected[-1][1],editor.getCurrent().getWidth())
+
+
+def test_lut():
+    """
+    Tests the lookup tables in module a6lut (all backends)
+    """
+    import random
+    print('Testing lookup tables')
+    introcs.assert_equals(bytes(range(256)),a6lut.IDENTITY)
+    introcs.assert_equals(255,a6lut.INVERT[0])
+    introcs.assert_true(a6lut.is_table(a6lut.make_table(lambda v: v//2)))
+    introcs.assert_false(a6lut.is_table(bytearray(256)))
+    introcs.assert_false(a6lut.is_table(b'abc'))
+
+    table = a6lut.levels(50,150)
+    introcs.assert_equals([0,0,128,255,255],[table[v] for v in [0,50,100,150,255]])
+    table = a6lut.levels(0,255,2.0)
+    introcs.assert_equals([0,180,255],[table[v] for v in [0,127,255]])
+    table = a6lut.curve([(0,0),(100,200),(255,255)])
+    introcs.assert_equals([0,100,200,228,255],[table[v] for v in [0,50,100,178,255]])
+    table = a6lut.curve([(10,20)])
+    introcs.assert_equals([20,20],[table[0],table[255]])
+
+    random.seed(10)
+    p = [(r,g,b) for r in range(0,256,17) for g in range(0,256,15) for b in range(0,256,5)]
+    p += [tuple(random.randrange(256) for c in range(3)) for n in range(1000)]
+    p = p[:len(p)-len(p) % 8]
+    for backend in a6image.BACKENDS:
+        if not a6image.has_backend(backend):
+            continue
+
+        # Channel tables
+        image = a6image.Image(p[:],8,backend)
+        a6lut.apply(image,a6lut.INVERT)
+        introcs.assert_equals([(255-r,255-g,255-b) for (r,g,b) in p],image.getData())
+        red = a6lut.levels(20,200)
+        blue = a6lut.curve([(0,255),(255,0)])
+        image = a6image.Image(p[:],8,backend)
+        a6lut.apply(image,red,None,blue)
+        introcs.assert_equals([(red[r],red[g],blue[b]) for (r,g,b) in p],image.getData())
+
+        # Tone tables give the same values as the formulas
+        for scales in [a6lut.GREYSCALE, a6lut.SEPIA, (2.0,0.5,0)]:
+            image = a6image.Image(p[:],8,backend)
+            a6lut.apply_tone(image,a6lut.BRIGHTNESS,scales)
+            expected = []
+            for (r,g,b) in p:
+                brightness = (0.3*r) + (0.6*g) + (0.1*b)
+                expected.append(tuple(min(int(s*brightness),255) for s in scales))
+            introcs.assert_equals(expected,image.getData())
+
+        # Applying a table to a copy leaves the original alone
+        image = a6image.Image(p[:],8,backend)
+        copy = image.copy()
+        editor = a6filter.Filter(copy)
+        editor.applyLUT(red)
+        introcs.assert_equals(p,image.getData())
+        introcs.assert_equals([(red[r],red[g],red[b]) for (r,g,b) in p],
+                              editor.getCurrent().getData())
+
+
+def test_geometry():
+    """
+    Tests the geometric transforms in class Filter against the reference loops
+    """
+    import itertools
+    print('Testing geometric transforms')
+    for width, height in [(7,5), (1,6), (6,1), (4,4)]:
+        p = [(n, 2*n % 256, 255-n) for n in range(width*height)]
+        for backend in a6image.BACKENDS:
+            if not a6image.has_backend(backend):
+                continue
+            for name in ['transpose','reflectHori','reflectVert','rotateLeft','rotateRight']:
+                editor = a6filter.Filter(a6image.Image(p[:],width,backend))
+                getattr(editor,name)()
+                expected = a6filter.Filter(a6image.Image(p[:],width,a6image.LIST))
+                getattr(expected,'_'+name+'Loop')()
+                introcs.assert_equals(expected.getCurrent().getWidth(),editor.getCurrent().getWidth())
+                introcs.assert_equals(expected.getCurrent().getData(),editor.getCurrent().getData())
+
+            # Every combination, and the version without NumPy
+            for flags in itertools.product([False,True],repeat=3):
+                image = a6image.Image(p[:],width,backend)
+                copy = image.copy()
+                image.reorient(*flags)
+                introcs.assert_equals(p,copy.getData())
+                grid = [p[row*width:(row+1)*width] for row in range(height)]
+                if flags[0]:
+                    grid = [list(col) for col in zip(*grid)]
+                if flags[1]:
+                    grid = grid[::-1]
+                if flags[2]:
+                    grid = [row[::-1] for row in grid]
+                expected = list(itertools.chain.from_iterable(grid))
+                introcs.assert_equals(expected,image.getData())
+                introcs.assert_equals(len(grid[0]),image.getWidth())
+                # The result owns writable storage, even with a 1-pixel side
+                image.setPixel(0,0,(1,2,3))
+                introcs.assert_equals((1,2,3),image.getPixel(0,0))
+                introcs.assert_equals(p,copy.getData())
+                if backend != a6image.NUMPY and any(flags):
+                    data = a6image._convert(p,a6image.LIST,backend)
+                    data, size = a6image._reorient(data,backend,width,*flags)
+                    introcs.assert_equals(expected,a6image._convert(data,backend,a6image.LIST))
+                    introcs.assert_equals(len(grid[0]),size)
+
+
+def test_orientation():
+    """
+    Tests that the Editor combines geometric transforms until they are needed
+    """
+    import itertools
+    print('Testing pending orientations')
+    width, height = 5, 3
+    p = [(n, 2*n % 256, 255-n) for n in range(width*height)]
+    flags = list(itertools.product([False,True],repeat=3))
+    for first in flags:
+        for second in flags:
+            image = a6image.Image(p[:],width,a6image.LIST)
+            image.reorient(*first)
+            image.reorient(*second)
+            expected = a6image.Image(p[:],width,a6image.LIST)
+            expected.reorient(*a6editor.compose(first,second))
+            introcs.assert_equals(expected.getWidth(),image.getWidth())
+            introcs.assert_equals(expected.getData(),image.getData())
+
+    for backend in a6image.BACKENDS:
+        if not a6image.has_backend(backend):
+            continue
+        # Three rotations are a single reordering
+        editor = a6filter.Filter(a6image.Image(p[:],width,backend))
+        editor.rotateRight()
+        editor.rotateRight()
+        editor.rotateLeft()
+        introcs.assert_equals(width,editor._history[-1].getWidth())
+        introcs.assert_equals(p,editor._history[-1].getData())
+        expected = a6filter.Filter(a6image.Image(p[:],width,a6image.LIST))
+        expected._rotateRightLoop()
+        introcs.assert_equals(expected.getCurrent().getWidth(),editor.getCurrent().getWidth())
+        introcs.assert_equals(expected.getCurrent().getData(),editor.getCurrent().getData())
+        introcs.assert_equals(a6editor.IDENTITY,editor._journal[-1].orientation)
+
+        # Reflections that cancel out do not touch the pixels
+        editor = a6filter.Filter(a6image.Image(p[:],width,backend))
+        store = editor._history[-1]._store
+        editor.reflectVert()
+        editor.reflectHori()
+        editor.rotateRight()
+        editor.rotateRight()
+        introcs.assert_true(editor.getCurrent()._store is store)
+        introcs.assert_equals(p,editor.getCurrent().getData())
+
+        # A 1-pixel side still leaves writable pixels behind
+        for size in [(1,5), (5,1)]:
+            line = p[:size[0]*size[1]]
+            for name in ['transpose','rotateLeft','rotateRight','reflectHori','reflectVert']:
+                editor = a6filter.Filter(a6image.Image(line[:],size[0],backend))
+                getattr(editor,name)()
+                editor.invert()
+                expected = a6filter.Filter(a6image.Image(line[:],size[0],a6image.LIST))
+                getattr(expected,'_'+name+'Loop')()
+                expected = [(255-r,255-g,255-b) for (r,g,b) in expected.getCurrent().getData()]
+                introcs.assert_equals(expected,editor.getCurrent().getData())
+
+        # Undo, redo and replay see the orientation of each edit
+        editor = a6filter.Filter(a6image.Image(p[:],width,backend))
+        images = [editor.getCurrent().copy()]
+        steps = [['rotateRight'], ['invert','transpose'], ['reflectHori','reflectVert'],
+                 ['rotateLeft'], ['monochromify']]
+        for names in steps:
+            editor.increment()
+            for name in names:
+                if name == 'monochromify':
+                    editor.monochromify(False)
+                else:
+                    getattr(editor,name)()
+            images.append(editor._history[-1].copy())
+            images[-1].reorient(*editor._journal[-1].orientation)
+        for pos in range(len(steps)-1,-1,-1):
+            introcs.assert_true(editor.undo())
+            introcs.assert_equals(images[pos].getWidth(),editor.getCurrent().getWidth())
+            introcs.assert_equals(images[pos].getData(),editor.getCurrent().getData())
+        for pos in range(1,len(steps)+1):
+            introcs.assert_true(editor.redo())
+            introcs.assert_equals(images[pos].getWidth(),editor.getCurrent().getWidth())
+            introcs.assert_equals(images[pos].getData(),editor.getCurrent().getData())
+
+
+def test_fuse():
+    """
+    Tests that fused filters give the same result as separate ones
+    """
+    print('Testing fused filters')
+    width, height = 37, 29
+    p = [(n*37 % 256, n*101 % 256, 255-n*13 % 256) for n in range(width*height)]
+    levels = a6lut.levels(20,230,1.5)
+    recipes = [[('monochromify',(True,)), ('vignette',())],
+               [('invert',()), ('monochromify',(False,)), ('vignette',()), ('invert',())],
+               [('applyLUT',(levels,)), ('invert',()), ('applyLUT',(a6lut.INVERT,levels,levels))],
+               [('vignette',()), ('rotateRight',()), ('vignette',()), ('pixellate',(4,))],
+               [('monochromify',(True,)), ('transpose',()), ('invert',())],
+               []]
+    for backend in a6image.BACKENDS:
+        if not a6image.has_backend(backend):
+            continue
+        for recipe in recipes:
+            editor = a6filter.Filter(a6image.Image(p[:],width,backend))
+            editor.fuse(recipe)
+            expected = a6filter.Filter(a6image.Image(p[:],width,backend))
+            for name, args in recipe:
+                getattr(expected,name)(*args)
+            introcs.assert_equals(expected.getCurrent().getWidth(),editor.getCurrent().getWidth())
+            introcs.assert_equals(expected.getCurrent().getData(),editor.getCurrent().getData())
+
+    # Only pointwise filters have stages
+    editor = a6filter.Filter(a6image.Image(p[:],width))
+    introcs.assert_equals(('table',(a6lut.INVERT,)*3),editor._stage('invert',()))
+    introcs.assert_equals(None,editor._stage('jail',()))
+
+
+class _ParallelFilter(a6filter.Filter):
+    """
+    A filter that splits even tiny images among two workers
+    """
+    WORKERS = 2
+
+
+def test_parallel():
+    """
+    Tests that filters run by threads or processes give the same result
+    """
+    print('Testing worker threads and processes')
+    introcs.assert_equals(a6filter.SERIAL,a6filter.Filter(a6image.Image([(0,0,0)],1))._mode())
+    if a6image._numpy() is None:
+        return
+    width, height = 23, 17
+    p = [(n*37 % 256, n*101 % 256, 255-n*13 % 256) for n in range(width*height)]
+    ops = [('invert',()), ('monochromify',(True,)), ('vignette',()),
+           ('applyLUT',(a6lut.levels(10,200),)), ('pixellate',(4,)), ('pixellate',(30,)),
+           ('fuse',([('monochromify',(False,)), ('vignette',()), ('invert',())],))]
+    for mode in [a6filter.THREADS, a6filter.PROCESSES]:
+        for backend in a6image.BACKENDS:
+            if not a6image.has_backend(backend):
+                continue
+            for name, args in ops:
+                editor = _ParallelFilter(a6image.Image(p[:],width,backend))
+                with editor.using(mode):
+                    introcs.assert_equals(mode,editor._mode())
+                    getattr(editor,name)(*args)
+                introcs.assert_true(editor.EXECUTION is None)
+                expected = a6filter.Filter(a6image.Image(p[:],width,backend))
+                getattr(expected,name)(*args)
+                introcs.assert_equals(expected.getCurrent().getData(),editor.getCurrent().getData())
+
+    # The mode follows the image size, unless it is set
+    editor = _ParallelFilter(a6image.Image(p[:],width))
+    editor.THREAD_SIZE = width*height
+    introcs.assert_equals(a6filter.THREADS,editor._mode())
+    editor.PARALLEL_SIZE = width*height
+    introcs.assert_equals(a6filter.PROCESSES,editor._mode())
+    with editor.using(a6filter.SERIAL):
+        introcs.assert_equals(a6filter.SERIAL,editor._mode())
+        introcs.assert_false(editor._parallel('invert',()))
+    introcs.assert_equals(a6filter.PROCESSES,editor._mode())
+
+    # Threads need NumPy storage, and there must be two bands
+    editor = _ParallelFilter(a6image.Image(p[:],width,a6image.LIST))
+    editor.EXECUTION = a6filter.THREADS
+    introcs.assert_false(editor._parallel('invert',()))
+    editor = _ParallelFilter(a6image.Image(p[:width],width,a6image.PACKED))
+    editor.EXECUTION = a6filter.THREADS
+    introcs.assert_false(editor._parallel('invert',()))
+
+
+def test_bench():
+    """
+    Tests the helpers of the benchmarks in module a6bench
+    """
+    import a6bench
+    print('Testing benchmark helpers')
+    image = a6image.Image([(1,2,3),(4,5,6),(7,8,9),(10,11,12)],2,a6image.PACKED)
+    large = a6bench.upscale(image,3)
+    introcs.assert_equals(6,large.getWidth())
+    introcs.assert_equals(6,large.getHeight())
+    introcs.assert_equals(a6image.PACKED,large.getBackend())
+    introcs.assert_equals((1,2,3),large.getPixel(2,2))
+    introcs.assert_equals((10,11,12),large.getPixel(3,3))
+    for mode in a6filter.MODES:
+        introcs.assert_true(a6bench.time_mode(large,mode,'invert',(),1) >= 0)
+    introcs.assert_equals([(1,2,3),(4,5,6),(7,8,9),(10,11,12)],image.getData())
+    introcs.assert_equals(4,len(a6bench.resize(image,0.000001)))
+    introcs.assert_equals(36,len(a6bench.resize(image,0.000036)))
+
+    names = [name for name, args in a6bench.operations()]
+    for name in ['invert','transpose','pixellate','vignette','fuse','encode','decode']:
+        introcs.assert_true(name in names)
+    for name in ['using','getCurrent','undo','_avg']:
+        introcs.assert_false(name in names)
+    larger = a6bench.upscale(image,5)     # jail needs a width of at least 8
+    for name, args in a6bench.operations():
+        seconds, peak = a6bench.measure(larger,name,args,1)
+        introcs.assert_true(seconds >= 0 and peak >= 0)
+
+    import contextlib, io, json, os
+    import tempfile
+
+    def suite(*args):
+        # Hide the line that suite prints for each result, but not test failures
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            results = a6bench.suite(*args)
+        return results, output.getvalue()
+
+    # Unknown samples are reported before anything runs
+    introcs.assert_true('Walker' in a6bench.sample_files())
+    errors = io.StringIO()
+    refused = False
+    with contextlib.redirect_stderr(errors):
+        try:
+            a6bench.main(['--samples','Walker,Nobody','--ops','invert'])
+        except SystemExit:
+            refused = True
+    introcs.assert_true(refused)
+    introcs.assert_true("'Nobody' is not a sample" in errors.getvalue())
+    introcs.assert_true('Walker' in errors.getvalue())
+
+    # The list backend is skipped above its size limit
+    ops = [('invert',())]
+    results, output = suite(ops,[0.01,0.02],[a6image.LIST],['Walker'],1,0.015)
+    introcs.assert_equals(1,len(results))
+    introcs.assert_equals(1,output.count('skipped'))
+    results, output = suite(ops,[0.01,0.02],[a6image.LIST],['Walker'],1,None)
+    introcs.assert_equals(2,len(results))
+    introcs.assert_equals(4,a6bench.LIST_SIZE)
+
+    with tempfile.TemporaryDirectory() as folder:
+        file = os.path.join(folder,'bench.json')
+        ops = [('invert',()),('decode',())]
+        results = suite(ops,[0.01],[a6image.PACKED],['Walker'],1)[0]
+        introcs.assert_equals(2,len(results))
+        introcs.assert_equals('invert',results[0]['operation'])
+        introcs.assert_equals('Walker',results[0]['sample'])
+        a6bench.write(results,file)
+        with open(file) as stream:
+            introcs.assert_equals(results,json.load(stream)['results'])
+        introcs.assert_equals([],a6bench.compare(results,file))
+        slower = [dict(result,seconds=2*result['seconds']+1) for result in results]
+        introcs.assert_equals(2,len(a6bench.compare(slower,file,0.5)))
+        introcs.assert_equals(0,len(a6bench.compare(slower,file,1e9)))
+
+
+def test_batch():
+    """
+    Tests the batch processing in module a6batch
+    """
+    import contextlib, io, os
+    import tempfile
+    import a6batch
+    print('Testing batch processing')
+    introcs.assert_equals(('vignette',()),a6batch.parse_op('vignette'))
+    introcs.assert_equals(('monochromify',(True,)),a6batch.parse_op('monochromify:True'))
+    introcs.assert_equals(('encode',('hi there',)),a6batch.parse_op('encode:hi there'))
+    introcs.assert_equals(('applyLUT',(b'a',None)),a6batch.parse_op("applyLUT:b'a',None"))
+    introcs.assert_equals(('pixellate',(10,)),a6batch.parse_op('pixellate: 10 '))
+    introcs.assert_equals(('applyLUT',(b'a',None)),a6batch.parse_op("applyLUT:b'a', None"))
+    introcs.assert_equals(('encode',('hello, world',)),a6batch.parse_op('encode:hello, world'))
+    introcs.assert_equals(('encode',('',)),a6batch.parse_op('encode:'))
+    for text in ['nope','decode','_avg','getCurrent']:
+        try:
+            a6batch.parse_op(text)
+            introcs.quit_with_error(repr(text)+' was accepted as an operation')
+        except ValueError:
+            pass
+
+    ops = [a6batch.parse_op('monochromify:True'), a6batch.parse_op('encode:hi')]
+
+    def batch(*args):
+        # Hide the line that run prints for each file, but not test failures
+        with contextlib.redirect_stdout(io.StringIO()):
+            return a6batch.run(*args)
+
+    with tempfile.TemporaryDirectory() as folder:
+        source = os.path.join(folder,'home.png')
+        a6batch.save(load_image('home'),source)
+        output = os.path.join(folder,'output')
+        introcs.assert_equals([source],a6batch.find_inputs(folder))
+        introcs.assert_equals(os.path.join(output,'home.png'),a6batch.output_path(source,output))
+        introcs.assert_equals([],a6batch.collisions([source],output))
+
+        # Inputs with the same output are refused
+        other = os.path.join(folder,'home.jpg')
+        a6batch.save(load_image('home'),other)
+        introcs.assert_equals([[other,source]],a6batch.collisions(a6batch.find_inputs(folder),output))
+        errors = io.StringIO()
+        refused = False
+        with contextlib.redirect_stderr(errors):
+            try:
+                a6batch.main([folder,output,'-o','invert'])
+            except SystemExit:
+                refused = True
+        introcs.assert_true(refused)
+        introcs.assert_true('home.jpg' in errors.getvalue())
+        introcs.assert_false(os.path.exists(output))
+        os.remove(other)
+
+        results = batch([source],ops,output,1)
+        introcs.assert_equals('done',results[0][1])
+        introcs.assert_equals(108*108,results[0][3])
+        editor = a6encode.Encoder(a6batch.load(a6batch.output_path(source,output)))
+        introcs.assert_equals('hi',editor.decode())
+        expected = a6encode.Encoder(load_image('home'))
+        expected.monochromify(True)
+        expected.encode('hi')
+        introcs.assert_equals(expected.getCurrent().getData(),editor.getCurrent().getData())
+
+        # Finished files are skipped, unless the recipe changes
+        target = a6batch.output_path(source,output)
+        introcs.assert_equals(a6batch.recipe(ops),a6batch.read_recipe(target))
+        introcs.assert_equals(None,a6batch.read_recipe(source))
+        introcs.assert_equals('skipped',batch([source],ops,output,1)[0][1])
+        changed = [a6batch.parse_op('invert')]
+        introcs.assert_equals('done',batch([source],changed,output,1)[0][1])
+        expected = a6encode.Encoder(load_image('home'))
+        expected.invert()
+        introcs.assert_equals(expected.getCurrent().getData(),a6batch.load(target).getData())
+        introcs.assert_equals('skipped',batch([source],changed,output,1)[0][1])
+        other = a6image.PACKED if a6image.preferred_backend() != a6image.PACKED else a6image.LIST
+        introcs.assert_equals('done',batch([source],changed,output,1,False,other)[0][1])
+        introcs.assert_equals('skipped',batch([source],changed,output,1,False,other)[0][1])
+
+        # Forced files are always done, and failures are reported
+        introcs.assert_equals('done',batch([source],ops,output,1,True)[0][1])
+        results = batch([source],[('encode',('x'*20000,False))],output,1,True)
+        introcs.assert_equals('encode failed',results[0][1])
+
+    # The command line tools do not import the GUI, PIL or NumPy until they are used
+    import subprocess, sys
+    code = ('import sys, a6batch, a6bench, a6encode, a6test, __main__; '
+            'print(sorted(set(sys.modules) & {"kivy","PIL","numpy"}))')
+    folder = os.path.dirname(os.path.abspath(__file__))
+    result = subprocess.run([sys.executable,'-c',code],cwd=folder,stdout=subprocess.PIPE,
+                            universal_newlines=True)
+    introcs.assert_equals('[]',result.stdout.strip())
+
+
 ## All of these tests hava a familiar form
 
 def compare_images(image1,image2,file1,file2):
@@ -334,7 +1322,7 @@ def compare_images(image1,image2,file1,file2):
                                   ' at ('+str(col)+','+str(row)+')')
 
 
-def test_reflect_vert():
+def test_reflect_vert(backend=None):
     """
     Tests the method reflectVert in class Filter
     """
@@ -342,8 +1330,8 @@ def test_reflect_vert():
 
     file1 = 'blocks'
     file2 = 'blocks-reflect-vertical'
-    image1 = load_image(file1)
-    image2 = load_image(file2)
+    image1 = load_image(file1,backend)
+    image2 = load_image(file2,backend)
     editor = a6filter.Filter(image1)
 
     editor.reflectVert()
@@ -351,15 +1339,15 @@ def test_reflect_vert():
 
     file1 = 'home'
     file2 = 'home-reflect-vertical'
-    image1 = load_image(file1)
-    image2 = load_image(file2)
+    image1 = load_image(file1,backend)
+    image2 = load_image(file2,backend)
     editor = a6filter.Filter(image1)
 
     editor.reflectVert()
     compare_images(editor.getCurrent(),image2,file1,file2)
 
 
-def test_monochromify():
+def test_monochromify(backend=None):
     """
     Tests the method monochromify in class Filter
     """
@@ -367,8 +1355,8 @@ def test_monochromify():
 
     file1 = 'blocks'
     file2 = 'blocks-grey'
-    image1 = load_image(file1)
-    image2 = load_image(file2)
+    image1 = load_image(file1,backend)
+    image2 = load_image(file2,backend)
     editor = a6filter.Filter(image1)
 
     editor.monochromify(False)
@@ -376,8 +1364,8 @@ def test_monochromify():
 
     file1 = 'home'
     file2 = 'home-grey'
-    image1 = load_image(file1)
-    image2 = load_image(file2)
+    image1 = load_image(file1,backend)
+    image2 = load_image(file2,backend)
     editor = a6filter.Filter(image1)
 
     editor.monochromify(False)
@@ -387,8 +1375,8 @@ def test_monochromify():
 
     file1 = 'blocks'
     file2 = 'blocks-sepia'
-    image1 = load_image(file1)
-    image2 = load_image(file2)
+    image1 = load_image(file1,backend)
+    image2 = load_image(file2,backend)
     editor = a6filter.Filter(image1)
 
     editor.monochromify(True)
@@ -396,15 +1384,15 @@ def test_monochromify():
 
     file1 = 'home'
     file2 = 'home-sepia'
-    image1 = load_image(file1)
-    image2 = load_image(file2)
+    image1 = load_image(file1,backend)
+    image2 = load_image(file2,backend)
     editor = a6filter.Filter(image1)
 
     editor.monochromify(True)
     compare_images(editor.getCurrent(),image2,file1,file2)
 
 
-def test_jail():
+def test_jail(backend=None):
     """
     Tests the method jail in class Filter
     """
@@ -412,8 +1400,8 @@ def test_jail():
 
     file1 = 'blocks'
     file2 = 'blocks-jail'
-    image1 = load_image(file1)
-    image2 = load_image(file2)
+    image1 = load_image(file1,backend)
+    image2 = load_image(file2,backend)
     editor = a6filter.Filter(image1)
 
     editor.jail()
@@ -421,15 +1409,15 @@ def test_jail():
 
     file1 = 'home'
     file2 = 'home-jail'
-    image1 = load_image(file1)
-    image2 = load_image(file2)
+    image1 = load_image(file1,backend)
+    image2 = load_image(file2,backend)
     editor = a6filter.Filter(image1)
 
     editor.jail()
     compare_images(editor.getCurrent(),image2,file1,file2)
 
 
-def test_vignette():
+def test_vignette(backend=None):
     """
     Tests the method vignette in class Filter
     """
@@ -437,8 +1425,8 @@ def test_vignette():
 
     file1 = 'blocks'
     file2 = 'blocks-vignette'
-    image1 = load_image(file1)
-    image2 = load_image(file2)
+    image1 = load_image(file1,backend)
+    image2 = load_image(file2,backend)
     editor = a6filter.Filter(image1)
 
     editor.vignette()
@@ -446,15 +1434,51 @@ def test_vignette():
 
     file1 = 'home'
     file2 = 'home-vignette'
-    image1 = load_image(file1)
-    image2 = load_image(file2)
+    image1 = load_image(file1,backend)
+    image2 = load_image(file2,backend)
     editor = a6filter.Filter(image1)
 
     editor.vignette()
     compare_images(editor.getCurrent(),image2,file1,file2)
 
-
-def test_pixellate():
+    # Odd sizes, against the pixel-by-pixel version
+    for width, height in [(7,5), (1,1), (2,9), (12,3)]:
+        p = [(n*37 % 256, n*101 % 256, 255-n*13 % 256) for n in range(width*height)]
+        editor = a6filter.Filter(a6image.Image(p[:],width,backend))
+        editor.vignette()
+        expected = a6filter.Filter(a6image.Image(p[:],width,a6image.LIST))
+        expected._vignetteLoop()
+        introcs.assert_equals(expected.getCurrent().getData(),editor.getCurrent().getData())
+
+    # Masks are shared by size, and the oldest are dropped
+    mask = a6filter.vignette_mask(7,5)
+    introcs.assert_true(a6filter.vignette_mask(7,5) is mask)
+    for width in range(1,a6filter.MASK_CACHE+1):
+        a6filter.vignette_mask(width,1)
+    introcs.assert_equals(a6filter.MASK_CACHE,len(a6filter._MASKS))
+    introcs.assert_false(a6filter.vignette_mask(7,5) is mask)
+
+    # Masks are also limited by size, and large ones are not kept at all
+    limit = a6filter.MASK_BYTES
+    try:
+        a6filter._MASKS.clear()
+        small = a6filter.vignette_mask(4,4)
+        a6filter.MASK_BYTES = 3*a6filter._mask_bytes(small)
+        introcs.assert_true(a6filter.vignette_mask(4,4) is small)
+        large = a6filter.vignette_mask(8,8)
+        introcs.assert_false((8,8) in a6filter._MASKS)
+        introcs.assert_false(a6filter.vignette_mask(8,8) is large)
+        introcs.assert_true(a6filter.vignette_mask(4,4) is small)
+        a6filter.vignette_mask(4,5)
+        a6filter.vignette_mask(4,6)
+        introcs.assert_equals([(4,5),(4,6)],list(a6filter._MASKS))
+        introcs.assert_true(sum(map(a6filter._mask_bytes,a6filter._MASKS.values()))
+                            <= a6filter.MASK_BYTES)
+    finally:
+        a6filter.MASK_BYTES = limit
+
+
+def test_pixellate(backend=None):
     """
     Tests the method pixellate in class Filter
     """
@@ -462,24 +1486,24 @@ def test_pixellate():
 
     file1 = 'blocks'
     file2 = 'blocks-pixellate-10'
-    image1 = load_image(file1)
-    image2 = load_image(file2)
+    image1 = load_image(file1,backend)
+    image2 = load_image(file2,backend)
     editor = a6filter.Filter(image1)
 
     editor.pixellate(10)
     compare_images(editor.getCurrent(),image2,file1,file2)
 
     file2 = 'blocks-pixellate-20'
-    image1 = load_image(file1)
-    image2 = load_image(file2)
+    image1 = load_image(file1,backend)
+    image2 = load_image(file2,backend)
     editor = a6filter.Filter(image1)
 
     editor.pixellate(20)
     compare_images(editor.getCurrent(),image2,file1,file2)
 
     file2 = 'blocks-pixellate-50'
-    image1 = load_image(file1)
-    image2 = load_image(file2)
+    image1 = load_image(file1,backend)
+    image2 = load_image(file2,backend)
     editor = a6filter.Filter(image1)
 
     editor.pixellate(50)
@@ -487,38 +1511,48 @@ def test_pixellate():
 
     file1 = 'home'
     file2 = 'home-pixellate-10'
-    image1 = load_image(file1)
-    image2 = load_image(file2)
+    image1 = load_image(file1,backend)
+    image2 = load_image(file2,backend)
     editor = a6filter.Filter(image1)
 
     editor.pixellate(10)
     compare_images(editor.getCurrent(),image2,file1,file2)
 
     file2 = 'home-pixellate-20'
-    image1 = load_image(file1)
-    image2 = load_image(file2)
+    image1 = load_image(file1,backend)
+    image2 = load_image(file2,backend)
     editor = a6filter.Filter(image1)
 
     editor.pixellate(20)
     compare_images(editor.getCurrent(),image2,file1,file2)
 
     file2 = 'home-pixellate-50'
-    image1 = load_image(file1)
-    image2 = load_image(file2)
+    image1 = load_image(file1,backend)
+    image2 = load_image(file2,backend)
     editor = a6filter.Filter(image1)
 
     editor.pixellate(50)
     compare_images(editor.getCurrent(),image2,file1,file2)
 
+    # Blocks cut off by the edges, and blocks larger than the image
+    for width, height in [(7,5), (1,9), (12,1)]:
+        p = [(n*37 % 256, n*101 % 256, 255-n*13 % 256) for n in range(width*height)]
+        for step in [1,2,3,4,20]:
+            editor = a6filter.Filter(a6image.Image(p[:],width,backend))
+            editor.pixellate(step)
+            expected = a6filter.Filter(a6image.Image(p[:],width,a6image.LIST))
+            expected._pixellateLoop(step)
+            introcs.assert_equals(expected.getCurrent().getData(),editor.getCurrent().getData())
+
 
-def test_encode():
+def test_encode(backend=None):
     """
     Tests the method encode in class Encoder
     """
     print('Testing method encode')
 
     # This is not a lot we can test without decode.  Just True or False
-    image = load_image('blocks')
+    image = load_image('blocks',backend)
     encoder = a6encode.Encoder(image)
 
     encoder.increment()
@@ -547,14 +1581,14 @@ def test_encode():
     introcs.assert_true(result)
 
 
-def test_decode():
+def test_decode(backend=None):
     """
     Tests the method decode in class Encoder
     """
     print('Testing method decode')
 
     # This is not a lot we can test without decode.  Just True or False
-    image = load_image('blocks')
+    image = load_image('blocks',backend)
     encoder = a6encode.Encoder(image)
     result = encoder.decode()
     introcs.assert_equals(None,result)
@@ -588,6 +1622,131 @@ def test_decode():
     introcs.assert_equals(None,result)
 
 
+def test_steganography(backend=None):
+    """
+    Tests that encode and decode match their pixel-by-pixel versions
+    """
+    print('Testing encode and decode against the pixel loops')
+    import io, zlib
+    p = [(n*37 % 256, 255-n % 7, 250+n % 6) for n in range(300)]
+    for text in ['', 'Hello 😊', 'x'*200, bytes(range(14,250)).decode('latin-1')[:90]]:
+        # Framed messages hide the same values as _encode_pixel
+        encoder = a6encode.Encoder(a6image.Image(p[:],20,backend))
+        introcs.assert_true(encoder.encode(text,False))
+        data = text.encode('utf-8')
+        expected = a6encode.Encoder(a6image.Image(p[:],20,a6image.LIST))
+        for pos, byte in enumerate(a6encode._header(len(data),zlib.crc32(data))+data):
+            expected._encode_pixel(pos,byte)
+        introcs.assert_equals(expected.getCurrent().getData(),encoder.getCurrent().getData())
+        introcs.assert_equals(text,encoder.decode())
+
+        # Legacy messages are still found
+        encoder = a6encode.Encoder(a6image.Image(p[:],20,backend))
+        introcs.assert_true(encoder._encodeLoop(text))
+        introcs.assert_equals(encoder._decodeLoop(),encoder.decode())
+        introcs.assert_equals(text,encoder.decode())
+
+    encoder = a6encode.Encoder(a6image.Image(p[:],20,backend))
+    introcs.assert_false(encoder.encode('x'*291,False))
+    introcs.assert_equals(p,encoder.getCurrent().getData())
+    introcs.assert_true(encoder.encode('x'*290,False))
+
+    # Messages are compressed when that makes them shorter (or when asked)
+    for text, compress, packed in [('x'*5000,None,True), ('abc',None,False), ('abc',True,True), ('',True,True)]:
+        encoder = a6encode.Encoder(a6image.Image(p[:],20,backend))
+        introcs.assert_true(encoder.encode(text,compress))
+        introcs.assert_equals(text,encoder.decode())
+        data = text.encode('utf-8')
+        size = len(zlib.compress(data,a6encode.LEVEL)) if packed else len(data)
+        flags, length, checksum = a6encode._read_header(encoder.getCurrent())
+        introcs.assert_equals(packed,flags == a6encode.COMPRESSED)
+        introcs.assert_equals(size,length)
+        changed = [pos for pos in range(300) if encoder.getCurrent()[pos] != p[pos]]
+        introcs.assert_true(changed[-1] < a6encode.HEADER+size)
+
+    # Streams are read and written in chunks, and a message may hold the legacy end marker
+    encoder = a6encode.Encoder(a6image.Image(p[:],20,backend))
+    encoder.CHUNK_SIZE = 7
+    data = bytes([14,213,33])*20+bytes(range(200))
+    introcs.assert_true(encoder.encodeStream(io.BytesIO(data)))
+    output = io.BytesIO()
+    introcs.assert_true(encoder.decodeStream(output))
+    introcs.assert_equals(data,output.getvalue())
+    introcs.assert_equals(None,encoder.decode())    # Not UTF-8
+    introcs.assert_false(encoder.encodeStream(io.BytesIO(bytes(291))))
+    output = io.BytesIO()
+    introcs.assert_true(encoder.decodeStream(output))
+    introcs.assert_equals(data,output.getvalue())
+    introcs.assert_true(encoder.encodeStream(io.BytesIO(bytes(5000)),True))
+    output = io.BytesIO()
+    introcs.assert_true(encoder.decodeStream(output))
+    introcs.assert_equals(bytes(5000),output.getvalue())
+
+    # The checksum catches changes to the message
+    encoder = a6encode.Encoder(a6image.Image(p[:],20,backend))
+    encoder.encode('Hello World')
+    encoder.getCurrent()[15] = (0,0,0)
+    introcs.assert_equals(None,encoder.decode())
+    introcs.assert_false(encoder.decodeStream(io.BytesIO()))
+
+    # Missing or cut off end markers, values above 255, and bad UTF-8
+    start = [(0,1,7),(0,2,8),(0,3,3),(0,4,3),(0,5,4),(1,1,3)]
+    plain = [(10,20,30)]*4
+    for tail in [[], [(0,1,4)], [(0,1,4),(2,1,3)], [(0,1,4),(2,1,5)], [(9,9,9),(0,1,4),(2,1,3),(0,3,3)],
+                 [(2,0,0),(0,1,4),(2,1,3),(0,3,3)], [(0,0,1),(0,1,4),(2,1,3),(0,3,3),(0,1,4)]]:
+        pixels = start+plain+tail
+        encoder = a6encode.Encoder(a6image.Image(pixels,len(pixels),backend))
+        expected = a6encode.Encoder(a6image.Image(pixels,len(pixels),a6image.LIST))
+        introcs.assert_equals(expected._decodeLoop(),encoder.decode())
+    introcs.assert_equals('',a6encode.Encoder(a6image.Image(start+plain,10,backend)).decode())
+    for pixels in [start[:5], plain+start, [(0,1,4)]]:
+        encoder = a6encode.Encoder(a6image.Image(pixels,len(pixels),backend))
+        introcs.assert_equals(None,encoder.decode())
+
+
+def test_decode_cache(backend=None):
+    """
+    Tests that decode only looks at the image again when the message may have changed
+    """
+    print('Testing the message cache of decode')
+    image = load_image('blocks',backend)
+    encoder = a6encode.Encoder(image)
+    introcs.assert_equals(None,encoder.decode())
+    introcs.assert_equals(10,encoder._message[2])
+
+    encoder.increment()
+    encoder.encode('Hello World')
+    introcs.assert_equals('Hello World',encoder.decode())
+    cached = encoder._message
+    introcs.assert_equals(21,cached[2])
+
+    # Changes after the message (or none at all) keep the result
+    current = encoder.getCurrent()
+    current[len(current)-1] = (1,2,3)
+    current.setPixel(current.getHeight()-1,0,(4,5,6))
+    introcs.assert_equals('Hello World',encoder.decode())
+    introcs.assert_true(encoder._message is cached)
+    introcs.assert_equals('Hello World',encoder.decode())
+    introcs.assert_true(encoder._message is cached)
+
+    # Changes to the message (or to the whole image) do not
+    pixel = current[20]
+    current[20] = (0,0,0)
+    introcs.assert_equals(None,encoder.decode())
+    introcs.assert_false(encoder._message is cached)
+    current[20] = pixel
+    introcs.assert_equals('Hello World',encoder.decode())
+    encoder.increment()
+    encoder.invert()
+    introcs.assert_equals(None,encoder.decode())
+    encoder.undo()
+    introcs.assert_equals('Hello World',encoder.decode())
+    encoder.reflectHori()
+    introcs.assert_equals(None,encoder.decode())
+    encoder.reflectHori()
+    introcs.assert_equals('Hello World',encoder.decode())
+
+
 def test_all():
     """
     Execute all of the test cases.
@@ -604,19 +1763,72 @@ def test_all():
     test_image_access()
     test_image_str()
     test_image_other()
+    test_image_packed()
+    test_image_numpy()
+    test_image_blocks()
+    test_image_cow()
+    test_image_display()
     print('Class Image passed all tests.')
     print()
 
+    print('Testing class Editor')
+    test_editor_history()
+    test_editor_journal()
+    print('Class Editor passed all tests.')
+    print()
+
+    print('Testing module a6lut')
+    test_lut()
+    print('Module a6lut passed all tests.')
+    print()
+
     print('Testing class Filter')
+    test_geometry()
+    test_orientation()
+    test_fuse()
+    test_parallel()
+    test_bench()
     test_reflect_vert()
     test_monochromify()
     test_jail()
     test_vignette()
-    #test_pixellate()         # Optional method
+    test_pixellate()
     print('Class Filter passed all tests.')
     print()
 
     print('Testing class Encoder')
     test_encode()
     test_decode()
+    test_steganography()
+    test_decode_cache()
     print('Class Encoder passed all tests.')
+    print()
+
+    print('Testing module a6batch')
+    test_batch()
+    print('Module a6batch passed all tests.')
+
+    for backend in a6image.BACKENDS:
+        if backend != a6image.LIST and a6image.has_backend(backend):
+            print()
+            test_backend(backend)
+
+
+def test_backend(backend):
+    """
+    Executes the Filter and Encoder test cases on another storage backend.
+
+    Parameter backend: The storage format for the test images
+    Precondition: backend is one of a6image.BACKENDS
+    """
+    print('Testing the '+backend+' backend')
+    test_reflect_vert(backend)
+    test_monochromify(backend)
+    test_jail(backend)
+    test_vignette(backend)
+    test_pixellate(backend)
+    test_encode(backend)
+    test_decode(backend)
+    test_steganography(backend)
+    test_decode_cache(backend)
+    print('The '+backend+' backend passed all tests.')
@@ -84,9 +84,9 @@ class InterfacePanel(BoxLayout):
         # For working with pop-ups (Hidden since not .kv aware)
         self._popup = None
         self.place_image('',self.source)
-        self.imagedrop = ImageDropDown(choices=['load','save','undo','reset'], 
+        self.imagedrop = ImageDropDown(choices=['load','save','undo','redo','reset'], 
                                        save=[self.save_image], load=[self.load_image],
-                                       undo=[self.undo], reset=[self.clear])
+                                       undo=[self.undo], redo=[self.redo], reset=[self.clear])
         self.textdrop  = TextDropDown( choices=['show','hide','code','load','save'],
                                        show=[self.show_text], hide=[self.hide_text],
                                        code=[self.encode], load=[self.load_text], 
@@ -101,12 +101,15 @@ class InterfacePanel(BoxLayout):
                                        left= [self.do_async,'rotateLeft'],
                                        right=[self.do_async,'rotateRight'],
                                        transpose=[self.do_async,'transpose'])
-        self.blockdrop = BlockDropDown(choices=['p10','p20','p50','p100', 'p200'],
+        self.blockdrop = BlockDropDown(choices=['p2','p5','p10','p20','p50','p100', 'p200','p500'],
+                                       p2=[self.do_async,'pixellate',2],
+                                       p5=[self.do_async,'pixellate',5],
                                        p10=[self.do_async,'pixellate',10],
                                        p20=[self.do_async,'pixellate',20],
                                        p50=[self.do_async,'pixellate',50],
                                        p100=[self.do_async,'pixellate',100],
-                                       p200=[self.do_async,'pixellate',200])
+                                       p200=[self.do_async,'pixellate',200],
+                                       p500=[self.do_async,'pixellate',500])
         self.async_action = None
         self.async_thread = None
         
@@ -232,8 +235,7 @@ class InterfacePanel(BoxLayout):
         try:
             image = CoreImage.open(file)
             image = image.convert("RGB")
-            buffer = list(image.getdata())
-            size  = image.size[0]*image.size[1]
+            buffer = image.tobytes()
             width = image.size[0]
         except:
             traceback.print_exc()
@@ -243,7 +245,7 @@ class InterfacePanel(BoxLayout):
         result = None
         if not buffer is None:
             try:
-                result = a6image.Image(buffer,width)
+                result = a6image.Image(buffer,width,a6image.preferred_backend())
             except:
                 traceback.print_exc()
                 result = None
@@ -309,11 +311,11 @@ class InterfacePanel(BoxLayout):
         # prepare image for saving
         from PIL import Image as CoreImage
 
-        # This worked (Unlike Kivy)!  But is slow.
+        # PIL reads the packed pixels directly (Unlike Kivy)
         current = self.workspace.getCurrent()
         try:
-            im = CoreImage.new('RGBA',(current.getWidth(),current.getHeight()))
-            im.putdata(tuple(current.getData()))
+            size = (current.getWidth(),current.getHeight())
+            im = CoreImage.frombuffer('RGB',size,current.getBuffer(True),'raw','RGB',0,1)
             im.save(filename,'PNG')
         except:
             traceback.print_exc()
@@ -493,6 +495,21 @@ class InterfacePanel(BoxLayout):
             traceback.print_exc()
             self.error('An error occurred when trying to undo')
         
+    def redo(self):
+        """
+        Redoes the last undone edit to the image.
+        
+        This method will redo the last undone edit, if it can be redone.
+        """
+        try:
+            if self.workspace.redo():
+                self.workimage.update(self.workspace.getCurrent())
+                self.decode()
+                self.canvas.ask_update()
+        except:
+            traceback.print_exc()
+            self.error('An error occurred when trying to redo')
+        
     def clear(self):
         """
         Clears all edits to the image.
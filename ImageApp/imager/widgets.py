@@ -20,7 +20,6 @@ from kivy.metrics import sp
 
 from kivy.properties import *
 
-from array import array             # Byte buffers
 from io import StringIO             # Making complex strings
 import traceback
 
@@ -182,6 +181,8 @@ class ImageDropDown(MenuDropDown):
     savechoice = ObjectProperty(None)
     # Undo one edit step
     undochoice  = ObjectProperty(None)
+    # Redo one undone edit step
+    redochoice  = ObjectProperty(None)
     # Undo all edits
     clearchoice = ObjectProperty(None)
 
@@ -271,6 +272,10 @@ class BlockDropDown(MenuDropDown):
     contains the hooks for the view properties
     """
     # These fields are 'hooks' to connect to the interface.kv file
+    # 2 pixel block
+    choice2 = ObjectProperty(None)
+    # 5 pixel block
+    choice5 = ObjectProperty(None)
     # 10 pixel block
     choice10 = ObjectProperty(None)
     # 20 pixel block
@@ -281,6 +286,8 @@ class BlockDropDown(MenuDropDown):
     choice100 = ObjectProperty(None)
     # 200 pixel block
     choice200 = ObjectProperty(None)
+    # 500 pixel block
+    choice500 = ObjectProperty(None)
 
 
 # PANELS
@@ -326,12 +333,18 @@ class ImagePanel(Widget):
         return os.path.join(dir,filename)
     
     def blit(self,picture):
-        for pos in range(len(picture)):
-            pixel = picture[pos]
-            self._blitter[pos*3  ] = pixel[0]
-            self._blitter[pos*3+1] = pixel[1]
-            self._blitter[pos*3+2] = pixel[2]
-        return self._blitter
+        """
+        Returns the pixels of picture as a buffer for Texture.blit_buffer
+        
+        For the packed and numpy backends this is a view of the picture's own
+        memory, so nothing is copied before the upload to the texture. Kivy
+        will not take a read-only buffer, so the view is writable; but it does
+        not mark any pixels as changed, since the texture only reads them.
+        
+        Parameter picture: The image to display
+        Precondition: picture is an Image object
+        """
+        return picture._rawBuffer()
     
     def setImage(self,picture):
         """
@@ -358,7 +371,6 @@ class ImagePanel(Widget):
             self.picture  = picture
             self.texture  = Texture.create(size=(picture.getWidth(), picture.getHeight()), 
                                            colorfmt='rgb', bufferfmt='ubyte')
-            self._blitter = array('B',[0]*len(picture)*3)
             self.texture.blit_buffer(self.blit(picture), colorfmt='rgb', bufferfmt='ubyte')
             self.texture.flip_vertical()
             